@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# Concurrent storage calls, so a handler that needs several independent answers waits for the
+# slowest query instead of the sum of all of them.
+#
+# Calls run on a small thread pool, each on its own pooled connection; the driver releases the GIL
+# while waiting on the network, so N round trips overlap. Sync handlers fan out with gather():
+#
+#     last_read, read_this_year = async_storage.gather(storage.last_read, lambda: storage.count_for_year(year))
+#
+# and asyncio code can await the same calls through AsyncStorage:
+#
+#     books = AsyncStorage()
+#     last_read, read_this_year = await asyncio.gather(books.last_read(), books.count_for_year(year))
+#
+# asyncio is imported by run() rather than here: it takes tens of milliseconds to import, and
+# the sync handlers, which are all the skill has, never need it.
+import functools
+import contextvars
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import database
+
+from storage import get_storage
+
+
+# One worker per pooled connection: more would only queue up waiting for a connection
+WORKERS = database.POOL_SIZE
+
+executor = None
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="storage")
+    return executor
+
+
+def gather(*calls):
+    """ Run zero-argument callables concurrently and return their results, in order.
+        Once all have finished, the exception raised by the first one that failed is re-raised. """
+    if len(calls) == 1:
+        return [calls[0]()]
+    # Each call runs in a copy of the caller's context, so it belongs to the caller's request (see telemetry)
+    futures = [get_executor().submit(contextvars.copy_context().run, call) for call in calls]
+    wait(futures)
+    return [future.result() for future in futures]
+
+
+async def run(call, *args):
+    """ Await call(*args) running on the storage thread pool """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(context.run, call, *args))
+
+
+class AsyncStorage(object):
+    """ The storage backend's methods as coroutines, e.g. await AsyncStorage().times_read("Dune") """
+    def __init__(self, storage=None):
+        self.storage = storage or get_storage()
+
+    def __getattr__(self, name):
+        method = getattr(self.storage, name)
+
+        async def call(*args):
+            return await run(method, *args)
+        return call
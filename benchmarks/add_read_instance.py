@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark: statements sent and wall-clock time per "add a read instance", comparing the INSERT +
+# set-based recompute of the book's row from all its readings with the current INSERT + constant-size
+# upsert, each in one transaction. Rereads make the recompute's grouped read grow; the upsert's doesn't.
+#
+# Runs against a local MySQL (same DB_* environment variables as the lambda function) whose
+# books table has the unique (tenant_id, title, author) key. It adds to tenant 1's library, and the
+# rows it creates are removed afterwards.
+#
+#   DB_HOST=127.0.0.1 DB_USER=root DB_PASSWORD=... python benchmarks/add_read_instance.py [adds]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import database
+import queries
+
+from converters import format_mask_converter
+
+
+BENCH_AUTHOR = "Benchmark Author"
+
+
+class CountingCursor(object):
+    """ Wraps a StatementCache and counts the statements sent through it. """
+    def __init__(self, statements):
+        self.statements = statements
+        self.count = 0
+
+    def execute(self, sql, params=()):
+        self.count += 1
+        return self.statements.execute(sql, params)
+
+    def fetchone(self):
+        return self.statements.fetchone()
+
+
+def add_recompute(mydb, cursor, reading):
+    """ INSERT + recompute of the book's row from all its readings, committed together """
+    tenant_id, title, author = reading[:3]
+    with database.transaction(mydb):
+        cursor.execute(queries.INSERT_READ_INSTANCE, reading)
+        cursor.execute(queries.REBUILD_BOOK, (tenant_id, title, author))
+    cursor.count += 1   # COMMIT
+
+
+def add_upsert(mydb, cursor, reading):
+    """ The add path as it is now: INSERT + constant-size upsert of the book's row, committed together """
+    tenant_id, title, author, year, month, unsure, read_format, context = reading
+    with database.transaction(mydb):
+        cursor.execute(queries.INSERT_READ_INSTANCE, reading)
+        cursor.execute(queries.UPSERT_BOOK, (tenant_id, title, author, year, month, unsure, year, month, format_mask_converter(read_format)))
+    cursor.count += 1   # COMMIT
+
+
+def readings(label, adds):
+    # Every title is read ten times, so nine out of ten adds are rereads
+    formats = ["Book", "Ebook", "Audiobook"]
+    for i in range(adds):
+        yield (1, "{} {}".format(label, i // 10), BENCH_AUTHOR, 2020, "Jan", "0", formats[i % 3], "context {}".format(i))
+
+
+def run(label, add, mydb, statements, adds):
+    cursor = CountingCursor(statements)
+    start = time.perf_counter()
+    for reading in readings(label, adds):
+        add(mydb, cursor, reading)
+    elapsed = time.perf_counter() - start
+    print("{:<9} {:>5.2f} statements/add  {:>8.3f} ms/add".format(label, cursor.count / adds, elapsed / adds * 1000))
+
+
+def main():
+    adds = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    mydb = database.connect()
+    statements = queries.StatementCache(mydb)
+    try:
+        run("recompute", add_recompute, mydb, statements, adds)
+        run("upsert", add_upsert, mydb, statements, adds)
+    finally:
+        cursor = mydb.cursor()
+        cursor.execute("DELETE FROM read_instances WHERE author = %s", (BENCH_AUTHOR,))
+        cursor.execute("DELETE FROM books WHERE author = %s", (BENCH_AUTHOR,))
+        mydb.commit()
+        mydb.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark: latency of N independent storage reads run one after another versus fanned out with
+# async_storage.gather() (and awaited through AsyncStorage), with a simulated network round trip.
+#
+# The reads go through the real MySQLStorage, connection pool and prepared statement cache; only
+# the driver's connection is replaced by a stand-in that sleeps for the injected latency on every
+# statement instead of talking to MySQL. Fanned out, N reads should take about
+# ceil(N / pool size) round trips instead of N.
+#
+#   python benchmarks/async_fan_out.py [latency ms] [repeats]
+import os
+import sys
+import time
+import asyncio
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cache
+import database
+import async_storage
+
+from storage import MySQLStorage
+
+
+class SlowCursor(object):
+    """ Enough of a mysql.connector prepared cursor for StatementCache, with a fixed round trip per statement """
+    def __init__(self, latency):
+        self.latency = latency
+        self.with_rows = True
+        self.rowcount = 1
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        time.sleep(self.latency)
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class SlowConnection(object):
+    in_transaction = False
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def cursor(self, prepared=False):
+        return SlowCursor(self.latency)
+
+    def ping(self, reconnect=False):
+        time.sleep(self.latency)
+
+    def close(self):
+        pass
+
+
+def reads(storage, count):
+    """ count independent reads, as zero-argument callables """
+    return [lambda year=2000 + i: storage.count_for_year(year) for i in range(count)]
+
+
+def median_ms(run, repeats):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    latency = (float(sys.argv[1]) if len(sys.argv) > 1 else 20) / 1000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    database.pool = database.ConnectionPool(connect=lambda: SlowConnection(latency))
+    cache.query_cache.size = 0      # Every read goes to the "database"
+    storage = MySQLStorage()
+    books = async_storage.AsyncStorage(storage)
+
+    def serial(count):
+        for read in reads(storage, count):
+            read()
+
+    def fanned_out(count):
+        async_storage.gather(*reads(storage, count))
+
+    def awaited(count):
+        async def run():
+            await asyncio.gather(*(books.count_for_year(2000 + i) for i in range(count)))
+        asyncio.run(run())
+
+    print("{:.0f} ms per statement, pool of {} connections".format(latency * 1000, database.POOL_SIZE))
+    print("{:>8} {:>12} {:>12} {:>12}".format("queries", "serial ms", "gather ms", "asyncio ms"))
+    fanned_out(database.POOL_SIZE)      # Open the pool's connections first
+    for count in (1, 2, 3, 4, 8):
+        print("{:>8} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+            count, median_ms(lambda: serial(count), repeats), median_ms(lambda: fanned_out(count), repeats),
+            median_ms(lambda: awaited(count), repeats)))
+
+
+if __name__ == "__main__":
+    main()
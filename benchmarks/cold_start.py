@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Cold-start benchmark for the lambda function.
+# Each run starts a fresh Python process (as a new Lambda container would) and measures:
+#   - the time to import lambda_function, from "python -X importtime"
+#   - the latency of the first lambda_handler call, replaying a recorded LaunchRequest envelope
+#   - the same, when a keep-warm ping (keep_warm.py) reached the new container first
+# and reports the median over all runs. The slowest imports of the last run are listed too.
+#
+#   python benchmarks/cold_start.py [runs] [envelope.json]
+#
+# The launch looks up the user's library, so the interpreters use a SQLite file in a temporary
+# directory (STORAGE_BACKEND=sqlite): the times don't depend on reaching RDS, and don't include
+# importing mysql.connector. A run whose response is the error answer, or whose prefetch failed,
+# stops the benchmark rather than timing the error path.
+import os
+import sys
+import json
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_ENVELOPE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "envelopes", "launch_request.json")
+
+FIRST_RESPONSE = """
+import json, sys, time
+envelope = json.load(open(sys.argv[1]))
+from lambda_function import lambda_handler
+if len(sys.argv) > 2:
+    lambda_handler({"keep_warm": True}, None)
+start = time.perf_counter()
+response = lambda_handler(envelope, None)
+print(json.dumps({"first_response_ms": (time.perf_counter() - start) * 1000,
+                  "speech": response["response"]["outputSpeech"]["ssml"]}))
+"""
+
+ERROR_SPEECH = "Sorry, please try again."                   # lambda_function.CatchAllExceptionHandler
+PREFETCH_FAILED = "Could not prefetch on launch"            # prefetch.prefetch
+
+
+class FailedRun(Exception):
+    pass
+
+
+def run_first_response(envelope, environment, options=(), arguments=()):
+    """ (first response ms, stderr) of a fresh interpreter's first lambda_handler call. Raises FailedRun if it
+        didn't answer the request properly. """
+    result = subprocess.run([sys.executable] + list(options) + ["-c", FIRST_RESPONSE, envelope] + list(arguments),
+                            cwd=ROOT, env=environment, capture_output=True, text=True, check=True)
+    output = json.loads(result.stdout.strip().splitlines()[-1])
+    if ERROR_SPEECH in output["speech"] or PREFETCH_FAILED in result.stderr:
+        raise FailedRun("The first request failed, so its time isn't the launch's:\n{}\n{}".format(
+            output["speech"], result.stderr[-2000:]))
+    return output["first_response_ms"], result.stderr
+
+
+def benchmark_environment():
+    """ The environment for the interpreters: this one's, with a SQLite library in a new temporary directory """
+    environment = dict(os.environ, STORAGE_BACKEND="sqlite", SQLITE_PATH=os.path.join(tempfile.mkdtemp(), "books.db"))
+    environment.pop("WRITE_BEHIND", None)
+    return environment
+
+
+def import_times(stderr):
+    """ {module: cumulative microseconds} from -X importtime output """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            times[fields[2].strip()] = int(fields[1])
+        except ValueError:
+            continue    # The header line
+    return times
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    envelope = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_ENVELOPE
+    environment = benchmark_environment()
+    import_ms = []
+    response_ms = []
+    warmed_ms = []
+    try:
+        for _ in range(runs):
+            milliseconds, stderr = run_first_response(envelope, environment, options=["-X", "importtime"])
+            times = import_times(stderr)
+            import_ms.append(times["lambda_function"] / 1000.0)
+            response_ms.append(milliseconds)
+            warmed_ms.append(run_first_response(envelope, environment, arguments=["keep-warm"])[0])
+    except FailedRun as error:
+        print(error)
+        return 1
+
+    print("import lambda_function  median {:>8.1f} ms  (min {:.1f}, max {:.1f})".format(
+        statistics.median(import_ms), min(import_ms), max(import_ms)))
+    print("first lambda_handler    median {:>8.1f} ms  (min {:.1f}, max {:.1f})".format(
+        statistics.median(response_ms), min(response_ms), max(response_ms)))
+    print("after keep-warm ping    median {:>8.1f} ms  (min {:.1f}, max {:.1f})".format(
+        statistics.median(warmed_ms), min(warmed_ms), max(warmed_ms)))
+    print("slowest imports (cumulative ms, last run):")
+    for module, microseconds in sorted(times.items(), key=lambda item: -item[1])[1:11]:
+        print("  {:>8.1f}  {}".format(microseconds / 1000.0, module))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
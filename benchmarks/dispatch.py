@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark: per-request dispatch overhead of the SDK's linear handler chain versus IntentRouter,
+# as the number of registered intents grows. Replays a mix of request envelopes for the skill's
+# intents and times only the step that picks the handler (no handler runs, no database).
+#
+#   python benchmarks/dispatch.py [requests]
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ask_sdk_core.utils as ask_utils
+
+from ask_sdk_core.dispatch_components import AbstractRequestHandler
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_runtime.dispatch_components import GenericRequestHandlerChain, GenericRequestMapper
+
+import lambda_function
+
+from dispatch import IntentRouter
+
+
+# Request mix, roughly how often each is spoken
+MIX = [("LaunchRequest", None)] * 4 + [
+    ("IntentRequest", "GetLastReadIntent"),
+    ("IntentRequest", "GetLastReadIntent"),
+    ("IntentRequest", "AddReadInstanceIntent"),
+    ("IntentRequest", "GetNumberOfTimesReadIntent"),
+    ("IntentRequest", "LastTimeReadIntent"),
+    ("IntentRequest", "LastTimeReadIntent"),
+    ("IntentRequest", "HowManyBooksReadDuringYearIntent"),
+    ("IntentRequest", "AMAZON.StopIntent"),
+    ("IntentRequest", "AMAZON.HelpIntent"),
+    ("SessionEndedRequest", None),
+    ]
+
+
+class SyntheticIntentHandler(AbstractRequestHandler):
+    """ Stand-in for an intent added to the skill later """
+    def __init__(self, intent_name):
+        self.intent_name = intent_name
+
+    def can_handle(self, handler_input):
+        return ask_utils.is_intent_name(self.intent_name)(handler_input)
+
+    def handle(self, handler_input):
+        return handler_input.response_builder.response
+
+
+def handler_inputs():
+    serializer = DefaultSerializer()
+    inputs = []
+    for request_type, intent_name in MIX:
+        request = {"type": request_type, "requestId": "req", "timestamp": "2021-01-15T20:00:00Z", "locale": "en-US"}
+        if intent_name:
+            request["intent"] = {"name": intent_name, "confirmationStatus": "NONE", "slots": {}}
+        envelope = {"version": "1.0",
+                    "context": {"System": {"application": {"applicationId": "app"}, "user": {"userId": "user"}}},
+                    "request": request}
+        inputs.append(HandlerInput(request_envelope=serializer.deserialize(json.dumps(envelope), RequestEnvelope)))
+    return inputs
+
+
+def mappers(extra_intents):
+    """ The skill's own routes plus extra_intents synthetic ones, as a linear chain and as a router.
+        Synthetic intents go ahead of the built-in ones in the chain, as new custom intents would. """
+    synthetic = [SyntheticIntentHandler("SyntheticIntent{}".format(i)) for i in range(extra_intents)]
+    handlers = lambda_function.router.handlers     # LaunchRequest and the six custom intents come first
+    chain = GenericRequestMapper([GenericRequestHandlerChain(handler)
+                                  for handler in handlers[:7] + synthetic + handlers[7:]])
+    router = IntentRouter()
+    router._chains = dict(lambda_function.router._chains)     # The skill's routes, without touching its router
+    for handler in synthetic:
+        router.add(handler, intent_names=[handler.intent_name])
+    return chain, router
+
+
+def per_request_us(mapper, inputs, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        mapper.get_request_handler_chain(inputs[i % len(inputs)])
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    inputs = handler_inputs()
+    print("{:>14} {:>14} {:>14}".format("extra intents", "chain us/req", "router us/req"))
+    for extra_intents in (0, 10, 50, 200):
+        chain, router = mappers(extra_intents)
+        print("{:>14} {:>14.2f} {:>14.2f}".format(
+            extra_intents, per_request_us(chain, inputs, requests), per_request_us(router, inputs, requests)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+# Load test for lambda_handler.
+# Seeds a database with synthetic books, generates request envelopes for every custom intent, and
+# replays them through lambda_handler from several threads at once, in a given mix. Reports the
+# p50/p95/p99 latency and SQL statements per request of each intent, and the overall throughput.
+#
+#   python benchmarks/load_test.py [--books N] [--requests N] [--concurrency N] [--mix Intent=weight,...]
+#                                  [--repeats N] [--mysql] [--sqlite-path PATH] [--save NAME] [--compare NAME]
+#                                  [--tolerance FRACTION] [--gate-latency]
+#
+# The books are seeded into the library of the envelopes' user. By default the database is a fresh
+# SQLite file. --sqlite-path keeps it between runs (seeding a million books takes a while): seeding
+# is skipped when that user's library already has readings. --mysql
+# runs against the DB_* database instead - point DB_NAME at a scratch database, since the test adds
+# and deletes readings.
+#
+# The requests are replayed --repeats times (3 by default), and each latency figure reported is the
+# median over the repeats, so one run disturbed by something else on the machine doesn't move it.
+#
+# --save NAME writes the results to benchmarks/baselines/NAME.json, to be committed; --compare NAME
+# prints the change from that baseline and exits non-zero if an intent runs more statements than it
+# did or has errors. Those are the same on any machine, but depend on the library's size and the
+# cache hits, so the run has to use the baseline's settings (--books, --requests, --concurrency,
+# --mix, --repeats, the backend); otherwise it exits with status 2 without comparing. Latency
+# depends on the machine and what else it's doing, so a p95 more than --tolerance (25%) above the
+# baseline's is marked "slower" but only fails the run with --gate-latency, for comparing runs
+# made on the same quiet machine.
+import os
+import sys
+import copy
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import storage
+import telemetry
+
+from converters import months_dict
+from sqlite_storage import SQLiteStorage
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE = os.path.join(HERE, "envelopes", "launch_request.json")
+BASELINES = os.path.join(HERE, "baselines")
+
+# Intent -> relative share of requests: mostly lookups, with adds and deletes balanced so the
+# database stays about the same size
+DEFAULT_MIX = "GetLastReadIntent=3,GetNumberOfTimesReadIntent=3,LastTimeReadIntent=2,HowManyBooksReadDuringYearIntent=2,AddReadInstanceIntent=1,DeleteLastReadInstanceIntent=1"
+
+MONTHS = sorted(months_dict)
+SPOKEN_FORMATS = ["print book", "kindle", "audiobook", ""]
+FORMATS = ["Book", "Ebook", "Audiobook", ""]
+CONTEXTS = ["", "", "on holiday", "for book club", "on the train"]
+YEARS = range(1995, 2025)
+AUTHORS = 5000
+
+STATEMENT_SLACK = 0.1   # More statements per request than the baseline that --compare lets through
+
+
+def synthetic_title(book):
+    return "Synthetic Book {:07d}".format(book)
+
+
+def synthetic_author(book):
+    return "Author {:04d}".format(book % AUTHORS)
+
+
+def synthetic_readings(books, seed=0, tenant_id=1):
+    """ One to three readings of each of the books, in reading order, as INSERT_READ_INSTANCE
+        parameters for the tenant's library """
+    rng = random.Random(seed)
+    readings = []
+    for book in range(books):
+        for i in range(1 + book % 3):
+            readings.append((tenant_id, synthetic_title(book), synthetic_author(book), rng.choice(YEARS),
+                             months_dict[rng.choice(MONTHS)], 0, rng.choice(FORMATS), rng.choice(CONTEXTS)))
+    rng.shuffle(readings)
+    return readings
+
+
+def seed_sqlite(books_storage, readings, batch_size=10000):
+    with books_storage.transaction() as cursor:
+        for start in range(0, len(readings), batch_size):
+            cursor.executemany(books_storage.queries.INSERT_READ_INSTANCE, readings[start:start + batch_size])
+        cursor.execute(books_storage.queries.REBUILD_TENANT_BOOKS, (books_storage.tenant_id,))
+
+
+def seed_mysql(books_storage, readings, batch_size=1000):
+    import queries
+    import database
+    import importer
+
+    connection = database.connect()
+    try:
+        cursor = connection.cursor()
+        for start in range(0, len(readings), batch_size):
+            with database.transaction(connection):
+                cursor.executemany(queries.INSERT_READ_INSTANCE, readings[start:start + batch_size])
+        cursor.close()
+        importer.rebuild_books(connection, books_storage.tenant_id)
+    finally:
+        connection.close()
+
+
+def load_envelope_template():
+    with open(TEMPLATE) as f:
+        return json.load(f)
+
+
+def envelope_user(template):
+    return template["context"]["System"]["user"]["userId"]
+
+
+def envelope(template, number, intent=None, slots=None):
+    """ A request envelope for the intent (a LaunchRequest if None), with the given slot values.
+        Slots the skill's model defines are present even when they have no value, as from the device. """
+    request_envelope = copy.deepcopy(template)
+    request_envelope["session"]["new"] = False
+    request = request_envelope["request"]
+    request["requestId"] = "amzn1.echo-api.request.load-test-{:08d}".format(number)
+    if intent is not None:
+        request["type"] = "IntentRequest"
+        request["intent"] = {
+            "name": intent,
+            "confirmationStatus": "NONE",
+            "slots": {name: dict({"name": name, "confirmationStatus": "NONE"}, **({"value": value} if value is not None else {}))
+                      for name, value in (slots or {}).items()},
+            }
+    return request_envelope
+
+
+def intent_slots(rng, intent, books):
+    """ Slot values for one request for the intent, as a user might say them """
+    book = rng.randrange(books)
+    title = synthetic_title(book).lower()
+    if intent == "AddReadInstanceIntent":
+        return {"title": title, "author": synthetic_author(book).lower(), "read_year": str(rng.choice(YEARS)),
+                "read_month": rng.choice(MONTHS), "unsure_of_date": rng.choice(["0", "0", "0", "1"]),
+                "read_format": rng.choice(SPOKEN_FORMATS), "read_context": rng.choice(CONTEXTS)}
+    if intent == "GetNumberOfTimesReadIntent":
+        return {"title": title, "author": synthetic_author(book).lower() if rng.random() < 0.5 else None}
+    if intent == "LastTimeReadIntent":
+        return {"title": title}
+    if intent == "HowManyBooksReadDuringYearIntent":
+        return {"year": str(rng.choice(YEARS)) if rng.random() < 0.8 else None}
+    return {}
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        intent, _, weight = part.partition("=")
+        weights[intent.strip()] = float(weight or 1)
+    return weights
+
+
+def generate_requests(count, mix, books, seed=0):
+    """ count (intent, envelope) pairs, with intents drawn in proportion to their weight in mix """
+    rng = random.Random(seed)
+    template = load_envelope_template()
+    intents = list(mix)
+    weights = [mix[intent] for intent in intents]
+    requests = []
+    for number in range(count):
+        intent = rng.choices(intents, weights)[0]
+        requests.append((intent, envelope(template, number, intent, intent_slots(rng, intent, books))))
+    return requests
+
+
+# The telemetry record of the request the current thread just handled
+last_record = threading.local()
+
+def collect(record):
+    """ Stands in for telemetry.emit: keeps each request's metrics instead of printing them """
+    if "_aws" in record:
+        last_record.value = record
+
+
+def handle(lambda_handler, intent, request_envelope):
+    """ (intent, milliseconds, SQL statements, failed) for one request """
+    last_record.value = None
+    start = time.perf_counter()
+    lambda_handler(request_envelope, None)
+    elapsed = (time.perf_counter() - start) * 1000
+    record = last_record.value or {}
+    return intent, elapsed, record.get("SqlStatements", 0), "Error" in record
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile of sorted values """
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+def summarize(results, seconds):
+    intents = {}
+    for intent, ms, statements, failed in results:
+        entry = intents.setdefault(intent, {"times": [], "statements": 0, "errors": 0})
+        entry["times"].append(ms)
+        entry["statements"] += statements
+        entry["errors"] += failed
+    summary = {}
+    for intent, entry in sorted(intents.items()):
+        times = sorted(entry["times"])
+        summary[intent] = {
+            "requests": len(times),
+            "p50_ms": round(percentile(times, 50), 3),
+            "p95_ms": round(percentile(times, 95), 3),
+            "p99_ms": round(percentile(times, 99), 3),
+            "statements": round(entry["statements"] / float(len(times)), 2),
+            "errors": entry["errors"],
+            }
+    return {"throughput": round(len(results) / seconds, 1), "intents": summary}
+
+
+def combine(summaries):
+    """ One summary of repeated runs: the median of each figure over the runs, and the total errors """
+    intents = {}
+    for intent in summaries[0]["intents"]:
+        entries = [summary["intents"][intent] for summary in summaries if intent in summary["intents"]]
+        intents[intent] = {key: round(statistics.median(entry[key] for entry in entries), 3)
+                           for key in ("p50_ms", "p95_ms", "p99_ms", "statements")}
+        intents[intent]["requests"] = sum(entry["requests"] for entry in entries)
+        intents[intent]["errors"] = sum(entry["errors"] for entry in entries)
+    return {"throughput": round(statistics.median(summary["throughput"] for summary in summaries), 1), "intents": intents}
+
+
+def report(summary):
+    print("{:<34}{:>9}{:>10}{:>10}{:>10}{:>12}{:>8}".format("intent", "requests", "p50 ms", "p95 ms", "p99 ms", "statements", "errors"))
+    for intent, entry in summary["intents"].items():
+        print("{:<34}{:>9}{:>10.2f}{:>10.2f}{:>10.2f}{:>12.2f}{:>8}".format(
+            intent, entry["requests"], entry["p50_ms"], entry["p95_ms"], entry["p99_ms"], entry["statements"], entry["errors"]))
+    print("throughput: {:.1f} requests/s".format(summary["throughput"]))
+
+
+def compare(summary, baseline, tolerance, gate_latency=False):
+    """ Print the change from the baseline. Returns the number of regressions: an intent that runs
+        more statements or has errors, or with gate_latency, whose p95 grew by more than tolerance (a fraction). """
+    regressions = 0
+    print("\n{:<34}{:>18}{:>22}".format("change from baseline", "p95 ms", "statements"))
+    for intent, entry in summary["intents"].items():
+        before = baseline["intents"].get(intent)
+        if before is None:
+            print("{:<34}{:>18}".format(intent, "new"))
+            continue
+        change = (entry["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+        # Statements per request vary a little between runs with query cache hits
+        slower = change > tolerance
+        regressed = ((gate_latency and slower) or entry["statements"] > before["statements"] + STATEMENT_SLACK or
+                     entry["errors"] > before["errors"])
+        regressions += regressed
+        print("{:<34}{:>9.2f} ({:+4.0%}){:>11.2f} -> {:<6.2f}{}".format(
+            intent, entry["p95_ms"], change, before["statements"], entry["statements"],
+            "  REGRESSION" if regressed else "  slower" if slower else ""))
+    print("throughput: {:.1f} -> {:.1f} requests/s".format(baseline["throughput"], summary["throughput"]))
+    return regressions
+
+
+def config_differences(baseline_config, config):
+    """ ["books 10000 in the baseline, 2000 now", ...] for each setting the runs differ in """
+    return ["{} {} in the baseline, {} now".format(key, baseline_config.get(key), config.get(key))
+            for key in sorted(set(baseline_config) | set(config)) if baseline_config.get(key) != config.get(key)]
+
+
+def baseline_path(name):
+    return os.path.join(BASELINES, name + ".json")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", type=int, default=10000, help="Synthetic books to seed an empty database with")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Comma-separated Intent=weight")
+    parser.add_argument("--repeats", type=int, default=3, help="Times to replay the requests; latencies are the median over them")
+    parser.add_argument("--mysql", action="store_true", help="Run against the MySQL database in DB_*")
+    parser.add_argument("--sqlite-path", help="SQLite file to use (and keep) instead of a temporary one")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the data and the requests")
+    parser.add_argument("--save", metavar="NAME", help="Save the results as baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare with baselines/NAME.json")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="p95 growth --compare marks as slower, as a fraction")
+    parser.add_argument("--gate-latency", action="store_true", help="Make --compare fail when an intent is slower too")
+    args = parser.parse_args(argv[1:])
+
+    if args.mysql:
+        books_storage = storage.MySQLStorage()
+    else:
+        books_storage = SQLiteStorage(args.sqlite_path or os.path.join(tempfile.mkdtemp(), "books.db"))
+    storage.storage = books_storage
+
+    library = books_storage.for_user(envelope_user(load_envelope_template()))
+    if library.last_read() is None:
+        start = time.perf_counter()
+        readings = synthetic_readings(args.books, args.seed, library.tenant_id)
+        if args.mysql:
+            seed_mysql(library, readings)
+        else:
+            seed_sqlite(library, readings)
+        print("seeded {} books ({} readings) in {:.1f}s".format(args.books, len(readings), time.perf_counter() - start))
+    else:
+        print("using the books already in the database")
+
+    mix = parse_mix(args.mix)
+    requests = generate_requests(args.requests, mix, args.books, args.seed)
+
+    # Every request is measured, and its metrics kept rather than logged
+    telemetry.METRICS_SAMPLE_RATE = 1.0
+    telemetry.emit = collect
+    from lambda_function import lambda_handler
+
+    # Warm up: the first request of each intent pays for cold caches (e.g. loading the title index)
+    for intent, request_envelope in {intent: request_envelope for intent, request_envelope in requests}.items():
+        handle(lambda_handler, intent, request_envelope)
+
+    summaries = []
+    for repeat in range(args.repeats):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(lambda request: handle(lambda_handler, *request), requests))
+        summaries.append(summarize(results, time.perf_counter() - start))
+    summary = combine(summaries)
+    summary["config"] = {"backend": "mysql" if args.mysql else "sqlite", "books": args.books, "requests": args.requests,
+                         "concurrency": args.concurrency, "mix": mix, "repeats": args.repeats}
+    report(summary)
+
+    status = 0
+    if args.compare:
+        with open(baseline_path(args.compare)) as f:
+            baseline = json.load(f)
+        differences = config_differences(baseline["config"], summary["config"])
+        if differences:
+            print("\nerror: can't compare with {}, which was run differently: {}".format(args.compare, "; ".join(differences)))
+            status = 2
+        else:
+            status = 1 if compare(summary, baseline, args.tolerance, args.gate_latency) else 0
+    if args.save:
+        if not os.path.isdir(BASELINES):
+            os.makedirs(BASELINES)
+        with open(baseline_path(args.save), "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("saved {}".format(baseline_path(args.save)))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+# Micro-benchmark: str.format-built SQL (text protocol, parsed on every call) versus
+# the prepared statements in queries.py (parsed once per connection).
+#
+# Runs against a local MySQL that already has the books/read_instances tables, using the
+# same DB_* environment variables as the lambda function:
+#
+#   DB_HOST=127.0.0.1 DB_USER=root DB_PASSWORD=... python benchmarks/prepared_statements.py [iterations]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import database
+import queries
+
+
+def formatted_lookups(cursor, title, year):
+    cursor.execute("SELECT times_read FROM books WHERE tenant_id = 1 AND title LIKE '%{}%'".format(title))
+    cursor.fetchall()
+    cursor.execute("SELECT COUNT(*) FROM read_instances WHERE tenant_id = 1 AND read_year = {}".format(year))
+    cursor.fetchall()
+    cursor.execute("SELECT title, author FROM read_instances WHERE id = (SELECT MAX(id) FROM read_instances WHERE tenant_id = 1)")
+    cursor.fetchall()
+
+
+def prepared_lookups(statements, title, year):
+    statements.execute(*queries.times_read_query(1, title))
+    statements.fetchall()
+    statements.execute(queries.COUNT_FOR_YEAR, (1, year))
+    statements.fetchall()
+    statements.execute(queries.LAST_READ, (1,))
+    statements.fetchall()
+
+
+def timed(label, iterations, run):
+    start = time.perf_counter()
+    for i in range(iterations):
+        run(i)
+    elapsed = time.perf_counter() - start
+    print("{:<10} {:>8.3f} ms/request  ({} requests, {:.2f} s)".format(
+        label, elapsed / iterations * 1000, iterations, elapsed))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    titles = ["Dune", "The Hobbit", "Nineteen Eighty-Four", "Emma"]
+    connection = database.connect()
+    try:
+        cursor = connection.cursor()
+        statements = queries.StatementCache(connection)
+
+        # Warm up both paths once so the first prepare isn't counted
+        formatted_lookups(cursor, titles[0], 2020)
+        prepared_lookups(statements, titles[0], 2020)
+
+        timed("formatted", iterations, lambda i: formatted_lookups(cursor, titles[i % len(titles)], 2000 + i % 20))
+        timed("prepared", iterations, lambda i: prepared_lookups(statements, titles[i % len(titles)], 2000 + i % 20))
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
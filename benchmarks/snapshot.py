@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# Footprint and speed of the library snapshot (snapshot.py).
+# For each library size, seeds a temporary SQLite database with synthetic books, exports a snapshot
+# and reports the file size, load time and Python heap the loaded snapshot takes (the numeric
+# columns are mapped from the file, so they're counted in the file size instead), then times the
+# read intents' lookups from the snapshot against SQL with the query cache off, and checks the
+# two give the same answers.
+#
+#   python benchmarks/snapshot.py [books ...]       (default: 10000 100000)
+import os
+import sys
+import time
+import random
+import tempfile
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cache
+import snapshot
+
+from load_test import synthetic_readings, synthetic_title, synthetic_author, seed_sqlite
+from sqlite_storage import SQLiteStorage
+
+
+def median_ms(call, arguments):
+    times = []
+    for args in arguments:
+        start = time.perf_counter()
+        call(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def measure(books):
+    directory = tempfile.mkdtemp()
+    storage = SQLiteStorage(os.path.join(directory, "books.db"))
+    seed_sqlite(storage, synthetic_readings(books))
+    path = os.path.join(directory, "books.snapshot")
+
+    start = time.perf_counter()
+    snapshot.export(storage, path)
+    export_ms = (time.perf_counter() - start) * 1000
+
+    load_times = []
+    for i in range(5):
+        start = time.perf_counter()
+        snapshot.Library(path)
+        load_times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    library = snapshot.Library(path)
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    rng = random.Random(1)
+    lookups = []
+    for i in range(200):
+        book = rng.randrange(books)
+        title = synthetic_title(book)[-6:]      # Part of the title, as said
+        lookups.append((title, synthetic_author(book) if i % 2 else None))
+    years = [(year,) for year in range(1995, 2025)]
+
+    cache.query_cache.size = 0
+    mismatches = [args for args in lookups if library.times_read(*args) != storage.times_read(*args)]
+    mismatches += [args for args in years if library.count_for_year(*args) != storage.count_for_year(*args)]
+    if library.last_read() != storage.last_read():
+        mismatches.append(("last_read",))
+    print("{} books: snapshot {:.0f} KB, exported in {:.0f} ms, loads in {:.1f} ms using {:.0f} KB of Python heap".format(
+        books, os.path.getsize(path) / 1024.0, export_ms, statistics.median(load_times) * 1000, heap / 1024.0))
+    print("  {:<16}{:>12}{:>12}".format("median ms", "snapshot", "sqlite"))
+    print("  {:<16}{:>12.4f}{:>12.4f}".format("times_read", median_ms(library.times_read, lookups), median_ms(storage.times_read, lookups)))
+    print("  {:<16}{:>12.4f}{:>12.4f}".format("count_for_year", median_ms(library.count_for_year, years), median_ms(storage.count_for_year, years)))
+    print("  {:<16}{:>12.4f}{:>12.4f}".format("last_read", median_ms(library.last_read, [()] * 200), median_ms(storage.last_read, [()] * 200)))
+    cache.query_cache.size = cache.CACHE_SIZE
+    for args in mismatches:
+        print("  snapshot and SQL disagree on {}".format(args))
+    storage.close()
+    return len(mismatches)
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or [10000, 100000]
+    mismatches = sum(measure(books) for books in sizes)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
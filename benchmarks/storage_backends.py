@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+# Conformance check and latency benchmark for the storage backends.
+# Runs the same scenario against each backend and fails if any answer differs from what the skill
+# expects, then times each intent's storage call with the query cache turned off.
+#
+#   python benchmarks/storage_backends.py [--mysql] [--iterations N]
+#
+# SQLite always runs, on a temporary file. --mysql also runs the MySQL backend, using the DB_*
+# settings - point DB_NAME at an empty scratch database: the check refuses to run on one with
+# readings in it, and deletes the readings it adds when it's done. tests/test_storage_backends.py
+# runs check_conformance under pytest.
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cache
+import snapshot
+import title_index
+
+from storage import MySQLStorage
+from sqlite_storage import SQLiteStorage
+
+
+READINGS = [
+    # title, author, year, month, unsure, read_format, context
+    ("Dune", "Frank Herbert", "2019", "Jan", "0", "Ebook", "on a train"),
+    ("Emma", "Jane Austen", "2019", "May", "0", "Book", ""),
+    ("Dune", "Frank Herbert", "2020", "Mar", "1", "Audiobook", "at the gym"),
+    ("The 100% Solution", "A. Writer", "2020", "", "0", "", ""),
+]
+
+
+def reset_caches():
+    """ Forget everything cached from the previous backend """
+    cache.query_cache.clear()
+    title_index.loaded.clear()
+    snapshot.loaded.clear()
+
+
+def expect(failures, name, actual, expected):
+    if actual != expected:
+        failures.append("{}: expected {!r}, got {!r}".format(name, expected, actual))
+
+
+def check_conformance(storage):
+    """ Run the scenario on an empty database. Returns a description of every wrong answer. """
+    reset_caches()
+    failures = []
+    if storage.last_read() is not None:
+        return ["database isn't empty - run the check on a scratch database"]
+
+    for reading in READINGS:
+        storage.add_read_instance(*reading)
+
+    expect(failures, "last_read", storage.last_read(), ("The 100% Solution", "A. Writer"))
+    expect(failures, "times_read", storage.times_read("Dune"), 2)
+    expect(failures, "times_read by author", storage.times_read("dune", "herbert"), 2)
+    expect(failures, "times_read missing", storage.times_read("Middlemarch"), None)
+    expect(failures, "times_read wildcard", storage.times_read("100%"), 1)
+    expect(failures, "times_read escaped wildcard", storage.times_read("1_0"), None)
+    expect(failures, "count_for_year", storage.count_for_year(2020), 2)
+    expect(failures, "count_for_year as text", storage.count_for_year("2019"), 2)
+    expect(failures, "count_for_year empty", storage.count_for_year(1999), 0)
+    expect(failures, "last_time_read", [tuple(row) for row in storage.last_time_read("dune")], [("Dune", 2020, "Mar")])
+    expect(failures, "readings_in_year", [tuple(row[1:]) for row in storage.readings_in_year(2020, 0, 5)],
+           [("Dune", "Frank Herbert"), ("The 100% Solution", "A. Writer")])
+    first = storage.readings_in_year(2020, 0, 1)
+    expect(failures, "readings_in_year next page", [tuple(row[1:]) for row in storage.readings_in_year(2020, first[0][0], 5)],
+           [("The 100% Solution", "A. Writer")])
+    expect(failures, "books_by_author", [tuple(row) for row in storage.books_by_author("jane austen", "", 5)], [("Emma", "Jane Austen")])
+    expect(failures, "books_by_author next page", [tuple(row) for row in storage.books_by_author("Jane Austen", "Emma", 5)], [])
+
+    expect(failures, "books row", storage.book("Dune", "Frank Herbert"),
+           ("Dune", "Frank Herbert", 2019, "Jan", 0, 2020, "Mar", 2, "Ebook/Audio", "on a train -- at the gym"))
+
+    # Another user's library is separate, both ways
+    other = storage.for_user("amzn1.ask.account.CONFORMANCE")
+    expect(failures, "other tenant", other.tenant_id != storage.tenant_id, True)
+    expect(failures, "other tenant's last_read", other.last_read(), None)
+    expect(failures, "other tenant's times_read", other.times_read("Dune"), None)
+    expect(failures, "other tenant's count_for_year", other.count_for_year(2020), 0)
+    other.add_read_instance(*READINGS[0])
+    expect(failures, "other tenant's books row", other.book("Dune", "Frank Herbert"),
+           ("Dune", "Frank Herbert", 2019, "Jan", 0, 2019, "Jan", 1, "Ebook", "on a train"))
+    expect(failures, "last_read beside other tenant", storage.last_read(), ("The 100% Solution", "A. Writer"))
+    expect(failures, "times_read beside other tenant", storage.times_read("Dune"), 2)
+    expect(failures, "other tenant's delete", other.delete_last_read_instance(), ("Dune", "Frank Herbert"))
+    expect(failures, "other tenant's delete when empty", other.delete_last_read_instance(), None)
+
+    expect(failures, "delete", storage.delete_last_read_instance(), ("The 100% Solution", "A. Writer"))
+    expect(failures, "delete", storage.delete_last_read_instance(), ("Dune", "Frank Herbert"))
+    expect(failures, "times_read after delete", storage.times_read("Dune"), 1)
+    expect(failures, "count_for_year after delete", storage.count_for_year(2020), 0)
+    expect(failures, "last_read after delete", storage.last_read(), ("Emma", "Jane Austen"))
+    expect(failures, "last_time_read after delete", [tuple(row) for row in storage.last_time_read("dune")], [("Dune", 2019, "Jan")])
+    expect(failures, "books row after delete", storage.book("Dune", "Frank Herbert"),
+           ("Dune", "Frank Herbert", 2019, "Jan", 0, 2019, "Jan", 1, "Ebook", "on a train"))
+
+    while storage.delete_last_read_instance() is not None:
+        pass
+    expect(failures, "empty again", storage.last_read(), None)
+    expect(failures, "books row of unread book", storage.book("Emma", "Jane Austen"), None)
+    expect(failures, "delete when empty", storage.delete_last_read_instance(), None)
+    return failures
+
+
+def median_ms(call, iterations):
+    times = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def benchmark(storage, iterations):
+    """ Median milliseconds per storage call for each intent, with the query cache off """
+    reset_caches()
+    cache.query_cache.size = 0
+    try:
+        for reading in READINGS:
+            storage.add_read_instance(*reading)
+        results = [
+            ("GetLastRead", median_ms(storage.last_read, iterations)),
+            ("GetNumberOfTimesRead", median_ms(lambda: storage.times_read("Dune"), iterations)),
+            ("HowManyBooksReadDuringYear", median_ms(lambda: storage.count_for_year(2020), iterations)),
+            ("LastTimeRead", median_ms(lambda: storage.last_time_read("dune"), iterations)),
+            ("AddReadInstance + Delete", median_ms(lambda: (storage.add_read_instance(*READINGS[1]),
+                                                            storage.delete_last_read_instance()), iterations)),
+            ]
+        while storage.delete_last_read_instance() is not None:
+            pass
+    finally:
+        cache.query_cache.size = cache.CACHE_SIZE
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mysql", action="store_true", help="Also run against the MySQL database in DB_*")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args(argv[1:])
+
+    directory = tempfile.mkdtemp()
+    backends = [("sqlite", SQLiteStorage(os.path.join(directory, "books.db")))]
+    if args.mysql:
+        backends.append(("mysql", MySQLStorage()))
+
+    failed = False
+    for name, storage in backends:
+        failures = check_conformance(storage)
+        for failure in failures:
+            print("{}: {}".format(name, failure))
+        print("{}: {}".format(name, "conforms" if not failures else "{} failure(s)".format(len(failures))))
+        failed = failed or bool(failures)
+
+    if failed:
+        return 1
+
+    print("\n{:<28}".format("median ms per call") + "".join("{:>10}".format(name) for name, storage in backends))
+    results = [benchmark(storage, args.iterations) for name, storage in backends]
+    for i, (intent, ms) in enumerate(results[0]):
+        print("{:<28}".format(intent) + "".join("{:>10.3f}".format(result[i][1]) for result in results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# Per-tenant latency as the number of tenants grows.
+# Seeds a temporary SQLite database with more and more tenants, each with its own library of
+# synthetic books (about two readings a book), and after each step times one tenant's storage
+# calls with the query cache off. With tenant_id leading every key, the times should stay flat
+# while the tables grow a thousandfold.
+#
+#   python benchmarks/tenants.py [--books N] [--tenants 1,10,100,1000] [--iterations N]
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cache
+
+from load_test import synthetic_readings, synthetic_title, synthetic_author
+from sqlite_storage import SQLiteStorage
+
+
+def user_id(number):
+    return "amzn1.ask.account.BENCHMARK-{:06d}".format(number)
+
+
+def add_tenants(storage, first, last, books):
+    """ Create tenants first..last-1 and seed each one's library """
+    for number in range(first, last):
+        library = storage.for_user(user_id(number))
+        readings = synthetic_readings(books, seed=number, tenant_id=library.tenant_id)
+        with library.transaction() as cursor:
+            cursor.executemany(library.queries.INSERT_READ_INSTANCE, readings)
+            cursor.execute(library.queries.REBUILD_TENANT_BOOKS, (library.tenant_id,))
+
+
+def median_ms(call, iterations):
+    times = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        call(i)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def measure(library, books, iterations):
+    """ [(call, median ms)] for the tenant's library """
+    def title(i):
+        return synthetic_title(i * 7919 % books)[-6:]      # Part of the title, as said
+
+    def add_and_delete(i):
+        library.add_read_instance(synthetic_title(i % books), synthetic_author(i % books), "2020", "Jan", "0", "Book", "")
+        library.delete_last_read_instance()
+
+    return [
+        ("last_read", median_ms(lambda i: library.last_read(), iterations)),
+        ("times_read", median_ms(lambda i: library.times_read(title(i)), iterations)),
+        ("count_for_year", median_ms(lambda i: library.count_for_year(1995 + i % 30), iterations)),
+        ("books_by_author", median_ms(lambda i: library.books_by_author(synthetic_author(i % books), "", 5), iterations)),
+        ("book_summaries", median_ms(lambda i: library.book_summaries(), max(1, iterations // 20))),
+        ("add + delete", median_ms(add_and_delete, iterations)),
+        ]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", type=int, default=500, help="Books in each tenant's library")
+    parser.add_argument("--tenants", default="1,10,100,1000", help="Comma-separated tenant counts to measure at")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args(argv[1:])
+
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), "books.db"))
+    cache.query_cache.size = 0
+    rows = []
+    seeded = 0
+    try:
+        for tenants in [int(count) for count in args.tenants.split(",")]:
+            start = time.perf_counter()
+            add_tenants(storage, seeded, tenants, args.books)
+            seeded = tenants
+            readings = storage.fetchone("SELECT COUNT(*) FROM read_instances")[0]
+            print("{} tenants, {} readings (seeded in {:.1f}s)".format(tenants, readings, time.perf_counter() - start))
+            rows.append((tenants, measure(storage.for_user(user_id(0)), args.books, args.iterations)))
+    finally:
+        cache.query_cache.size = cache.CACHE_SIZE
+        storage.close()
+
+    print("\n{:<20}".format("median ms, tenants") + "".join("{:>10}".format(tenants) for tenants, results in rows))
+    for i, (call, ms) in enumerate(rows[0][1]):
+        print("{:<20}".format(call) + "".join("{:>10.3f}".format(results[i][1]) for tenants, results in rows))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark: spoken-title lookup through title_index.TitleIndex versus the old REGEXP match,
+# over a synthetic library. The REGEXP path is reproduced with Python's re module applied to
+# every title, which is the work MySQL did per row of books for "WHERE title REGEXP ...".
+#
+#   python benchmarks/title_search.py [books] [lookups]
+import os
+import re
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from title_index import TitleIndex
+
+
+WORDS = ("shadow river king night garden iron winter house stone glass empire silent forgotten "
+         "last dragon city war song light dark sea storm wolf crown secret fire golden time").split()
+
+
+def synthetic_titles(count, seed=1):
+    rng = random.Random(seed)
+    titles = set()
+    while len(titles) < count:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(2, 5))]
+        if rng.random() < 0.4:
+            words.insert(0, "The")
+        words.append(str(rng.randint(1, 9999)))
+        titles.add(" ".join(word.capitalize() for word in words))
+    return sorted(titles)
+
+
+def old_regexp(spoken_title):
+    """ The pattern LastTimeReadIntentHandler used to build """
+    refined_title = [item.strip('.').strip(',').strip(':').strip('!').strip('?') for item in spoken_title.split(' ')]
+    regexp_title = '[a-z :.,!?]*[0-9]*'.join(' '.join(refined_title))
+    return regexp_title + '[a-z :.,!?]*[0-9]*'
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    titles = synthetic_titles(count)
+    rng = random.Random(2)
+    spoken = [rng.choice(titles).lower() for _ in range(lookups)]
+
+    start = time.perf_counter()
+    index = TitleIndex()
+    for book_id, title in enumerate(titles):
+        index.add(book_id, title, "Author", 2020, "Jan")
+    build = time.perf_counter() - start
+    print("{} titles, index built in {:.2f} s".format(count, build))
+
+    start = time.perf_counter()
+    for text in spoken:
+        pattern = re.compile(old_regexp(text), re.IGNORECASE)
+        [title for title in titles if pattern.search(title)]
+    regexp_time = (time.perf_counter() - start) / lookups
+
+    start = time.perf_counter()
+    for text in spoken:
+        index.search(text)
+    index_time = (time.perf_counter() - start) / lookups
+
+    print("REGEXP scan   {:>10.3f} ms/lookup".format(regexp_time * 1000))
+    print("title index   {:>10.3f} ms/lookup".format(index_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
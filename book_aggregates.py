@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Maintenance for the books table's aggregate columns (times_read, first/last read, unsure,
+# format_mask), which are updated on every add and recomputed from read_instances on every delete.
+# These commands find and repair rows that drifted before that, or were edited by hand.
+# Books are processed in batches of (tenant_id, title, author) keys in index order, one transaction
+# per batch, across every tenant's library.
+#
+#   python book_aggregates.py check [batch size]     List books that differ from a recompute, exit non-zero if any
+#   python book_aggregates.py repair [batch size]    Recompute every book with readings
+import sys
+import time
+
+import queries
+
+from database import transaction
+
+
+BATCH_SIZE = 500
+
+
+def key_ranges(connection, batch_size=BATCH_SIZE):
+    """ Yield (after, last, books) for batches of up to batch_size books with readings, covering them
+        all: each batch is the (tenant_id, title, author) keys k with after < k <= last. """
+    cursor = connection.cursor()
+    after = (0, "", "")
+    while True:
+        cursor.execute(queries.NEXT_BOOK_KEYS, after + (batch_size,))
+        keys = cursor.fetchall()
+        if not keys:
+            break
+        last = tuple(keys[-1])
+        yield after, last, len(keys)
+        after = last
+    cursor.close()
+
+
+def count_books(connection):
+    cursor = connection.cursor()
+    cursor.execute(queries.COUNT_READ_BOOKS)
+    count = cursor.fetchone()[0]
+    cursor.close()
+    return count
+
+
+def repair(connection, batch_size=BATCH_SIZE, progress=None):
+    """ Recompute the books row of every book with readings. progress, if given, is called
+        with the number of books done so far after each batch. Returns the number of books. """
+    done = 0
+    cursor = connection.cursor()
+    for after, last, books in key_ranges(connection, batch_size):
+        with transaction(connection):
+            cursor.execute(queries.REBUILD_BOOK_RANGE, after + last)
+            cursor.execute(queries.BUMP_LIBRARY_VERSION_RANGE, (after[0], last[0]))
+        done += books
+        if progress:
+            progress(done)
+    cursor.close()
+    return done
+
+
+def check(connection, batch_size=BATCH_SIZE):
+    """ List the books whose row differs from a recompute from read_instances, as
+        (tenant_id, title, author, stored aggregates or None, recomputed aggregates). Empty means consistent. """
+    drift = []
+    cursor = connection.cursor()
+    for after, last, books in key_ranges(connection, batch_size):
+        # Keys compare case-insensitively, like the columns' collation
+        cursor.execute(queries.BOOK_AGGREGATES_RANGE, after + last)
+        stored = {(row[0], row[1].lower(), row[2].lower()): tuple(row[3:]) for row in cursor.fetchall()}
+        cursor.execute(queries.RECOMPUTED_BOOK_RANGE, after + last)
+        for row in cursor.fetchall():
+            tenant_id, title, author = row[:3]
+            stored_row = stored.get((tenant_id, title.lower(), author.lower()))
+            if stored_row != tuple(row[3:]):
+                drift.append((tenant_id, title, author, stored_row, tuple(row[3:])))
+    cursor.close()
+    connection.rollback()   # End the read snapshot
+    return drift
+
+
+def main(argv):
+    import database
+
+    command = argv[1] if len(argv) > 1 else "check"
+    batch_size = int(argv[2]) if len(argv) > 2 else BATCH_SIZE
+    connection = database.connect()
+    try:
+        if command == "repair":
+            total = count_books(connection)
+            start = time.perf_counter()
+
+            def progress(done):
+                print("{}/{} books ({:.0f} books/s)".format(done, total, done / (time.perf_counter() - start)))
+
+            repair(connection, batch_size, progress)
+            print("books repaired")
+        else:
+            drift = check(connection, batch_size)
+            for tenant_id, title, author, stored, recomputed in drift:
+                print("tenant {}: {} by {}: books has {}, read_instances give {}".format(tenant_id, title, author, stored, recomputed))
+            print("{} inconsistent book(s)".format(len(drift)))
+            return 1 if drift else 0
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
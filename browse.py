@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+# Paged listing of books for the browse intent: the books read in a year, or the books by an author.
+# Each page is fetched with keyset pagination - the query asks for the rows after the last one
+# already spoken, along an index that serves the order (read_instances by (read_year, id), books by
+# (author, title)) - so a page costs the same however far into the list it is, and no page is
+# longer than PAGE_SIZE books however large the library gets.
+#
+# Where the listing is up to is kept in the session attributes between "next"s:
+#
+#   {"browse": {"by": "year", "value": 2019, "after": 1234}}
+import os
+
+
+PAGE_SIZE = int(os.environ.get("BROWSE_PAGE_SIZE", "5"))
+SESSION_KEY = "browse"
+
+
+def start(by, value):
+    """ Position before the first page of the books read in a year (by="year") or by an author (by="author") """
+    return {"by": by, "value": value, "after": 0 if by == "year" else ""}
+
+
+def fetch_page(storage, position):
+    """ ([(title, author), ...] of the page after position, position after that page or None if it's the last) """
+    # One extra row tells whether there's another page without a separate count
+    if position["by"] == "year":
+        rows = storage.readings_in_year(position["value"], position["after"], PAGE_SIZE + 1)
+        books = [(title, author) for reading_id, title, author in rows]
+        keys = [row[0] for row in rows]
+    else:
+        rows = storage.books_by_author(position["value"], position["after"], PAGE_SIZE + 1)
+        books = [(title, author) for title, author in rows]
+        keys = [row[0] for row in rows]
+
+    if len(books) <= PAGE_SIZE:
+        return books, None
+    return books[:PAGE_SIZE], dict(position, after=keys[PAGE_SIZE - 1])
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# Read-through result cache for the query intents.
+# Results live in module globals, so they survive between warm Lambda invocations. Entries expire
+# after CACHE_TTL seconds, the least recently used are evicted past CACHE_SIZE entries, and the
+# write handlers invalidate exactly the entries a new or deleted reading could change.
+#
+# Each Lambda container has its own cache, and a write only invalidates the container that
+# handled it - the TTL bounds how stale another container's answer can be.
+#
+# The users of a container share the cache. Their entries are told apart by the tenant_id in the
+# statement parameters, and every tag names its tenant, so a write drops entries of its own library only.
+import os
+import time
+import threading
+
+from collections import OrderedDict
+
+
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "300"))
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", "256"))
+
+
+class QueryCache(object):
+    """ TTL + LRU cache of query results, keyed by normalized SQL and parameters.
+        Every entry carries tags naming what it depends on, e.g. (2, "year", "2019"), so writes
+        can drop just the entries they affect. """
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()   # key -> (expires, rows, tags)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(sql, params):
+        return " ".join(sql.split()), tuple(str(param) for param in params)
+
+    def get(self, key):
+        """ Returns (True, rows) on a hit, (False, None) on a miss or expired entry. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, rows, tags):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, rows, tuple(tags))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate):
+        """ Drop every entry with a tag for which predicate(tag) is true. """
+        with self._lock:
+            stale = [key for key, (expires, rows, tags) in self._entries.items() if any(predicate(tag) for tag in tags)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            }
+
+
+query_cache = QueryCache()
+
+
+def cached_fetchall(sql, params, tags, fetchall):
+    """ Rows for sql/params from the cache, or from fetchall(sql, params) on a miss (only then
+        does the storage backend touch the database). """
+    key = query_cache.key(sql, params)
+    found, rows = query_cache.get(key)
+    if found:
+        return rows
+    rows = fetchall(sql, params)
+    query_cache.put(key, rows, tags)
+    return rows
+
+
+# Tags used by the query intents, each for one tenant's library
+def last_read_tag(tenant_id):
+    return (tenant_id, "last_read")
+
+def year_tag(tenant_id, year):
+    return (tenant_id, "year", str(year))
+
+def title_contains_tag(tenant_id, text):
+    """ Entry depends on every book whose title contains text (LIKE '%text%') """
+    return (tenant_id, "title_contains", text.lower())
+
+
+def invalidate_reading(tenant_id, title, author, year):
+    """ Drop the cached answers a reading of title/author in year being added to or deleted from the
+        tenant's library could change: the last book read, that year's count, and any title lookup
+        whose text is part of the title. """
+    year = str(year)
+    title_lower = title.lower()
+
+    def affected(tag):
+        if tag[0] != tenant_id:
+            return False
+        kind = tag[1]
+        if kind == "last_read":
+            return True
+        if kind == "year":
+            return tag[2] == year
+        if kind == "title_contains":
+            return tag[2] in title_lower
+        return False
+
+    query_cache.invalidate(affected)
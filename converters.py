@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# Converters between what the user says and how values are stored in the database tables.
+# Kept free of Alexa SDK and database imports so the query layer and offline tools can share them.
+
+
+# Converter between spoken month name and how it is represented in the database tables
+months_dict = {
+        "" : "",  # To handle NULL months (which actually consist of empty strings, not NULL)
+        "january": "Jan",
+        "february": "Feb",
+        "march": "Mar",
+        "april": "Apr",
+        "may": "May",
+        "june": "Jun",
+        "july": "Jul",
+        "august": "Aug",
+        "september": "Sep",
+        "october": "Oct",
+        "november": "Nov",
+        "december": "Dec"
+    }
+
+reverse_months_dict = {v:k for k,v in months_dict.items()}
+
+def months_converter(month_input):
+    """ Catches any incorrect spoken month values and returns an empty string. """
+    if month_input.lower() in months_dict.keys():
+        return months_dict[month_input.lower()]
+    else:
+        return ""
+
+
+def format_converter(format_input):
+    """ Converter between spoken format input and format representation in tables """
+    formats = {
+        "audiobook": "Audiobook",
+        "kindle": "Ebook",
+        "print book": "Book",
+        "book": "Book"
+        }
+    if format_input.lower() in formats.keys():
+        return formats[format_input.lower()]
+    else:
+        return ""
+    
+def overall_format_converter(old_format, added_format):
+    """ Handles updates to overall_format column in books table when a new read instance is added. """
+    if old_format == added_format:
+        return old_format
+    elif (old_format == "Audiobook" and added_format == "Book") or \
+         (old_format == "Book" and added_format == "Audiobook"):
+        return "Book/Audio"
+    elif (old_format == "Ebook" and added_format == "Audiobook") or \
+         (old_format == "Audiobook" and added_format == "Ebook"):
+        return "Ebook/Audio"
+    elif (old_format == "Ebook" and added_format == "Book") or \
+         (old_format == "Book" and added_format == "Ebook"):
+        return "Book/Ebook"
+    elif (old_format == "Book/Ebook" and added_format == "Audiobook") or \
+         (old_format == "Book/Audio" and added_format == "Ebook") or \
+         (old_format == "Ebook/Audio" and added_format == "Book"):
+        return "Book/Ebook/Audio"
+    else:
+        return old_format
+
+
+# Forces unsure_input into either a 0 (default if none given) or a 1 (if any unsure response)
+def unsure_converter(unsure_input):
+    if unsure_input == "0":
+        return "0"
+    else:
+        return "1"
+
+
+# Separator between context strings in books table when a new read_instance is added
+context_separator = " -- "
+
+def context_converter(context_input):
+    """ Converts null response "no" into an empty string.
+        Apostrophes and quotation marks are kept - queries are parameterized, so they can't break the SQL. """
+    if context_input == "no":
+        return ""
+    else:
+        return context_input
+
+
+# Every value a single reading's format can take
+read_formats = ["", "Book", "Ebook", "Audiobook"]
+
+# Bit of each format in the books table's format_mask, the formats of all a book's readings OR'ed together
+format_bits = {"Book": 1, "Ebook": 2, "Audiobook": 4}
+
+def format_mask_converter(read_format):
+    """ format_mask bit of a reading's format, 0 if it has none """
+    return format_bits.get(read_format, 0)
+
+def overall_format_from_mask(format_mask):
+    """ Name of a book's combined formats ("Book/Audio", ...) from its format_mask, merged by overall_format_converter """
+    overall_format = ""
+    for read_format, bit in format_bits.items():
+        if format_mask & bit:
+            overall_format = overall_format_converter(overall_format, read_format) if overall_format else read_format
+    return overall_format
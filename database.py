@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+# Connection manager for the book database.
+# Replaces the single global mydb/cursor pair with a small bounded pool that survives
+# between warm Lambda invocations, checks that idle connections are still alive before
+# handing them out, and gives every request its own cursor.
+import os
+import time
+import logging
+import threading
+
+import telemetry
+
+from contextlib import contextmanager, ExitStack
+from queries import StatementCache
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+# Connection settings. When DB_USE_PROXY is set the pool connects to the RDS Proxy endpoint instead.
+DB_HOST = os.environ.get("DB_HOST", "**************")
+DB_PROXY_HOST = os.environ.get("DB_PROXY_HOST", DB_HOST)
+DB_PORT = int(os.environ.get("DB_PORT", "3306"))
+DB_USER = os.environ.get("DB_USER", "*****************")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "**************")
+DB_NAME = os.environ.get("DB_NAME", "aws_sql_test")
+DB_USE_PROXY = os.environ.get("DB_USE_PROXY", "0") == "1"
+
+# Pool settings
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "4"))              # Most connections open at once
+PING_INTERVAL = float(os.environ.get("DB_PING_INTERVAL", "30"))   # Seconds idle before a connection is pinged on checkout
+IDLE_TIMEOUT = float(os.environ.get("DB_IDLE_TIMEOUT", "600"))    # Seconds idle before a connection is closed instead of reused
+CHECKOUT_TIMEOUT = float(os.environ.get("DB_CHECKOUT_TIMEOUT", "5"))  # Seconds to wait for a free connection
+
+
+def mysql_connector():
+    """ mysql.connector, imported on first use rather than at cold start, so requests that never
+        touch the database (launch, help, stop) don't pay for loading the driver. """
+    import mysql.connector
+    return mysql.connector
+
+
+def connect():
+    """ Open a new connection to the book database.
+        Selecting the database at connect time saves the extra "USE aws_sql_test" round trip. """
+    return mysql_connector().connect(
+            host=DB_PROXY_HOST if DB_USE_PROXY else DB_HOST,
+            port=DB_PORT,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            database=DB_NAME
+            )
+
+
+class PoolStats(object):
+    """ Counters describing how well the pool is doing its job. """
+    def __init__(self):
+        self.hits = 0           # Checkouts served by an idle pooled connection
+        self.misses = 0         # Checkouts that had to open a new connection
+        self.reconnects = 0     # Pooled connections found dead and re-established
+        self.discards = 0       # Connections closed because they broke or sat idle too long
+        self.checkouts = 0
+        self.checkout_time = 0.0
+        self.max_checkout_time = 0.0
+
+    def record_checkout(self, seconds):
+        self.checkouts += 1
+        self.checkout_time += seconds
+        self.max_checkout_time = max(self.max_checkout_time, seconds)
+
+    def as_dict(self):
+        average = self.checkout_time / self.checkouts if self.checkouts else 0.0
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reconnects": self.reconnects,
+            "discards": self.discards,
+            "checkouts": self.checkouts,
+            "avg_checkout_ms": round(average * 1000, 3),
+            "max_checkout_ms": round(self.max_checkout_time * 1000, 3),
+            }
+
+
+class PooledConnection(object):
+    """ A connection owned by the pool, its prepared statements, and the time it was last handed back. """
+    def __init__(self, connection):
+        self.connection = connection
+        self.statements = StatementCache(connection)
+        self.last_used = time.monotonic()
+
+
+class ConnectionPool(object):
+    """ Bounded pool of database connections.
+        Idle connections are kept between warm invocations. A connection that has been idle
+        longer than ping_interval is pinged (and reconnected if the server dropped it) before
+        being handed out, and one idle longer than idle_timeout is closed and replaced.
+        In proxy mode the RDS Proxy keeps the server side of the connection healthy, so the
+        ping is skipped and a broken connection is simply discarded when it fails. """
+    def __init__(self, size=POOL_SIZE, ping_interval=PING_INTERVAL, idle_timeout=IDLE_TIMEOUT,
+                 checkout_timeout=CHECKOUT_TIMEOUT, proxy_mode=DB_USE_PROXY, connect=connect):
+        self.size = size
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.proxy_mode = proxy_mode
+        self.stats = PoolStats()
+        self._connect = connect
+        self._idle = []         # Most recently used connection last, so it's reused first
+        self._open = 0
+        self._lock = threading.Condition()
+
+    def _close_quietly(self, pooled):
+        try:
+            pooled.connection.close()
+        except mysql_connector().Error:
+            pass
+
+    def _acquire(self, ping=False):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._lock:
+            while True:
+                now = time.monotonic()
+
+                # Throw away connections that have been idle too long to be worth checking
+                while self._idle and now - self._idle[0].last_used > self.idle_timeout:
+                    self._close_quietly(self._idle.pop(0))
+                    self._open -= 1
+                    self.stats.discards += 1
+
+                if self._idle:
+                    pooled = self._idle.pop()
+                    self.stats.hits += 1
+                    break
+
+                if self._open < self.size:
+                    # Reserve the slot before connecting, outside the lock
+                    self._open += 1
+                    self.stats.misses += 1
+                    pooled = None
+                    break
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise mysql_connector().errors.PoolError("No database connection available")
+                self._lock.wait(remaining)
+
+        if pooled is None:
+            try:
+                return PooledConnection(self._connect())
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                    self._lock.notify()
+                raise
+
+        if not self.proxy_mode and (ping or time.monotonic() - pooled.last_used > self.ping_interval):
+            self._ensure_alive(pooled)
+        return pooled
+
+    def _ensure_alive(self, pooled):
+        """ Ping an idle connection and re-establish it if RDS has dropped the socket. """
+        try:
+            pooled.connection.ping(reconnect=False)
+        except mysql_connector().Error:
+            self.stats.reconnects += 1
+            pooled.statements.clear()
+            try:
+                pooled.connection.reconnect(attempts=2, delay=0)
+            except Exception:
+                self._discard(pooled)
+                raise
+
+    def _discard(self, pooled):
+        pooled.statements.clear()
+        self._close_quietly(pooled)
+        with self._lock:
+            self._open -= 1
+            self.stats.discards += 1
+            self._lock.notify()
+
+    def _release(self, pooled):
+        # End any transaction the request left open. This also drops the read snapshot,
+        # so the next request sees rows committed since.
+        try:
+            if pooled.connection.in_transaction:
+                pooled.connection.rollback()
+        except mysql_connector().Error:
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(pooled)
+            self._lock.notify()
+
+    @contextmanager
+    def checkout(self, ping=False):
+        """ Borrow a connection and its prepared statement cursor for the length of one request:
+
+                with pool.checkout() as (mydb, cursor):
+                    cursor.execute(queries.SELECT_BOOK, (title, author))
+
+            A connection that fails with a connection-level error is discarded instead of
+            being returned to the pool. ping checks an idle connection however recently it was used. """
+        start = time.perf_counter()
+        pooled = self._acquire(ping)
+        with self._lock:
+            self.stats.record_checkout(time.perf_counter() - start)
+
+        broken = False
+        try:
+            yield pooled.connection, telemetry.instrument(pooled.statements)
+        except (mysql_connector().errors.OperationalError, mysql_connector().errors.InterfaceError):
+            broken = True
+            raise
+        finally:
+            pooled.statements.close()
+            if broken:
+                self._discard(pooled)
+            else:
+                self._release(pooled)
+
+    def warm(self, connections, statements):
+        """ Hold up to connections connections at once - opening new ones, pinging (and re-establishing)
+            idle ones - and run the statements on each, so they're prepared before a request needs them.
+            Returns the number of connections warmed. """
+        count = min(connections, self.size)
+        with ExitStack() as stack:
+            for i in range(count):
+                mydb, cursor = stack.enter_context(self.checkout(ping=True))
+                for sql, params in statements:
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+        return count
+
+    def close(self):
+        """ Close every idle connection. Connections currently checked out are closed when released. """
+        with self._lock:
+            while self._idle:
+                self._close_quietly(self._idle.pop())
+                self._open -= 1
+
+
+@contextmanager
+def transaction(connection):
+    """ Run a group of statements as one transaction: committed if the block finishes,
+        rolled back if it raises. Autocommit is off, so the transaction starts with the first
+        statement and no separate START TRANSACTION round trip is needed. """
+    try:
+        yield connection
+    except Exception:
+        try:
+            connection.rollback()
+        except mysql_connector().Error:
+            pass
+        raise
+    else:
+        connection.commit()
+
+
+# Global pool, so warm invocations reuse connections instead of reconnecting every time an intent is triggered
+pool = None
+
+def get_pool():
+    global pool
+    if pool is None:
+        pool = ConnectionPool()
+    return pool
+
+
+def checkout():
+    """ Shortcut for get_pool().checkout(), used by the intent handlers. """
+    return get_pool().checkout()
+
+
+def pool_stats():
+    return get_pool().stats.as_dict()
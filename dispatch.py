@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# Constant-time request routing for the skill.
+# The SDK's default request mapper asks every registered handler's can_handle in order until one
+# says yes, so the cost of dispatch grows with the number of intents. IntentRouter looks the
+# handler up by request type and intent name instead, and is installed ahead of the default
+# mapper, which stays behind it for anything the router doesn't know.
+import json
+
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_runtime.dispatch_components.request_components import AbstractRequestMapper, GenericRequestHandlerChain
+
+
+class IntentRouter(AbstractRequestMapper):
+    """ Maps (request type, intent name) to a handler chain with a dict lookup.
+
+            router.add(LaunchRequestHandler(), request_type="LaunchRequest")
+            router.add(GetLastReadIntentHandler(), intent_names=["GetLastReadIntent"])
+
+        Handlers are still ordinary AbstractRequestHandlers - their can_handle just isn't
+        called on the routed path. Unrouted IntentRequests go to the fallback handler if there
+        is one; anything else returns None, so the next request mapper gets a chance. """
+    def __init__(self):
+        self.handlers = []
+        self._chains = {}           # (request type, intent name or None) -> GenericRequestHandlerChain
+        self._fallback = None
+
+    def add(self, handler, request_type="IntentRequest", intent_names=None):
+        chain = GenericRequestHandlerChain(request_handler=handler)
+        for intent_name in intent_names or [None]:
+            self._chains[(request_type, intent_name)] = chain
+        self.handlers.append(handler)
+
+    def set_fallback(self, handler):
+        """ Handler for IntentRequests with no route of their own (e.g. IntentReflectorHandler) """
+        self._fallback = GenericRequestHandlerChain(request_handler=handler)
+        self.handlers.append(handler)
+
+    def route(self, request):
+        request_type = request.object_type
+        if request_type == "IntentRequest":
+            chain = self._chains.get((request_type, request.intent.name))
+            return chain if chain is not None else self._fallback
+        return self._chains.get((request_type, None))
+
+    def get_request_handler_chain(self, handler_input):
+        return self.route(handler_input.request_envelope.request)
+
+
+def create_lambda_handler(skill_builder, router):
+    """ Lambda entry point for the skill, built once at cold start with the router in front.
+        (SkillBuilder.lambda_handler() rebuilds the skill configuration on every invocation.) """
+    skill = skill_builder.create()
+    skill.request_dispatcher.request_mappers.insert(0, router)
+
+    def lambda_handler(event, context):
+        request_envelope = skill.serializer.deserialize(payload=json.dumps(event), obj_type=RequestEnvelope)
+        response_envelope = skill.invoke(request_envelope=request_envelope, context=context)
+        return skill.serializer.serialize(response_envelope)
+
+    return lambda_handler
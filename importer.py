@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+# Bulk import of a reading log CSV (e.g. the old Excel book list, saved as CSV) into read_instances,
+# followed by one set-based rebuild of the books table from read_instances.
+#
+#   python importer.py readings.csv [--user ALEXA_USER_ID] [--batch-size 1000] [--source NAME] [--no-rebuild]
+#
+# The CSV needs a header row naming the read_instances columns: title, author, read_year, and
+# optionally read_month, unsure, read_format and read_context. Months and formats can be spoken
+# ("january", "kindle") or already in their stored form ("Jan", "Ebook"). The readings go to the
+# library of the Alexa user given with --user, or to tenant 1 (the library from before partitioning,
+# see tenants.py).
+#
+# Rows are streamed from the file and inserted in batches with executemany(), which the driver
+# sends as one multi-row INSERT per batch, so memory use doesn't depend on the size of the file.
+# Each batch is committed together with the number of rows imported so far (in import_checkpoints),
+# so an import that fails part way can be run again and carries on after the last committed batch.
+import os
+import sys
+import csv
+import time
+import logging
+import argparse
+
+from itertools import islice
+
+import queries
+import tenants
+
+from converters import (months_converter, reverse_months_dict, format_converter, read_formats,
+                        unsure_converter, context_converter)
+from database import transaction
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+CREATE_IMPORT_CHECKPOINTS = (
+    "CREATE TABLE IF NOT EXISTS import_checkpoints ("
+    "source VARCHAR(255) NOT NULL, "
+    "rows_imported INT NOT NULL, "
+    "updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP, "
+    "PRIMARY KEY (source))")
+SELECT_CHECKPOINT = "SELECT rows_imported FROM import_checkpoints WHERE source = %s"
+SAVE_CHECKPOINT = ("INSERT INTO import_checkpoints (source, rows_imported) VALUES (%s, %s) "
+                   "ON DUPLICATE KEY UPDATE rows_imported = VALUES(rows_imported)")
+
+BATCH_SIZE = 1000
+MAX_REPORTED_REJECTS = 20
+
+
+class RejectedRow(ValueError):
+    pass
+
+
+def normalize_row(row):
+    """ A CSV row (dict) as an INSERT_READ_INSTANCE parameter tuple without the tenant_id, converted
+        the way the skill converts spoken values. Raises RejectedRow if the row can't be stored. """
+    title = (row.get("title") or "").strip()
+    author = (row.get("author") or "").strip()
+    year = (row.get("read_year") or "").strip()
+    if not title or not author:
+        raise RejectedRow("missing title or author")
+    if not (year.isdigit() and len(year) == 4):
+        raise RejectedRow("read_year {!r} is not a year".format(year))
+
+    month = (row.get("read_month") or "").strip()
+    month = months_converter(reverse_months_dict.get(month.title(), month))
+    read_format = (row.get("read_format") or "").strip()
+    if read_format not in read_formats:
+        read_format = format_converter(read_format)
+    unsure = unsure_converter((row.get("unsure") or "").strip() or "0")     # A blank cell means sure, not unsure
+    context = context_converter((row.get("read_context") or "").strip())
+    return title, author, year, month, unsure, read_format, context
+
+
+def read_rows(path, skip=0):
+    """ Yield (line number, row dict) for each data row of the CSV, after the first skip rows """
+    with open(path, newline="", encoding="utf-8-sig") as csv_file:
+        reader = csv.DictReader(csv_file)
+        for row in islice(reader, skip, None):
+            yield reader.line_num, row
+
+
+def batches(rows, batch_size):
+    """ Group an iterable into lists of up to batch_size items """
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class ImportStats(object):
+    def __init__(self, resumed_from):
+        self.resumed_from = resumed_from
+        self.inserted = 0
+        self.rejected = 0
+        self.start = time.perf_counter()
+
+    @property
+    def consumed(self):
+        return self.resumed_from + self.inserted + self.rejected
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return (self.inserted + self.rejected) / elapsed if elapsed else 0.0
+
+
+def import_csv(connection, path, source=None, batch_size=BATCH_SIZE, progress=None, tenant_id=tenants.DEFAULT_TENANT):
+    """ Import every row of the CSV at path not imported by an earlier run into the tenant's library.
+        Returns the ImportStats. progress, if given, is called with the ImportStats after each committed batch. """
+    if not source:
+        source = os.path.basename(path)
+        if tenant_id != tenants.DEFAULT_TENANT:
+            source = "{}/{}".format(tenant_id, source)     # Checkpointed apart from other users' imports of a file by that name
+    cursor = connection.cursor()
+    cursor.execute(CREATE_IMPORT_CHECKPOINTS)
+    cursor.execute(SELECT_CHECKPOINT, (source,))
+    row = cursor.fetchone()
+    connection.commit()
+
+    stats = ImportStats(resumed_from=row[0] if row else 0)
+    if stats.resumed_from:
+        logger.info("Resuming %s after row %d", source, stats.resumed_from)
+
+    for batch in batches(read_rows(path, skip=stats.resumed_from), batch_size):
+        values = []
+        for line_num, csv_row in batch:
+            try:
+                values.append((tenant_id,) + normalize_row(csv_row))
+            except RejectedRow as error:
+                stats.rejected += 1
+                if stats.rejected <= MAX_REPORTED_REJECTS:
+                    logger.warning("Skipping line %d: %s", line_num, error)
+
+        with transaction(connection):
+            if values:
+                cursor.executemany(queries.INSERT_READ_INSTANCE, values)
+            cursor.execute(SAVE_CHECKPOINT, (source, stats.consumed + len(values)))
+        stats.inserted += len(values)
+        if progress:
+            progress(stats)
+
+    cursor.close()
+    return stats
+
+
+def rebuild_books(connection, tenant_id=tenants.DEFAULT_TENANT):
+    """ Recompute the books row of every book with readings in the tenant's library, in one statement """
+    cursor = connection.cursor()
+    with transaction(connection):
+        cursor.execute(queries.REBUILD_TENANT_BOOKS, (tenant_id,))
+        cursor.execute(queries.BUMP_LIBRARY_VERSION, (tenant_id,))
+    cursor.close()
+
+
+def main(argv):
+    import database
+    from storage import get_storage
+
+    parser = argparse.ArgumentParser(description="Import a reading log CSV into the book database")
+    parser.add_argument("path")
+    parser.add_argument("--user", help="Alexa user id whose library the readings go to (default: tenant 1)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--source", help="Name the import is checkpointed under (default: the file name)")
+    parser.add_argument("--no-rebuild", action="store_true", help="Don't rebuild the books table afterwards")
+    args = parser.parse_args(argv[1:])
+
+    def report(stats):
+        print("{} rows imported, {} rejected, {:.0f} rows/s".format(stats.inserted, stats.rejected, stats.rate()))
+
+    last_report = [time.perf_counter()]
+    def progress(stats):
+        if time.perf_counter() - last_report[0] >= 5:
+            report(stats)
+            last_report[0] = time.perf_counter()
+
+    tenant_id = get_storage().find_or_create_tenant(args.user) if args.user else tenants.DEFAULT_TENANT
+    connection = database.connect()
+    try:
+        stats = import_csv(connection, args.path, args.source, args.batch_size, progress=progress, tenant_id=tenant_id)
+        report(stats)
+        if not args.no_rebuild:
+            start = time.perf_counter()
+            rebuild_books(connection, tenant_id)
+            print("books rebuilt in {:.1f}s".format(time.perf_counter() - start))
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
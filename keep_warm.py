@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# Keep-warm pings. After a quiet spell the first utterance pays for a new Lambda container, then
+# for opening a connection to RDS, then for preparing each statement it runs. An EventBridge rule
+# invoking the function on a schedule (e.g. rate(5 minutes)) keeps all three warm in between.
+# lambda_handler passes these events here instead of to the skill:
+#
+#   {"source": "aws.events", "detail-type": "Scheduled Event", ...}     From an EventBridge schedule
+#   {"keep_warm": true}                                                  From a script or a test
+#
+# A ping holds KEEP_WARM_CONNECTIONS pooled connections at once - opening them, or pinging them and
+# reconnecting if RDS dropped them - and runs the read intents' statements on each so they're
+# prepared. Then it reloads the title search indexes and snapshots of the users the container
+# served recently, if they're due, so a request doesn't have to. With WRITE_BEHIND=1 it drains the
+# write queue too.
+#
+# One ping warms one container. Keep the schedule's interval below DB_IDLE_TIMEOUT, or the pool
+# closes the connections between pings. Each ping logs a metrics record with "KeepWarm" for its
+# intent (see telemetry.py).
+import os
+import logging
+
+import telemetry
+import snapshot
+import title_index
+import write_behind
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+KEEP_WARM_CONNECTIONS = int(os.environ.get("KEEP_WARM_CONNECTIONS", "3"))    # Pooled connections a ping opens and prepares
+
+
+def is_keep_warm_event(event):
+    """ Whether the Lambda event is a keep-warm ping rather than an Alexa request """
+    if not isinstance(event, dict):
+        return False
+    return event.get("keep_warm") is True or (event.get("source") == "aws.events" and
+                                               event.get("detail-type") == "Scheduled Event")
+
+
+def refresh_caches(storage):
+    """ Reload the title indexes and snapshots this container holds that are due for it """
+    for tenant_id in title_index.loaded.tenant_ids():
+        title_index.get_title_index(storage.for_tenant(tenant_id))
+    for tenant_id in snapshot.loaded.tenant_ids():
+        snapshot.get_library(storage.for_tenant(tenant_id))
+
+
+def handle_keep_warm_event(event, storage):
+    """ Warm the connections, statements and caches. A failure is logged rather than raised, so the
+        schedule doesn't retry the ping; the next request reconnects as usual. """
+    telemetry.start_event("KeepWarm")
+    connections = 0
+    error = None
+    try:
+        # Prepared with the parameters of the library used most recently, so its pages are in the buffer pool too
+        recent = title_index.loaded.tenant_ids()
+        connections = (storage.for_tenant(recent[-1]) if recent else storage).warm(KEEP_WARM_CONNECTIONS)
+        refresh_caches(storage)
+        if write_behind.WRITE_BEHIND:
+            write_behind.drain(storage)
+    except Exception as exception:
+        logger.warning("Keep-warm ping failed", exc_info=True)
+        error = type(exception).__name__
+    telemetry.finish_request(error)
+    return {"warmedConnections": connections}
@@ -4,124 +4,36 @@
 # Please visit https://alexa.design/cookbook for additional examples on implementing slots, dialog management,
 # session persistence, api calls, and more.
 # This sample is built using the handler classes approach in skill builder.
+import os
 import datetime
-import mysql.connector
 import logging
 import ask_sdk_core.utils as ask_utils
 
 from ask_sdk_core.skill_builder import SkillBuilder
 from ask_sdk_core.dispatch_components import AbstractRequestHandler
 from ask_sdk_core.dispatch_components import AbstractExceptionHandler
+from ask_sdk_core.dispatch_components import AbstractRequestInterceptor
+from ask_sdk_core.dispatch_components import AbstractResponseInterceptor
 from ask_sdk_core.handler_input import HandlerInput
 
 from ask_sdk_model import Response
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-
-# Global database and cursor variables, so doesn't have to reconnect every time an intent is triggered
-mydb = None
-cursor = None
-
-def connect_to_database():
-    """ Global mydb and cursor variables ensure you only need to connect once per session """
-    global mydb
-    global cursor
-    if mydb is None:
-        mydb = mysql.connector.connect(
-                host="**************",
-                port=3306,
-                user="*****************",
-                password="**************"
-                )
-        cursor = mydb.cursor()
-        cursor.execute("USE aws_sql_test")
-    return mydb, cursor
-
-
-# Converter between spoken month name and how it is represented in the database tables
-months_dict = {
-        "" : "",  # To handle NULL months (which actually consist of empty strings, not NULL)
-        "january": "Jan",
-        "february": "Feb",
-        "march": "Mar",
-        "april": "Apr",
-        "may": "May",
-        "june": "Jun",
-        "july": "Jul",
-        "august": "Aug",
-        "september": "Sep",
-        "october": "Oct",
-        "november": "Nov",
-        "december": "Dec"
-    }
-
-reverse_months_dict = {v:k for k,v in months_dict.items()}
-
-def months_converter(month_input):
-    """ Catches any incorrect spoken month values and returns an empty string. """
-    if month_input.lower() in months_dict.keys():
-        return months_dict[month_input.lower()]
-    else:
-        return ""
-
-
-def format_converter(format_input):
-    """ Converter between spoken format input and format representation in tables """
-    formats = {
-        "audiobook": "Audiobook",
-        "kindle": "Ebook",
-        "print book": "Book",
-        "book": "Book"
-        }
-    if format_input.lower() in formats.keys():
-        return formats[format_input.lower()]
-    else:
-        return ""
-    
-def overall_format_converter(old_format, added_format):
-    """ Handles updates to overall_format column in books table when a new read instance is added. """
-    if old_format == added_format:
-        return old_format
-    elif (old_format == "Audiobook" and added_format == "Book") or \
-         (old_format == "Book" and added_format == "Audiobook"):
-        return "Book/Audio"
-    elif (old_format == "Ebook" and added_format == "Audiobook") or \
-         (old_format == "Audiobook" and added_format == "Ebook"):
-        return "Ebook/Audio"
-    elif (old_format == "Ebook" and added_format == "Book") or \
-         (old_format == "Book" and added_format == "Ebook"):
-        return "Book/Ebook"
-    elif (old_format == "Book/Ebook" and added_format == "Audiobook") or \
-         (old_format == "Book/Audio" and added_format == "Ebook") or \
-         (old_format == "Ebook/Audio" and added_format == "Book"):
-        return "Book/Ebook/Audio"
-    else:
-        return old_format
-
-
-# Forces unsure_input into either a 0 (default if none given) or a 1 (if any unsure response)
-def unsure_converter(unsure_input):
-    if unsure_input == "0":
-        return "0"
-    else:
-        return "1"
+import browse
+import prefetch
+import keep_warm
+import telemetry
+import write_behind
 
+from storage import get_storage
+from dispatch import IntentRouter, create_lambda_handler
+from converters import (months_converter, reverse_months_dict, format_converter,
+                        unsure_converter, context_converter)
 
-# Separator between context strings in books table when a new read_instance is added
-context_separator = " -- "
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
 
-def context_converter(context_input):
-    """ Removes apostrophes and quotation marks from context text to 
-        avoid syntax errors with SQL queries.
-        Also converts null response "no" into an empty string. """
-    context_input = context_input.replace("'" , "")
-    context_input = context_input.replace("\"" , "")
-    if context_input == "no":
-        return ""
-    else:
-        return context_input
+# Register HelloWorldIntentHandler and IntentReflectorHandler, for interaction model testing
+ENABLE_DEBUG_HANDLERS = os.environ.get("ENABLE_DEBUG_HANDLERS", "0") == "1"
 
 
 def get_slot_value(slots, slot_name, default_value):
@@ -134,6 +46,45 @@ def get_slot_value(slots, slot_name, default_value):
     return slot_value
 
 
+def get_user_storage(handler_input):
+    """ Storage bound to the library of the user making the request """
+    return get_storage().for_user(handler_input.request_envelope.context.system.user.user_id)
+
+
+def books_page_response(handler_input, position, intro, not_found):
+    """ Speak the next page of a browse listing after intro (not_found if there are no books at all),
+        keeping where the listing is up to in the session attributes """
+    session_attributes = handler_input.attributes_manager.session_attributes
+    storage = get_user_storage(handler_input)
+    if write_behind.WRITE_BEHIND and write_behind.pending_readings(session_attributes, storage):
+        # Pages are read by key from the database, so the session's queued readings go in first
+        # rather than being merged into them
+        write_behind.settle(session_attributes, storage)
+    books, next_position = browse.fetch_page(storage, position)
+    if next_position is not None:
+        session_attributes[browse.SESSION_KEY] = next_position
+        reprompt = "Say next to hear more, or ask me something else."
+    else:
+        session_attributes.pop(browse.SESSION_KEY, None)
+        reprompt = "Anything else?"
+
+    if books:
+        if position["by"] == "author":
+            listing = ", ".join(title for title, author in books)
+        else:
+            listing = ", ".join("{} by {}".format(title, author) for title, author in books)
+        speak_output = "<speak>{}{}. {}</speak>".format(intro, listing, reprompt if next_position is not None else "That's all.")
+    else:
+        speak_output = not_found
+
+    return (
+        handler_input.response_builder
+            .speak(speak_output)
+            .ask(reprompt)
+            .response
+    )
+
+
 class LaunchRequestHandler(AbstractRequestHandler):
     """ [Built-in] Handler for Skill Launch."""
     def can_handle(self, handler_input):
@@ -142,6 +93,9 @@ class LaunchRequestHandler(AbstractRequestHandler):
 
     def handle(self, handler_input):
         # type: (HandlerInput) -> Response
+        # Open connections and fetch the likely first answers while the welcome is being spoken
+        prefetch.prefetch(handler_input.attributes_manager.session_attributes, lambda: get_user_storage(handler_input))
+
         speak_output = "Welcome to your book database."
         return (
             handler_input.response_builder
@@ -157,13 +111,16 @@ class GetLastReadIntentHandler(AbstractRequestHandler):
         return ask_utils.is_intent_name("GetLastReadIntent")(handler_input)
 
     def handle(self, handler_input):
-        mydb, cursor = connect_to_database()
-        
-        cursor.execute("SELECT title, author FROM read_instances WHERE id = (SELECT MAX(id) FROM read_instances)")
-        title, author = cursor.fetchone()
-        
-        speak_output = "<speak>The last book you <w role='amazon:VBD'>read</w> was {} by {}.</speak>".format(title, author)
-            
+        session_attributes = handler_input.attributes_manager.session_attributes
+        storage = get_user_storage(handler_input)
+        pending = write_behind.pending_readings(session_attributes, storage)
+        last_read = write_behind.last_read(pending, prefetch.last_read(session_attributes, storage))
+
+        if last_read is not None:
+            speak_output = "<speak>The last book you <w role='amazon:VBD'>read</w> was {} by {}.</speak>".format(*last_read)
+        else:
+            speak_output = "You haven't added any books yet."
+
         return (
             handler_input.response_builder
                 .speak(speak_output)
@@ -176,10 +133,8 @@ class AddReadInstanceIntentHandler(AbstractRequestHandler):
     """ [My own custom] Handler for Add Read Instance Intent."""
     def can_handle(self, handler_input):
         return ask_utils.is_intent_name("AddReadInstanceIntent")(handler_input)
-        
+
     def handle(self, handler_input):
-        mydb, cursor = connect_to_database()
-        
         # Get all the required read instance fields provided by the user
         slots = handler_input.request_envelope.request.intent.slots
         title = get_slot_value(slots, "title", "default_title").title()
@@ -189,60 +144,17 @@ class AddReadInstanceIntentHandler(AbstractRequestHandler):
         unsure = unsure_converter(get_slot_value(slots, "unsure_of_date", "0"))
         read_format = format_converter(get_slot_value(slots, "read_format", ""))
         context = context_converter(get_slot_value(slots, "read_context", ""))
-        
-        # Insert a row into the read_instances table
-        insert_command = "INSERT INTO read_instances VALUES (DEFAULT," # DEFAULT takes the place of the id field, which auto-increments
-        insert_command += "'{}',".format(title)
-        insert_command += "'{}',".format(author) 
-        insert_command += "'{}',".format(year)
-        insert_command += "'{}',".format(month)
-        insert_command += "'{}',".format(unsure)
-        insert_command += "'{}',".format(read_format)
-        insert_command += "'{}')".format(context)
-        cursor.execute(insert_command)
-        
-        # Update books table
-        command = "SELECT * FROM books WHERE title = '{}' AND author = '{}'".format(title, author)
-        cursor.execute(command)
-        row = cursor.fetchone()
-        
-        # If new book reading already exists in the books table:
-        if row:
-            # Increment times_read by 1
-            command = "UPDATE books SET times_read = times_read + 1 WHERE id = {}".format(row[0])
-            cursor.execute(command)
-            
-            # Update last_read_year and last_read_month
-            command = "UPDATE books SET last_read_year = '{}', last_read_month = '{}' WHERE id = {}".format(year, month, row[0])
-            cursor.execute(command)
-            
-            # Update read format
-            updated_format = overall_format_converter(row[9], read_format)
-            command = "UPDATE books SET overall_format = '{}' WHERE id = '{}'".format(updated_format, row[0])
-            cursor.execute(command)
-            
-            # Concatenate new reading context onto overall context
-            overall_context = context_converter(row[10]) + context_separator + context
-            command = "UPDATE books SET overall_context = '{}' WHERE id = {}".format(overall_context, row[0])
-            cursor.execute(command)
-            
-        # If it doesn't already exist, create a new book entry
+
+        session_attributes = handler_input.attributes_manager.session_attributes
+        storage = get_user_storage(handler_input)
+        prefetch.invalidate(session_attributes)
+        if write_behind.WRITE_BEHIND:
+            # Answer once the reading is queued; it's added to the database by a drain
+            write_behind.enqueue_read_instance(session_attributes, storage, title, author, year, month,
+                                               unsure, read_format, context)
         else:
-            command = "INSERT INTO books VALUES (DEFAULT, '{}', '{}', '{}', '{}', '{}', '{}', '{}', '{}', '{}', '{}')".format( 
-                        title, 
-                        author, 
-                        year,       # First read year
-                        month,      # First read month
-                        unsure, 
-                        year,       # Last read year
-                        month,      # Last read month
-                        1,          # Initialize times read to 1
-                        read_format, 
-                        context)
-            cursor.execute(command)
-        
-        mydb.commit()
-        
+            storage.add_read_instance(title, author, year, month, unsure, read_format, context)
+
         speak_output = "Okay. Added."
         #speak_output = title + " " + author + " " + year + " " + month + " " + unsure + " " + read_format + " " + context
 
@@ -253,58 +165,25 @@ class AddReadInstanceIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-    
+
 class DeleteLastReadInstanceIntentHandler(AbstractRequestHandler):
     """ [My own custom] Handler for Delete Last Read Instance Intent."""
     def can_handle(self, handler_input):
         return ask_utils.is_intent_name("DeleteLastReadInstanceIntent")(handler_input)
 
     def handle(self, handler_input):
-        mydb, cursor = connect_to_database()
-        
-        # Get title and author of read instance to be deleted, to use for updating books table
-        cursor.execute("SELECT title, author FROM read_instances ORDER BY id DESC LIMIT 1")
-        title, author = cursor.fetchone()
-        
-        # Delete last row
-        cursor.execute("DELETE FROM read_instances ORDER BY id DESC LIMIT 1")
-
-        # Get all the row info of the deleted read instance's book in the books table
-        command = "SELECT * FROM books WHERE title = '{}' AND author = '{}'".format(title, author)
-        cursor.execute(command)
-        row = cursor.fetchone()
-        
-        # If times_read is only 1, delete from the books table too
-        if row[8] == 1:
-            command = "DELETE FROM books WHERE id = {}".format(row[0])
-            cursor.execute(command)
-            
+        session_attributes = handler_input.attributes_manager.session_attributes
+        storage = get_user_storage(handler_input)
+        prefetch.invalidate(session_attributes)
+        if write_behind.WRITE_BEHIND:
+            # The last reading may still be queued
+            write_behind.settle(session_attributes, storage)
+        deleted = storage.delete_last_read_instance()
+
+        if deleted is not None:
+            speak_output = "<speak>Okay. I deleted the last book you <w role='amazon:VBD'>read</w>. {} by {}. Want to add a new one?</speak>".format(*deleted)
         else:
-            # Decrement times read
-            command = "UPDATE books SET times_read = times_read - 1 WHERE id = {}".format(row[0])
-            cursor.execute(command)
-            
-            # Revert back to last read month and year by finding next most recent reading in read_instances.
-            # If there isn't one, do nothing (The original last read date can't be recovered automatically.)
-            command = "SELECT read_year, read_month FROM read_instances WHERE title = '{}' AND author = '{}' ORDER BY ID DESC LIMIT 1".format(title, author)
-            cursor.execute(command)
-            most_recent_reading = cursor.fetchone()
-            if most_recent_reading:
-                next_most_recent_year, next_most_recent_month = most_recent_reading
-                command = "UPDATE books SET last_read_year = {}, last_read_month = '{}' WHERE id = {}".format(next_most_recent_year, next_most_recent_month, row[0])
-                cursor.execute(command)
-            
-            # Remove last part of overall_context
-            original_overall_context = row[10]
-            separator_index = original_overall_context.rfind(context_separator)
-            if separator_index != -1:
-                updated_overall_context = original_overall_context[0: separator_index]
-                command = "UPDATE books SET overall_context = '{}' WHERE id = {}".format(updated_overall_context, row[0])
-                cursor.execute(command)
-        
-        mydb.commit()
-        
-        speak_output = "<speak>Okay. I deleted the last book you <w role='amazon:VBD'>read</w>. {} by {}. Want to add a new one?</speak>".format(title, author)
+            speak_output = "You haven't added any books yet, so there's nothing to delete."
 
         return (
             handler_input.response_builder
@@ -320,23 +199,24 @@ class GetNumberOfTimesReadIntentHandler(AbstractRequestHandler):
         return ask_utils.is_intent_name("GetNumberOfTimesReadIntent")(handler_input)
 
     def handle(self, handler_input):
-        mydb, cursor = connect_to_database()
-        
         slots = handler_input.request_envelope.request.intent.slots
         title = slots["title"].value.title()
+        storage = get_user_storage(handler_input)
+        pending = write_behind.pending_readings(handler_input.attributes_manager.session_attributes, storage)
 
         if slots["author"].value is not None:
             author = slots["author"].value.title()
-            cursor.execute("SELECT times_read FROM books WHERE title LIKE '%{}%' and author LIKE '%{}%'".format(title, author))
+            times_read = write_behind.times_read(pending, title, author, storage.times_read(title, author))
         else:
-            cursor.execute("SELECT times_read FROM books WHERE title LIKE '%{}%'".format(title))
-            
-        times_read = cursor.fetchone()[0]
-        
-        speak_output = str(times_read)
-        
+            times_read = write_behind.times_read(pending, title, None, storage.times_read(title))
+
+        if times_read is not None:
+            speak_output = str(times_read)
+        else:
+            speak_output = "I couldn't find {} in the books table.".format(title)
+
         #speak_output = "<speak>You've <w role='amazon:VBD'>read</w> {} {} times.</speak>".format(title, times_read)
-        
+
         return (
             handler_input.response_builder
                 .speak(speak_output)
@@ -351,27 +231,15 @@ class LastTimeReadIntentHandler(AbstractRequestHandler):
         return ask_utils.is_intent_name("LastTimeReadIntent")(handler_input)
 
     def handle(self, handler_input):
-        mydb, cursor = connect_to_database()
-        
         slots = handler_input.request_envelope.request.intent.slots
         title = slots["title"].value
-        
-        title_split = title.split(' ')
-        refined_title = []
-        for item in title_split:
-            refined_item = item.strip('.')
-            refined_item = refined_item.strip(',')
-            refined_item = refined_item.strip(':')
-            refined_item = refined_item.strip('!')
-            refined_item = refined_item.strip('?')
-            refined_title.append(refined_item)
-        refined_title_list = ' '.join(refined_title)
-        
-        regexp_title = '[a-z :.,!?]*[0-9]*'.join(refined_title_list)
-        regexp_title += '[a-z :.,!?]*[0-9]*'
-        
-        cursor.execute("SELECT title, last_read_year, last_read_month FROM books WHERE title REGEXP '{}'".format(regexp_title))
-        result = cursor.fetchall()
+
+        # Closest matching titles from the title search index, best match first
+        storage = get_user_storage(handler_input)
+        result = storage.last_time_read(title)
+        pending = write_behind.pending_readings(handler_input.attributes_manager.session_attributes, storage)
+        result = write_behind.last_time_read(pending, title, result)
+
         if result:
             speak_output = "<speak>"
             for row in result:
@@ -396,20 +264,21 @@ class HowManyBooksReadDuringYearIntent(AbstractRequestHandler):
         return ask_utils.is_intent_name("HowManyBooksReadDuringYearIntent")(handler_input)
 
     def handle(self, handler_input):
-        mydb, cursor = connect_to_database()
-        
         slots = handler_input.request_envelope.request.intent.slots
         year = slots["year"].value
+        session_attributes = handler_input.attributes_manager.session_attributes
+        storage = get_user_storage(handler_input)
+        pending = write_behind.pending_readings(session_attributes, storage)
 
         if year:
             # If the user provided a specified year
-            cursor.execute("SELECT COUNT(*) FROM read_instances WHERE read_year = {}".format(year))
-            count = cursor.fetchone()[0]
+            count = write_behind.count_for_year(pending, year, prefetch.count_for_year(session_attributes, storage, year))
             speak_output = "<speak>You <w role='amazon:VBD'>read</w> {} books in {}</speak>".format(count, year)
         else:
             # Use the current year - covering the utterance "How many books did I read this year?"
-            cursor.execute("SELECT COUNT(*) FROM read_instances WHERE read_year = {}".format(datetime.datetime.now().year))
-            count = cursor.fetchone()[0]
+            current_year = datetime.datetime.now().year
+            count = write_behind.count_for_year(pending, current_year,
+                                                prefetch.count_for_year(session_attributes, storage, current_year))
             speak_output = "<speak>You <w role='amazon:VBD'>read</w> {} books so far this year.</speak>".format(count)
 
         return (
@@ -420,6 +289,46 @@ class HowManyBooksReadDuringYearIntent(AbstractRequestHandler):
         )
 
 
+class BrowseBooksIntentHandler(AbstractRequestHandler):
+    """ [My own custom] Handler for Browse Books Intent - lists the books read in a year, or by an author, a page at a time."""
+    def can_handle(self, handler_input):
+        return ask_utils.is_intent_name("BrowseBooksIntent")(handler_input)
+
+    def handle(self, handler_input):
+        slots = handler_input.request_envelope.request.intent.slots
+
+        if slots["author"].value is not None:
+            author = slots["author"].value.title()
+            position = browse.start("author", author)
+            intro = "By {} you've <w role='amazon:VBD'>read</w> ".format(author)
+            not_found = "I couldn't find any books by {} in the books table.".format(author)
+        else:
+            # "What books did I read this year?" leaves the year empty
+            year = int(slots["year"].value or datetime.datetime.now().year)
+            position = browse.start("year", year)
+            intro = "In {} you <w role='amazon:VBD'>read</w> ".format(year)
+            not_found = "<speak>I couldn't find any books you <w role='amazon:VBD'>read</w> in {}.</speak>".format(year)
+
+        return books_page_response(handler_input, position, intro, not_found)
+
+
+class NextBooksPageIntentHandler(AbstractRequestHandler):
+    """ [My own custom] Handler for the Next Intent - continues a Browse Books listing."""
+    def can_handle(self, handler_input):
+        return ask_utils.is_intent_name("AMAZON.NextIntent")(handler_input)
+
+    def handle(self, handler_input):
+        position = handler_input.attributes_manager.session_attributes.get(browse.SESSION_KEY)
+        if position is None:
+            return (
+                handler_input.response_builder
+                    .speak("There's nothing more to list.")
+                    .ask("Anything else?")
+                    .response
+            )
+        return books_page_response(handler_input, position, "", "There's nothing more to list.")
+
+
 class HelloWorldIntentHandler(AbstractRequestHandler):
     """ [Built-in] Handler for Hello World Intent."""
     def can_handle(self, handler_input):
@@ -488,6 +397,27 @@ class SessionEndedRequestHandler(AbstractRequestHandler):
         return handler_input.response_builder.response
 
 
+class FallbackIntentHandler(AbstractRequestHandler):
+    """ [My own custom] Handler for AMAZON.FallbackIntent, and any other intent without its own handler
+    (e.g. AMAZON.NavigateHomeIntent) - says what the skill can do instead of failing."""
+    def can_handle(self, handler_input):
+        # type: (HandlerInput) -> bool
+        return ask_utils.is_request_type("IntentRequest")(handler_input)
+
+    def handle(self, handler_input):
+        # type: (HandlerInput) -> Response
+        speak_output = ("<speak>Sorry, I can't help with that. You can add a book you've <w role='amazon:VBD'>read</w>, "
+                        "or ask me what the last book you <w role='amazon:VBD'>read</w> was.</speak>")
+        reprompt = "What would you like to do?"
+
+        return (
+            handler_input.response_builder
+                .speak(speak_output)
+                .ask(reprompt)
+                .response
+        )
+
+
 class IntentReflectorHandler(AbstractRequestHandler):
     """ [Built-in] The intent reflector is used for interaction model testing and debugging.
     It will simply repeat the intent the user said. You can create custom handlers
@@ -523,6 +453,7 @@ class CatchAllExceptionHandler(AbstractExceptionHandler):
     def handle(self, handler_input, exception):
         # type: (HandlerInput, Exception) -> Response
         logger.error(exception, exc_info=True)
+        telemetry.finish_request(error=type(exception).__name__)   # The response interceptor doesn't run after an exception
 
         speak_output = "Sorry, please try again. "
 
@@ -534,25 +465,67 @@ class CatchAllExceptionHandler(AbstractExceptionHandler):
         )
 
 
+class RequestMetricsInterceptor(AbstractRequestInterceptor):
+    """ Starts measuring each sampled request before its handler runs (see telemetry.py). """
+    def process(self, handler_input):
+        # type: (HandlerInput) -> None
+        telemetry.start_request(handler_input)
+
+
+class ResponseMetricsInterceptor(AbstractResponseInterceptor):
+    """ Emits the request's latency metrics once its handler has returned. """
+    def process(self, handler_input, response):
+        # type: (HandlerInput, Response) -> None
+        telemetry.finish_request()
+
+
+# The router maps each request type / intent name straight to its handler. Make sure any new
+# handlers you've defined are routed below - they're also registered with the SkillBuilder, in
+# this order, as the linear handler chain behind the router.
+
+router = IntentRouter()
+
+router.add(LaunchRequestHandler(), request_type="LaunchRequest")
+router.add(GetLastReadIntentHandler(), intent_names=["GetLastReadIntent"])
+router.add(AddReadInstanceIntentHandler(), intent_names=["AddReadInstanceIntent"])
+router.add(DeleteLastReadInstanceIntentHandler(), intent_names=["DeleteLastReadInstanceIntent"])
+router.add(GetNumberOfTimesReadIntentHandler(), intent_names=["GetNumberOfTimesReadIntent"])
+router.add(LastTimeReadIntentHandler(), intent_names=["LastTimeReadIntent"])
+router.add(HowManyBooksReadDuringYearIntent(), intent_names=["HowManyBooksReadDuringYearIntent"])
+router.add(BrowseBooksIntentHandler(), intent_names=["BrowseBooksIntent"])
+router.add(NextBooksPageIntentHandler(), intent_names=["AMAZON.NextIntent"])
+router.add(HelpIntentHandler(), intent_names=["AMAZON.HelpIntent"])
+router.add(CancelOrStopIntentHandler(), intent_names=["AMAZON.CancelIntent", "AMAZON.StopIntent"])
+router.add(SessionEndedRequestHandler(), request_type="SessionEndedRequest")
+
+# The sample/debugging handlers are only registered when ENABLE_DEBUG_HANDLERS=1
+if ENABLE_DEBUG_HANDLERS:
+    router.add(HelloWorldIntentHandler(), intent_names=["HelloWorldIntent"])
+    router.set_fallback(IntentReflectorHandler()) # Any intent without its own handler is reflected back
+else:
+    router.set_fallback(FallbackIntentHandler()) # AMAZON.FallbackIntent, and any intent without its own handler
+
 # The SkillBuilder object acts as the entry point for your skill, routing all request and response
-# payloads to the handlers above. Make sure any new handlers or interceptors you've
-# defined are included below. The order matters - they're processed top to bottom.
+# payloads to the handlers above.
 
 sb = SkillBuilder()
 
-sb.add_request_handler(LaunchRequestHandler())
-sb.add_request_handler(GetLastReadIntentHandler())
-sb.add_request_handler(AddReadInstanceIntentHandler())
-sb.add_request_handler(DeleteLastReadInstanceIntentHandler())
-sb.add_request_handler(GetNumberOfTimesReadIntentHandler())
-sb.add_request_handler(LastTimeReadIntentHandler())
-sb.add_request_handler(HowManyBooksReadDuringYearIntent())
-sb.add_request_handler(HelloWorldIntentHandler())
-sb.add_request_handler(HelpIntentHandler())
-sb.add_request_handler(CancelOrStopIntentHandler())
-sb.add_request_handler(SessionEndedRequestHandler())
-sb.add_request_handler(IntentReflectorHandler()) # make sure IntentReflectorHandler is last so it doesn't override your custom intent handlers
+for handler in router.handlers:
+    sb.add_request_handler(handler)
 
 sb.add_exception_handler(CatchAllExceptionHandler())
 
-lambda_handler = sb.lambda_handler()
+sb.add_global_request_interceptor(RequestMetricsInterceptor())
+sb.add_global_response_interceptor(ResponseMetricsInterceptor())
+
+skill_handler = create_lambda_handler(sb, router)
+
+
+def lambda_handler(event, context):
+    """ Lambda entry point: Alexa requests go to the skill, batches from the write-behind queue to the drain,
+        and scheduled keep-warm pings to keep_warm """
+    if keep_warm.is_keep_warm_event(event):
+        return keep_warm.handle_keep_warm_event(event, get_storage())
+    if write_behind.is_queue_event(event):
+        return write_behind.handle_queue_event(event, get_storage())
+    return skill_handler(event, context)
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+# Versioned schema migrations for the book database.
+# Each migration has a list of steps to apply it and a list to roll it back. A step is either an
+# SQL string or a function taking a cursor. Applied versions are recorded in schema_migrations.
+#
+#   python migrations.py status
+#   python migrations.py up [version]       Apply pending migrations (up to version, if given)
+#   python migrations.py down <version>     Roll back every migration above version
+#   python migrations.py check              EXPLAIN the handler queries and fail on any full table scan
+import sys
+import logging
+
+import queries
+
+from converters import overall_format_from_mask, context_separator
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+CREATE_SCHEMA_MIGRATIONS = (
+    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+    "version INT NOT NULL, "
+    "name VARCHAR(100) NOT NULL, "
+    "applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+    "PRIMARY KEY (version))")
+
+
+class Migration(object):
+    def __init__(self, version, name, up, down):
+        self.version = version
+        self.name = name
+        self.up = up
+        self.down = down
+
+
+def index_exists(cursor, table, index_name):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.statistics "
+                   "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+                   (table, index_name))
+    return cursor.fetchone()[0] > 0
+
+
+def add_index(table, index_name, definition):
+    """ Step that adds an index unless it's already there (e.g. added by hand from the README) """
+    def step(cursor):
+        if not index_exists(cursor, table, index_name):
+            cursor.execute("ALTER TABLE {} ADD {}".format(table, definition))
+    return step
+
+
+def drop_index(table, index_name):
+    def step(cursor):
+        if index_exists(cursor, table, index_name):
+            cursor.execute("ALTER TABLE {} DROP INDEX {}".format(table, index_name))
+    return step
+
+
+def restore_overall_columns_sql():
+    """ Rolling back migration 7: overall_format named from format_mask, and overall_context joined
+        from the readings' contexts in id order, as the books row used to store them """
+    names = " ".join("WHEN {} THEN '{}'".format(mask, overall_format_from_mask(mask)) for mask in range(8))
+    return ("UPDATE books b JOIN (SELECT title, author, "
+            "GROUP_CONCAT(IFNULL(read_context, '') ORDER BY id SEPARATOR '" + context_separator + "') AS overall_context "
+            "FROM read_instances GROUP BY title, author) c ON c.title = b.title AND c.author = b.author "
+            "SET b.overall_format = CASE b.format_mask " + names + " ELSE '' END, b.overall_context = c.overall_context")
+
+
+def reading_stats_triggers(partitioned, bump_version=False):
+    """ The triggers keeping reading_stats up to date, counting per tenant if partitioned (migration 9),
+        and bumping the library_version of the tenants whose readings changed if bump_version (migration 10) """
+    tenant_column, tenant_value, tenant_match = ("tenant_id, ", "NEW.tenant_id, ", "tenant_id = OLD.tenant_id AND ") if partitioned else ("", "", "")
+    insert = ("INSERT INTO reading_stats (" + tenant_column + "read_year, read_month, read_format, books_read) "
+              "VALUES (" + tenant_value + "NEW.read_year, IFNULL(NEW.read_month, ''), IFNULL(NEW.read_format, ''), 1) "
+              "ON DUPLICATE KEY UPDATE books_read = books_read + 1")
+    decrement = ("UPDATE reading_stats SET books_read = books_read - 1 "
+                 "WHERE " + tenant_match + "read_year = OLD.read_year AND read_month = IFNULL(OLD.read_month, '') "
+                 "AND read_format = IFNULL(OLD.read_format, '')")
+    if not bump_version:
+        return ["CREATE TRIGGER reading_stats_insert AFTER INSERT ON read_instances FOR EACH ROW " + insert,
+                "CREATE TRIGGER reading_stats_delete AFTER DELETE ON read_instances FOR EACH ROW " + decrement,
+                "CREATE TRIGGER reading_stats_update AFTER UPDATE ON read_instances FOR EACH ROW BEGIN " + decrement + "; " + insert + "; END"]
+    bump = ("INSERT INTO library_version (tenant_id, version) VALUES ({}.tenant_id, 1) "
+            "ON DUPLICATE KEY UPDATE version = version + 1")
+    return ["CREATE TRIGGER reading_stats_insert AFTER INSERT ON read_instances FOR EACH ROW BEGIN " +
+            insert + "; " + bump.format("NEW") + "; END",
+            "CREATE TRIGGER reading_stats_delete AFTER DELETE ON read_instances FOR EACH ROW BEGIN " +
+            decrement + "; " + bump.format("OLD") + "; END",
+            "CREATE TRIGGER reading_stats_update AFTER UPDATE ON read_instances FOR EACH ROW BEGIN " +
+            decrement + "; " + insert + "; " + bump.format("OLD") + "; " + bump.format("NEW") + "; END"]
+
+
+DROP_READING_STATS_TRIGGERS = ["DROP TRIGGER IF EXISTS reading_stats_insert",
+                               "DROP TRIGGER IF EXISTS reading_stats_delete",
+                               "DROP TRIGGER IF EXISTS reading_stats_update"]
+
+
+MIGRATIONS = [
+    Migration(1, "books unique title/author",
+        up=[add_index("books", "books_title_author", "UNIQUE KEY books_title_author (title, author)")],
+        down=[drop_index("books", "books_title_author")]),
+
+    Migration(2, "read_instances lookup indexes",
+        up=[add_index("read_instances", "read_instances_title_author", "INDEX read_instances_title_author (title, author, id)"),
+            add_index("read_instances", "read_instances_read_year", "INDEX read_instances_read_year (read_year)")],
+        down=[drop_index("read_instances", "read_instances_title_author"),
+              drop_index("read_instances", "read_instances_read_year")]),
+
+    Migration(3, "books title fulltext index",
+        up=[add_index("books", "books_title_fulltext", "FULLTEXT INDEX books_title_fulltext (title)")],
+        down=[drop_index("books", "books_title_fulltext")]),
+
+    # Counts maintained by triggers, so they change in the same transaction as read_instances
+    # without the handlers sending any extra statements
+    Migration(4, "reading_stats summary table",
+        up=["CREATE TABLE reading_stats ("
+            "read_year YEAR NOT NULL, "
+            "read_month VARCHAR(10) NOT NULL DEFAULT '', "
+            "read_format VARCHAR(20) NOT NULL DEFAULT '', "
+            "books_read INT NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (read_year, read_month, read_format))"]
+           + reading_stats_triggers(partitioned=False) +
+           ["INSERT INTO reading_stats (read_year, read_month, read_format, books_read) "
+            "SELECT read_year, IFNULL(read_month, ''), IFNULL(read_format, ''), COUNT(*) FROM read_instances "
+            "GROUP BY read_year, IFNULL(read_month, ''), IFNULL(read_format, '')"],
+        down=DROP_READING_STATS_TRIGGERS + ["DROP TABLE IF EXISTS reading_stats"]),
+
+    # Lets the browse intent page through an author's books in title order
+    Migration(5, "books author index",
+        up=[add_index("books", "books_author_title", "INDEX books_author_title (author, title)")],
+        down=[drop_index("books", "books_author_title")]),
+
+    # A counter every write bumps, so in-memory snapshots of the library can tell they're stale
+    Migration(6, "library_version stamp",
+        up=["CREATE TABLE library_version (id TINYINT NOT NULL, version BIGINT NOT NULL, PRIMARY KEY (id))",
+            "INSERT INTO library_version (id, version) VALUES (1, 0)"],
+        down=["DROP TABLE IF EXISTS library_version"]),
+
+    # A reread becomes a constant-size update: formats are OR'ed into a bitmask, and contexts are
+    # read from read_instances when needed instead of being appended to a growing TEXT column
+    Migration(7, "books format_mask replaces overall_format and overall_context",
+        up=["ALTER TABLE books ADD COLUMN format_mask TINYINT UNSIGNED NOT NULL DEFAULT 0",
+            "UPDATE books b JOIN (SELECT title, author, " + queries.format_mask_sql() + " AS format_mask "
+            "FROM read_instances GROUP BY title, author) m ON m.title = b.title AND m.author = b.author "
+            "SET b.format_mask = m.format_mask",
+            "ALTER TABLE books DROP COLUMN overall_format, DROP COLUMN overall_context"],
+        down=["ALTER TABLE books ADD COLUMN overall_format VARCHAR(20) NULL DEFAULT NULL, ADD COLUMN overall_context TEXT",
+              "SET SESSION group_concat_max_len = 1048576",     # The default 1024 bytes would cut long contexts short
+              restore_overall_columns_sql(),
+              "ALTER TABLE books DROP COLUMN format_mask"]),
+
+    # Ids of the readings queued by write_behind.py that have been applied, so redelivered ones are skipped
+    Migration(8, "applied_writes",
+        up=["CREATE TABLE applied_writes ("
+            "id CHAR(32) NOT NULL, "
+            "applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+            "PRIMARY KEY (id))"],
+        down=["DROP TABLE IF EXISTS applied_writes"]),
+
+    # One library per Alexa user. tenant_id leads every key of the library tables, so a user's
+    # lookups read their own rows however many users there are. The full-text index can't include
+    # tenant_id, and would match titles across every library, so it goes. The existing rows become
+    # tenant 1, unclaimed until "python tenants.py claim". Rolling back keeps tenant 1's library only.
+    Migration(9, "tenant partitioning",
+        up=["CREATE TABLE tenants ("
+            "id INT UNSIGNED NOT NULL AUTO_INCREMENT, "
+            "user_id VARCHAR(255) NOT NULL, "
+            "created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+            "PRIMARY KEY (id), "
+            "UNIQUE KEY tenants_user_id (user_id))",
+            "INSERT INTO tenants (id, user_id) VALUES (1, '')"]
+           + DROP_READING_STATS_TRIGGERS +
+           ["ALTER TABLE read_instances ADD COLUMN tenant_id INT UNSIGNED NOT NULL DEFAULT 1 AFTER id, "
+            "ADD INDEX read_instances_tenant (tenant_id), "
+            "DROP INDEX read_instances_title_author, ADD INDEX read_instances_title_author (tenant_id, title, author, id), "
+            "DROP INDEX read_instances_read_year, ADD INDEX read_instances_read_year (tenant_id, read_year)",
+            "ALTER TABLE books ADD COLUMN tenant_id INT UNSIGNED NOT NULL DEFAULT 1 AFTER id, "
+            "DROP INDEX books_title_author, ADD UNIQUE KEY books_title_author (tenant_id, title, author), "
+            "DROP INDEX books_author_title, ADD INDEX books_author_title (tenant_id, author, title), "
+            "DROP INDEX books_title_fulltext",
+            "ALTER TABLE reading_stats ADD COLUMN tenant_id INT UNSIGNED NOT NULL DEFAULT 1 FIRST, "
+            "DROP PRIMARY KEY, ADD PRIMARY KEY (tenant_id, read_year, read_month, read_format)",
+            "UPDATE library_version SET id = 1",
+            "ALTER TABLE library_version CHANGE id tenant_id INT UNSIGNED NOT NULL"]
+           + reading_stats_triggers(partitioned=True),
+        down=DROP_READING_STATS_TRIGGERS +
+             ["DELETE FROM read_instances WHERE tenant_id <> 1",
+              "DELETE FROM books WHERE tenant_id <> 1",
+              "DELETE FROM reading_stats WHERE tenant_id <> 1",
+              "DELETE FROM library_version WHERE tenant_id <> 1",
+              "ALTER TABLE read_instances DROP INDEX read_instances_tenant, "
+              "DROP INDEX read_instances_title_author, ADD INDEX read_instances_title_author (title, author, id), "
+              "DROP INDEX read_instances_read_year, ADD INDEX read_instances_read_year (read_year), "
+              "DROP COLUMN tenant_id",
+              "ALTER TABLE books DROP INDEX books_title_author, ADD UNIQUE KEY books_title_author (title, author), "
+              "DROP INDEX books_author_title, ADD INDEX books_author_title (author, title), "
+              "ADD FULLTEXT INDEX books_title_fulltext (title), "
+              "DROP COLUMN tenant_id",
+              "ALTER TABLE reading_stats DROP PRIMARY KEY, DROP COLUMN tenant_id, "
+              "ADD PRIMARY KEY (read_year, read_month, read_format)",
+              "ALTER TABLE library_version CHANGE tenant_id id TINYINT NOT NULL",
+              "DROP TABLE IF EXISTS tenants"]
+             + reading_stats_triggers(partitioned=False)),
+
+    # A write changes library_version in the statement that changes the readings, rather than in
+    # a round trip of its own. Writes that change books only (importer.rebuild_books,
+    # book_aggregates.repair) still bump it themselves.
+    Migration(10, "library_version bumped by triggers",
+        up=DROP_READING_STATS_TRIGGERS + reading_stats_triggers(partitioned=True, bump_version=True),
+        down=DROP_READING_STATS_TRIGGERS + reading_stats_triggers(partitioned=True)),
+]
+
+
+def current_version(cursor):
+    cursor.execute(CREATE_SCHEMA_MIGRATIONS)
+    cursor.execute("SELECT MAX(version) FROM schema_migrations")
+    version = cursor.fetchone()[0]
+    return version or 0
+
+
+def run_steps(cursor, steps):
+    for step in steps:
+        if callable(step):
+            step(cursor)
+        else:
+            cursor.execute(step)
+
+
+def migrate(connection, target=None):
+    """ Apply every migration above the current version, up to target (default: all of them).
+        Returns the versions applied. """
+    cursor = connection.cursor(buffered=True)
+    version = current_version(cursor)
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= version or (target is not None and migration.version > target):
+            continue
+        logger.info("Applying migration %d: %s", migration.version, migration.name)
+        run_steps(cursor, migration.up)
+        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                       (migration.version, migration.name))
+        connection.commit()
+        applied.append(migration.version)
+    return applied
+
+
+def rollback(connection, target):
+    """ Roll back every applied migration above target, newest first. Returns the versions rolled back. """
+    cursor = connection.cursor(buffered=True)
+    version = current_version(cursor)
+    rolled_back = []
+    for migration in reversed(MIGRATIONS):
+        if migration.version > version or migration.version <= target:
+            continue
+        logger.info("Rolling back migration %d: %s", migration.version, migration.name)
+        run_steps(cursor, migration.down)
+        cursor.execute("DELETE FROM schema_migrations WHERE version = %s", (migration.version,))
+        connection.commit()
+        rolled_back.append(migration.version)
+    return rolled_back
+
+
+# Handler queries with representative parameters, for the EXPLAIN check
+PLAN_CHECKS = [
+    ("tenant for user", queries.TENANT_FOR_USER, ("amzn1.ask.account.EXAMPLE",)),
+    ("last read", queries.LAST_READ, (1,)),
+    ("last read instance", queries.LAST_READ_INSTANCE, (1,)),
+    ("delete last read instance", queries.DELETE_LAST_READ_INSTANCE, (1,)),
+    ("count for year", queries.COUNT_FOR_YEAR, (1, 2020)),
+    ("select book", queries.SELECT_BOOK, (1, "Dune", "Frank Herbert")),
+    ("rebuild book", queries.REBUILD_BOOK, (1, "Dune", "Frank Herbert")),
+    ("upsert book", queries.UPSERT_BOOK, (1, "Dune", "Frank Herbert", 2020, "Jan", "0", 2020, "Jan", 1)),
+    ("book contexts", queries.BOOK_CONTEXTS, (1, "Dune", "Frank Herbert")),
+    ("delete book without readings", queries.DELETE_BOOK_WITHOUT_READINGS, (1, "Dune", "Frank Herbert", 1, "Dune", "Frank Herbert")),
+    ("times read by title",) + queries.times_read_query(1, "Dune"),
+    ("times read by title and author",) + queries.times_read_query(1, "Dune", "Frank Herbert"),
+    ("book summaries", queries.BOOK_SUMMARIES, (1,)),
+    ("readings in year page", queries.READINGS_IN_YEAR_PAGE, (1, 2020, 0, 6)),
+    ("books by author page", queries.BOOKS_BY_AUTHOR_PAGE, (1, "Frank Herbert", "", 6)),
+    ("library version", queries.LIBRARY_VERSION, (1,)),
+    ("bump library version", queries.BUMP_LIBRARY_VERSION, (1,)),
+    ("insert applied write", queries.INSERT_APPLIED_WRITE, ("0123456789abcdef",)),
+    ("applied writes", queries.applied_writes_query(2), ("0123456789abcdef", "fedcba9876543210")),
+]
+
+
+def check_query_plans(connection):
+    """ EXPLAIN each handler query and return a description of every table it would
+        read with a full scan (access type ALL). An empty list means every query uses an index.
+        Derived tables are skipped: scanning a query's own grouped result is expected. So is the
+        INSERT row of an INSERT ... VALUES, which MySQL reports as ALL though it reads nothing. """
+    cursor = connection.cursor(buffered=True)
+    failures = []
+    for name, sql, params in PLAN_CHECKS:
+        cursor.execute("EXPLAIN " + sql, params)
+        columns = [column[0] for column in cursor.description]
+        for row in cursor.fetchall():
+            plan = dict(zip(columns, row))
+            if plan.get("select_type") == "INSERT":
+                continue
+            if plan.get("type") == "ALL" and not str(plan.get("table")).startswith("<derived"):
+                failures.append("{}: full scan of {}".format(name, plan.get("table")))
+    return failures
+
+
+def main(argv):
+    import database
+
+    command = argv[1] if len(argv) > 1 else "status"
+    connection = database.connect()
+    try:
+        if command == "up":
+            applied = migrate(connection, int(argv[2]) if len(argv) > 2 else None)
+            print("Applied: {}".format(applied or "nothing to do"))
+        elif command == "down":
+            rolled_back = rollback(connection, int(argv[2]))
+            print("Rolled back: {}".format(rolled_back or "nothing to do"))
+        elif command == "check":
+            failures = check_query_plans(connection)
+            for failure in failures:
+                print(failure)
+            print("{} full table scan(s)".format(len(failures)))
+            return 1 if failures else 0
+        else:
+            version = current_version(connection.cursor(buffered=True))
+            print("Schema version {} of {}".format(version, MIGRATIONS[-1].version))
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
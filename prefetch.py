@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# Answers prefetched when the skill is launched, kept in the session attributes for the rest of the session.
+# The LaunchRequest handler fetches what's asked most - the last book read and this year's count -
+# concurrently, and loads the title search index, so the first question of the session finds a
+# pooled connection already open and its answer already there. Session attributes travel with
+# each request, so follow-up questions are answered from them even when they reach a different
+# Lambda container than the launch did:
+#
+#   {"prefetched": {"last_read": ["Dune", "Frank Herbert"], "year": 2021, "count_for_year": 12}}
+#
+# Writes in the session drop the prefetched answers (see invalidate), and the handlers go back to
+# storage. Writes from other sessions aren't seen until the next launch.
+import logging
+import datetime
+
+import title_index
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+SESSION_KEY = "prefetched"
+
+
+def prefetch(session_attributes, get_storage):
+    """ Fetch the hot answers into session_attributes, from the storage get_storage() returns. That's
+        called here, since finding the user's library is a query too. A failure is logged rather than
+        raised: the launch still works, and the handlers will ask storage themselves. """
+    import async_storage    # Its thread pool is only needed once a session is launched, so it isn't loaded at cold start
+    year = datetime.datetime.now().year
+    try:
+        storage = get_storage()
+        last_read, count, index = async_storage.gather(storage.last_read,
+                                                       lambda: storage.count_for_year(year),
+                                                       lambda: title_index.get_title_index(storage))
+    except Exception:
+        logger.warning("Could not prefetch on launch", exc_info=True)
+        return
+    session_attributes[SESSION_KEY] = {"last_read": list(last_read) if last_read else None,
+                                       "year": year, "count_for_year": count}
+
+
+def last_read(session_attributes, storage):
+    """ (title, author) of the last reading added, or None - from the session if prefetched """
+    prefetched = session_attributes.get(SESSION_KEY)
+    if prefetched is not None:
+        return tuple(prefetched["last_read"]) if prefetched["last_read"] else None
+    return storage.last_read()
+
+
+def count_for_year(session_attributes, storage, year):
+    prefetched = session_attributes.get(SESSION_KEY)
+    if prefetched is not None and str(prefetched["year"]) == str(year):
+        return prefetched["count_for_year"]
+    return storage.count_for_year(year)
+
+
+def invalidate(session_attributes):
+    """ Called after a write in the session, which may have changed the prefetched answers """
+    session_attributes.pop(SESSION_KEY, None)
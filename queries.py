@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+# Data-access layer for the book database.
+# All the SQL the intent handlers run lives here as parameterized statements. They are sent
+# to MySQL as server-side prepared statements, prepared once per connection and reused, so
+# repeat requests on a warm connection skip the parse, and user text never has to be escaped.
+#
+# YEAR columns are selected as "column + 0": mysql-connector 8.0.22 can't decode YEAR values
+# sent over the binary (prepared statement) protocol, but reads the resulting integer fine.
+#
+# Each library belongs to a tenant (see tenants.py), and the statements on one library take its
+# tenant_id as their first parameter.
+from converters import format_bits
+
+
+# tenants
+TENANT_FOR_USER = "SELECT id FROM tenants WHERE user_id = %s"
+INSERT_TENANT = "INSERT IGNORE INTO tenants (user_id) VALUES (%s)"
+CLAIM_TENANT = "UPDATE tenants SET user_id = %s WHERE id = %s AND user_id = ''"
+# Merging an unclaimed library into another tenant's (tenants.py claim --force)
+UNCLAIMED_TENANT = "SELECT id FROM tenants WHERE id = %s AND user_id = '' FOR UPDATE"
+MOVE_TENANT_READINGS = "UPDATE read_instances SET tenant_id = %s WHERE tenant_id = %s"
+DELETE_TENANT_BOOKS = "DELETE FROM books WHERE tenant_id = %s"
+DELETE_TENANT_READING_STATS = "DELETE FROM reading_stats WHERE tenant_id = %s"
+DELETE_TENANT_LIBRARY_VERSION = "DELETE FROM library_version WHERE tenant_id = %s"
+TENANT_SIZES = ("SELECT t.id, t.user_id, COUNT(b.id) FROM tenants t LEFT JOIN books b ON b.tenant_id = t.id "
+                "GROUP BY t.id, t.user_id ORDER BY t.id")
+
+# read_instances
+LAST_READ = "SELECT title, author FROM read_instances WHERE id = (SELECT MAX(id) FROM read_instances WHERE tenant_id = %s)"
+LAST_READ_INSTANCE = "SELECT title, author, read_year + 0 FROM read_instances WHERE tenant_id = %s ORDER BY id DESC LIMIT 1"
+# The columns are named, so executemany() can also send a whole batch as one multi-row INSERT
+INSERT_READ_INSTANCE = ("INSERT INTO read_instances (tenant_id, title, author, read_year, read_month, unsure, read_format, read_context) "
+                        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
+DELETE_LAST_READ_INSTANCE = "DELETE FROM read_instances WHERE tenant_id = %s ORDER BY id DESC LIMIT 1"
+# Keyset pages for browsing: the rows after the last one of the previous page, in index order
+READINGS_IN_YEAR_PAGE = ("SELECT id, title, author FROM read_instances WHERE tenant_id = %s AND read_year = %s AND id > %s "
+                         "ORDER BY id LIMIT %s")
+
+# reading_stats - per year/month/format reading counts, kept up to date by triggers on read_instances
+COUNT_FOR_YEAR = "SELECT CAST(IFNULL(SUM(books_read), 0) AS SIGNED) FROM reading_stats WHERE tenant_id = %s AND read_year = %s"
+READING_STATS = "SELECT tenant_id, read_year + 0, read_month, read_format, books_read FROM reading_stats WHERE books_read <> 0"
+RECOMPUTED_READING_STATS = ("SELECT tenant_id, read_year + 0, IFNULL(read_month, ''), IFNULL(read_format, ''), COUNT(*) "
+                            "FROM read_instances GROUP BY tenant_id, read_year, IFNULL(read_month, ''), IFNULL(read_format, '')")
+CLEAR_READING_STATS = "DELETE FROM reading_stats"
+REBUILD_READING_STATS = ("INSERT INTO reading_stats (tenant_id, read_year, read_month, read_format, books_read) "
+                         "SELECT tenant_id, read_year, IFNULL(read_month, ''), IFNULL(read_format, ''), COUNT(*) FROM read_instances "
+                         "GROUP BY tenant_id, read_year, IFNULL(read_month, ''), IFNULL(read_format, '')")
+
+# books
+SELECT_BOOK = ("SELECT id, title, author, first_read_year + 0, first_read_month, unsure, last_read_year + 0, last_read_month, "
+               "times_read, format_mask FROM books WHERE tenant_id = %s AND title = %s AND author = %s")
+# A book's contexts, in reading order - joined with context_separator they're its overall context
+BOOK_CONTEXTS = "SELECT read_context FROM read_instances WHERE tenant_id = %s AND title = %s AND author = %s ORDER BY id"
+# Read along the tenant's part of the books_title_author key, so the cost depends on the size of
+# the user's own library and not on the whole table
+TIMES_READ_BY_TITLE = "SELECT times_read FROM books WHERE tenant_id = %s AND title LIKE %s"
+TIMES_READ_BY_TITLE_AND_AUTHOR = "SELECT times_read FROM books WHERE tenant_id = %s AND title LIKE %s AND author LIKE %s"
+BOOK_SUMMARIES = "SELECT id, title, author, last_read_year + 0, last_read_month FROM books WHERE tenant_id = %s"   # Loads the title search index
+BOOK_SUMMARY = ("SELECT id, title, author, last_read_year + 0, last_read_month FROM books "
+                "WHERE tenant_id = %s AND title = %s AND author = %s")
+BOOKS_BY_AUTHOR_PAGE = "SELECT title, author FROM books WHERE tenant_id = %s AND author = %s AND title > %s ORDER BY title LIMIT %s"
+
+# library_version - bumped in every transaction that changes a library's readings or books, so a
+# snapshot (snapshot.py) can tell whether it's stale. The read_instances triggers bump it for each
+# reading added or deleted (migration 10); BUMP_LIBRARY_VERSION is for writes that change books
+# only. A tenant's row is added by its first write.
+LIBRARY_VERSION = "SELECT version FROM library_version WHERE tenant_id = %s"
+BUMP_LIBRARY_VERSION = ("INSERT INTO library_version (tenant_id, version) VALUES (%s, 1) "
+                        "ON DUPLICATE KEY UPDATE version = version + 1")
+# applied_writes - ids of the readings write_behind.py has queued and a drain has applied, so each
+# is applied once however many times it's delivered
+INSERT_APPLIED_WRITE = "INSERT IGNORE INTO applied_writes (id) VALUES (%s)"
+
+def applied_writes_query(count):
+    return "SELECT id FROM applied_writes WHERE id IN ({})".format(", ".join(["%s"] * count))
+
+SNAPSHOT_BOOKS = ("SELECT id, title, author, times_read, last_read_year + 0, last_read_month FROM books "
+                  "WHERE tenant_id = %s ORDER BY id")
+SNAPSHOT_READINGS = "SELECT title, author, read_year + 0 FROM read_instances WHERE tenant_id = %s ORDER BY id"
+
+
+
+def format_mask_sql(over=""):
+    """ SQL aggregate giving the format_mask of a group of readings: the bit of each format
+        (converters.format_bits) any of them was read in. over is a window clause, for SQLite. """
+    return "(" + " + ".join("IFNULL(MAX(read_format = '{}'){}, 0) * {}".format(read_format, over, bit)
+                            for read_format, bit in sorted(format_bits.items(), key=lambda item: item[1])) + ")"
+
+
+# Adds a book on its first reading, or updates it in place on a reread: a constant-size write however
+# many times the book has been read. Relies on the unique (tenant_id, title, author) key on books.
+UPSERT_BOOK = (
+    "INSERT INTO books (tenant_id, title, author, first_read_year, first_read_month, unsure, last_read_year, last_read_month, "
+    "times_read, format_mask) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 1, %s) "
+    "ON DUPLICATE KEY UPDATE "
+    "times_read = times_read + 1, "
+    "last_read_year = VALUES(last_read_year), "
+    "last_read_month = VALUES(last_read_month), "
+    "format_mask = format_mask | VALUES(format_mask)")
+
+
+def recomputed_books_sql(where=""):
+    """ Set-based recompute of books rows from read_instances: one grouped query over the readings matched
+        by where (a condition on read_instances columns, e.g. "WHERE tenant_id = %s AND title = %s AND author = %s").
+        Readings count in id order, the order they were added, so each row is what adding the readings
+        one at a time would have produced: first/last read and unsure from the first and last readings,
+        and the formats of them all. """
+    return (
+        "SELECT f.tenant_id, f.title, f.author, f.read_year, f.read_month, f.unsure, l.read_year, l.read_month, g.times_read, g.format_mask "
+        "FROM (SELECT MIN(id) AS first_id, MAX(id) AS last_id, COUNT(*) AS times_read, " + format_mask_sql() + " AS format_mask "
+        "FROM read_instances " + where + " GROUP BY tenant_id, title, author) g "
+        "JOIN read_instances f ON f.id = g.first_id "
+        "JOIN read_instances l ON l.id = g.last_id")
+
+
+def rebuild_books_sql(where=""):
+    """ Writes recomputed_books_sql(where) over the books rows. Books with no readings are left alone. """
+    return (
+        "INSERT INTO books (tenant_id, title, author, first_read_year, first_read_month, unsure, last_read_year, last_read_month, "
+        "times_read, format_mask) " + recomputed_books_sql(where) + " "
+        "ON DUPLICATE KEY UPDATE "
+        "first_read_year = VALUES(first_read_year), "
+        "first_read_month = VALUES(first_read_month), "
+        "unsure = VALUES(unsure), "
+        "last_read_year = VALUES(last_read_year), "
+        "last_read_month = VALUES(last_read_month), "
+        "times_read = VALUES(times_read), "
+        "format_mask = VALUES(format_mask)")
+
+
+REBUILD_BOOKS = rebuild_books_sql()
+REBUILD_TENANT_BOOKS = rebuild_books_sql("WHERE tenant_id = %s")
+REBUILD_BOOK = rebuild_books_sql("WHERE tenant_id = %s AND title = %s AND author = %s")
+DELETE_BOOK_WITHOUT_READINGS = ("DELETE FROM books WHERE tenant_id = %s AND title = %s AND author = %s "
+                                "AND NOT EXISTS (SELECT 1 FROM read_instances WHERE tenant_id = %s AND title = %s AND author = %s)")
+
+# Repairing books in batches of (tenant_id, title, author) keys, in index order
+COUNT_READ_BOOKS = "SELECT COUNT(*) FROM (SELECT DISTINCT tenant_id, title, author FROM read_instances) books_read"
+NEXT_BOOK_KEYS = ("SELECT DISTINCT tenant_id, title, author FROM read_instances WHERE (tenant_id, title, author) > (%s, %s, %s) "
+                  "ORDER BY tenant_id, title, author LIMIT %s")
+BOOK_KEY_RANGE = "WHERE (tenant_id, title, author) > (%s, %s, %s) AND (tenant_id, title, author) <= (%s, %s, %s)"
+REBUILD_BOOK_RANGE = rebuild_books_sql(BOOK_KEY_RANGE)
+RECOMPUTED_BOOK_RANGE = recomputed_books_sql(BOOK_KEY_RANGE)
+BOOK_AGGREGATES_RANGE = ("SELECT tenant_id, title, author, first_read_year + 0, first_read_month, unsure, last_read_year + 0, "
+                         "last_read_month, times_read, format_mask FROM books " + BOOK_KEY_RANGE)
+# Every library with a book in the range from one tenant_id to another
+BUMP_LIBRARY_VERSION_RANGE = "UPDATE library_version SET version = version + 1 WHERE tenant_id BETWEEN %s AND %s"
+
+
+def times_read_query(tenant_id, title, author=None):
+    """ Statement and parameters looking up how many times a book in the tenant's library was read by (part of) its title """
+    if author is not None:
+        return TIMES_READ_BY_TITLE_AND_AUTHOR, (tenant_id, like_pattern(title), like_pattern(author))
+    return TIMES_READ_BY_TITLE, (tenant_id, like_pattern(title))
+
+
+def like_pattern(text):
+    """ Turn spoken text into a LIKE pattern matching it anywhere in the column.
+        LIKE wildcards in the text itself are escaped so they match literally. """
+    text = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return "%" + text + "%"
+
+
+class StatementCache(object):
+    """ Prepared statements for one connection, keyed by SQL text.
+
+        A mysql.connector prepared cursor holds a single statement, so each distinct
+        statement gets its own cursor and is only prepared the first time it runs.
+        Result rows are read in full on execute, which lets statements be interleaved
+        freely on the same connection. Used like a regular cursor:
+
+            cursor.execute(queries.SELECT_BOOK, (title, author))
+            row = cursor.fetchone()
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+        self.lastrowid = None
+        self._cursors = {}
+        self._rows = []
+
+    def _cursor_for(self, sql):
+        cursor = self._cursors.get(sql)
+        if cursor is None:
+            cursor = self.connection.cursor(prepared=True)
+            self._cursors[sql] = cursor
+        return cursor
+
+    def execute(self, sql, params=()):
+        cursor = self._cursor_for(sql)
+        cursor.execute(sql, tuple(params))
+        self._rows = cursor.fetchall() if cursor.with_rows else []
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+        return self
+
+    def fetchone(self):
+        if self._rows:
+            return self._rows.pop(0)
+        return None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def clear(self):
+        """ Forget every prepared statement, e.g. after the connection was re-established
+            (the server drops prepared statements along with the session). """
+        for cursor in self._cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self._cursors = {}
+        self._rows = []
+
+    def close(self):
+        # Statements stay prepared for the next request on this connection; only pending rows are dropped
+        self._rows = []
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# Maintenance for the reading_stats summary table (see migration 4).
+# Triggers on read_instances keep the counts current; these commands repair and verify them.
+#
+#   python reading_stats.py check      Compare reading_stats with a full recompute, exit non-zero on drift
+#   python reading_stats.py rebuild    Recompute reading_stats from read_instances
+import sys
+
+import queries
+
+from database import transaction
+
+
+def rebuild(connection):
+    """ Replace every reading_stats row with counts recomputed from read_instances, in one transaction """
+    cursor = connection.cursor()
+    with transaction(connection):
+        cursor.execute(queries.CLEAR_READING_STATS)
+        cursor.execute(queries.REBUILD_READING_STATS)
+    cursor.close()
+
+
+def check(connection):
+    """ List every (tenant, year, month, format) whose materialized count differs from a full recompute,
+        as (tenant_id, read_year, read_month, read_format, materialized, actual). Empty means consistent. """
+    cursor = connection.cursor()
+    cursor.execute(queries.READING_STATS)
+    materialized = {row[:4]: row[4] for row in cursor.fetchall()}
+    cursor.execute(queries.RECOMPUTED_READING_STATS)
+    actual = {row[:4]: row[4] for row in cursor.fetchall()}
+    cursor.close()
+    connection.rollback()   # End the read snapshot
+
+    drift = []
+    for key in sorted(set(materialized) | set(actual), key=lambda key: (key[0], key[1], key[2], key[3])):
+        if materialized.get(key, 0) != actual.get(key, 0):
+            drift.append(key + (materialized.get(key, 0), actual.get(key, 0)))
+    return drift
+
+
+def main(argv):
+    import database
+
+    command = argv[1] if len(argv) > 1 else "check"
+    connection = database.connect()
+    try:
+        if command == "rebuild":
+            rebuild(connection)
+            print("reading_stats rebuilt")
+        else:
+            drift = check(connection)
+            for tenant_id, read_year, read_month, read_format, materialized, actual in drift:
+                print("tenant {}: {} {} {}: reading_stats has {}, read_instances has {}".format(
+                    tenant_id, read_year, read_month or "-", read_format or "-", materialized, actual))
+            print("{} inconsistent row(s)".format(len(drift)))
+            return 1 if drift else 0
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
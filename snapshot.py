@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+# In-memory snapshot of the library for the read intents (SNAPSHOT_ENABLED=1).
+# The books table and the read_instances years are exported into one compact columnar file, which
+# a warm Lambda maps into memory and answers GetLastRead, GetNumberOfTimesRead,
+# HowManyBooksReadDuringYear and the title index load from, without a round trip to the database.
+#
+# File layout: a header, then the columns, each 8-byte aligned.
+#
+#   b"BOOKSNAP" | header length (4 bytes, little endian) | JSON header | columns...
+#
+# Numeric columns are arrays of native machine ints, read in place through memoryviews onto the
+# mapped file. Strings are stored once in a UTF-8 blob with an offsets column. Authors are interned
+# and books refer to them by number. The header holds the library_version the file was exported at,
+# the column directory and the small things (months, the last reading).
+#
+# Every write bumps library_version in its own transaction (see queries.py), the readings through
+# the read_instances triggers. A container checks the stamp every SNAPSHOT_CHECK_INTERVAL seconds,
+# and at once after its own writes. When the stamp has moved on, the snapshot is exported again
+# and reloaded.
+#
+# Each tenant's library has its own snapshot file (SNAPSHOT_PATH followed by the tenant_id) and
+# version, and a container keeps the snapshots of the TENANT_CACHE_SIZE tenants used most recently.
+# A tenant's file is deleted when its snapshot is dropped to make room for another.
+import os
+import sys
+import json
+import mmap
+import time
+import array
+import bisect
+import struct
+import tempfile
+import threading
+
+from collections import Counter
+
+import tenants
+
+
+SNAPSHOT_ENABLED = os.environ.get("SNAPSHOT_ENABLED", "0") == "1"
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "/tmp/books.snapshot")
+SNAPSHOT_CHECK_INTERVAL = float(os.environ.get("SNAPSHOT_CHECK_INTERVAL", "30"))   # Seconds between library_version checks
+
+MAGIC = b"BOOKSNAP"
+FORMAT = 1
+
+
+def string_column(strings):
+    """ (offsets array, UTF-8 blob) for a list of strings. Offsets count characters, not bytes. """
+    offsets = array.array("I", [0])
+    for string in strings:
+        offsets.append(offsets[-1] + len(string))
+    return offsets, "".join(strings).encode("utf-8")
+
+
+def snapshot_path(tenant_id):
+    return "{}-{}".format(SNAPSHOT_PATH, tenant_id)
+
+
+def export(storage, path):
+    """ Write a snapshot of storage's library to path, atomically replacing any earlier one. Returns its version. """
+    with storage.transaction() as cursor:
+        # One transaction, so the version, books and readings all agree
+        cursor.execute(storage.queries.LIBRARY_VERSION, (storage.tenant_id,))
+        row = cursor.fetchone()
+        version = row[0] if row else 0      # A library that was never written to
+        cursor.execute(storage.queries.SNAPSHOT_BOOKS, (storage.tenant_id,))
+        books = cursor.fetchall()
+        cursor.execute(storage.queries.SNAPSHOT_READINGS, (storage.tenant_id,))
+        readings = cursor.fetchall()
+
+    authors = {}
+    months = {}
+    for book_id, title, author, times_read, last_read_year, last_read_month in books:
+        authors.setdefault(author, len(authors))
+        months.setdefault(last_read_month, len(months))
+
+    title_offsets, title_blob = string_column([book[1] for book in books])
+    author_offsets, author_blob = string_column(list(authors))
+    columns = [
+        ("book_id", array.array("I", [book[0] for book in books])),
+        ("title_offsets", title_offsets),
+        ("titles", title_blob),
+        ("book_author", array.array("I", [authors[book[2]] for book in books])),
+        ("author_offsets", author_offsets),
+        ("authors", author_blob),
+        ("times_read", array.array("H", [book[3] or 0 for book in books])),
+        ("last_read_year", array.array("H", [book[4] for book in books])),
+        ("last_read_month", array.array("B", [months[book[5]] for book in books])),
+        ("reading_year", array.array("H", [reading[2] for reading in readings])),
+        ]
+
+    header = {"format": FORMAT, "version": version, "byteorder": sys.byteorder,
+              "books": len(books), "readings": len(readings), "months": list(months),
+              "last_read": list(readings[-1][:2]) if readings else None, "columns": {}}
+    data = []
+    offset = 0
+    for name, column in columns:
+        raw = column.tobytes() if isinstance(column, array.array) else column
+        typecode = column.typecode if isinstance(column, array.array) else "s"
+        header["columns"][name] = [typecode, offset, len(raw)]
+        data.append(raw + b"\0" * (-len(raw) % 8))
+        offset += len(data[-1])
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    preamble = MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes
+    preamble += b"\0" * (-len(preamble) % 8)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+    with os.fdopen(descriptor, "wb") as f:
+        f.write(preamble)
+        for raw in data:
+            f.write(raw)
+    os.replace(temporary, path)
+    return version
+
+
+def read_version(path):
+    """ library_version of the snapshot at path, or None if there isn't a readable one """
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            length = struct.unpack("<I", f.read(4))[0]
+            header = json.loads(f.read(length).decode("utf-8"))
+    except (OSError, ValueError, struct.error):
+        return None
+    return header["version"] if header.get("format") == FORMAT and header.get("byteorder") == sys.byteorder else None
+
+
+class Library(object):
+    """ A snapshot file mapped into memory. Numeric columns are views onto the mapped pages,
+        so loading costs little more than decoding the title and author strings. """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        length = struct.unpack_from("<I", self._map, len(MAGIC))[0]
+        start = len(MAGIC) + 4
+        header = json.loads(self._map[start:start + length].decode("utf-8"))
+        data_start = start + length + (-(start + length) % 8)
+
+        self.version = header["version"]
+        self.books = header["books"]
+        self.months = header["months"]
+        self._last_read = tuple(header["last_read"]) if header["last_read"] else None
+        view = memoryview(self._map)
+        columns = {}
+        for name, (typecode, offset, size) in header["columns"].items():
+            column = view[data_start + offset:data_start + offset + size]
+            columns[name] = column.tobytes().decode("utf-8") if typecode == "s" else column.cast(typecode)
+
+        self.book_id = columns["book_id"]
+        self.title_offsets = columns["title_offsets"]
+        self.titles = columns["titles"]
+        self.book_author = columns["book_author"]
+        self.author_offsets = columns["author_offsets"]
+        self.authors = columns["authors"]
+        self.times_read_column = columns["times_read"]
+        self.last_read_year = columns["last_read_year"]
+        self.last_read_month = columns["last_read_month"]
+        self.reading_year = columns["reading_year"]
+        self._year_counts = None
+
+        # Lowercased copy of the titles for case-insensitive substring search. It has to line up with
+        # title_offsets, so characters whose lowercase is longer (rare) are left as they are.
+        lowered = self.titles.lower()
+        if len(lowered) != len(self.titles):
+            lowered = "".join(c.lower() if len(c.lower()) == 1 else c for c in self.titles)
+        self._search_titles = lowered
+
+    def title(self, book):
+        return self.titles[self.title_offsets[book]:self.title_offsets[book + 1]]
+
+    def author(self, book):
+        author = self.book_author[book]
+        return self.authors[self.author_offsets[author]:self.author_offsets[author + 1]]
+
+    def last_read(self):
+        return self._last_read
+
+    def times_read(self, title, author=None):
+        """ Storage.times_read from memory: the first book, in id order, whose title (and author) contain the text """
+        text = title.lower()
+        author_text = author.lower() if author is not None else None
+        start = 0
+        while True:
+            position = self._search_titles.find(text, start)
+            if position < 0:
+                return None
+            book = bisect.bisect_right(self.title_offsets, position) - 1
+            end = self.title_offsets[book + 1]
+            if position + len(text) > end:
+                start = position + 1        # Ran across into the next title
+                continue
+            if author_text is None or author_text in self.author(book).lower():
+                return self.times_read_column[book]
+            start = end
+
+    def count_for_year(self, year):
+        if self._year_counts is None:
+            self._year_counts = Counter(self.reading_year)
+        return self._year_counts.get(int(year), 0)
+
+    def book_summaries(self):
+        """ (id, title, author, last_read_year, last_read_month) of every book, like Storage.book_summaries """
+        return [(self.book_id[book], self.title(book), self.author(book), self.last_read_year[book],
+                 self.months[self.last_read_month[book]]) for book in range(self.books)]
+
+
+class LoadedLibrary(object):
+    """ A tenant's loaded snapshot, and when its version was last checked """
+    def __init__(self):
+        self.library = None
+        self.checked_at = 0.0
+        self.stale = False
+        self.lock = threading.Lock()
+
+
+def remove_snapshot(tenant_id, state):
+    """ Delete the snapshot file of a tenant dropped from loaded, so /tmp holds the files of the
+        TENANT_CACHE_SIZE tenants in it at most. The pages stay mapped until its Library is collected. """
+    try:
+        os.remove(snapshot_path(tenant_id))
+    except OSError:
+        pass
+
+
+# Global snapshots, loaded on first use and kept between warm invocations
+loaded = tenants.PerTenant(LoadedLibrary, evicted=remove_snapshot)
+
+def get_library(storage):
+    """ The loaded snapshot of storage's library, exported and (re)loaded when its version is behind.
+        None when snapshots are turned off. """
+    if not SNAPSHOT_ENABLED:
+        return None
+    state = loaded.get(storage.tenant_id)
+    with state.lock:
+        if state.library is None or state.stale or time.monotonic() - state.checked_at > SNAPSHOT_CHECK_INTERVAL:
+            version = storage.library_version()
+            if state.library is None or state.library.version != version:
+                path = snapshot_path(storage.tenant_id)
+                if read_version(path) != version:
+                    export(storage, path)
+                state.library = Library(path)
+            state.checked_at = time.monotonic()
+            state.stale = False
+        return state.library
+
+
+def library_changed(tenant_id):
+    """ Called by the storage backend after committing a write, so the version is checked on the next read """
+    state = loaded.peek(tenant_id)
+    if state is not None and state.library is not None:
+        state.stale = True
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+# The statements of queries.py in SQLite's dialect, for the embedded storage backend.
+# Same names and parameter order as queries.py, so storage.Storage can run either set.
+# The schema matches the MySQL one: the same tables, keys and indexes, and reading_stats kept up
+# to date by triggers.
+# Text columns compare case-insensitively, like MySQL's default collation.
+from queries import format_mask_sql, like_pattern
+
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS tenants ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "user_id VARCHAR(255) NOT NULL, "
+    "created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+    "CONSTRAINT tenants_user_id UNIQUE (user_id))",
+    "INSERT OR IGNORE INTO tenants (id, user_id) VALUES (1, '')",       # The library from before partitioning, unclaimed
+
+    "CREATE TABLE IF NOT EXISTS books ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "tenant_id INTEGER NOT NULL DEFAULT 1, "
+    "title VARCHAR(100) NOT NULL COLLATE NOCASE, "
+    "author VARCHAR(100) NOT NULL COLLATE NOCASE, "
+    "first_read_year INTEGER NOT NULL, "
+    "first_read_month VARCHAR(10) NULL DEFAULT NULL, "
+    "unsure TINYINT NULL DEFAULT NULL, "
+    "last_read_year INTEGER NOT NULL, "
+    "last_read_month VARCHAR(10) NULL DEFAULT NULL, "
+    "times_read TINYINT NULL DEFAULT NULL, "
+    "format_mask TINYINT NOT NULL DEFAULT 0, "
+    "CONSTRAINT books_title_author UNIQUE (tenant_id, title, author))",
+
+    "CREATE TABLE IF NOT EXISTS read_instances ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "tenant_id INTEGER NOT NULL DEFAULT 1, "
+    "title VARCHAR(100) NOT NULL COLLATE NOCASE, "
+    "author VARCHAR(100) NOT NULL COLLATE NOCASE, "
+    "read_year INTEGER NOT NULL, "
+    "read_month VARCHAR(10) NULL DEFAULT NULL, "
+    "unsure TINYINT NULL DEFAULT NULL, "
+    "read_format VARCHAR(20) NULL DEFAULT NULL, "
+    "read_context TEXT)",
+
+    "CREATE INDEX IF NOT EXISTS read_instances_tenant ON read_instances (tenant_id, id)",
+    "CREATE INDEX IF NOT EXISTS read_instances_title_author ON read_instances (tenant_id, title, author, id)",
+    "CREATE INDEX IF NOT EXISTS read_instances_read_year ON read_instances (tenant_id, read_year, id)",
+    "CREATE INDEX IF NOT EXISTS books_author_title ON books (tenant_id, author, title)",
+
+    "CREATE TABLE IF NOT EXISTS reading_stats ("
+    "tenant_id INTEGER NOT NULL DEFAULT 1, "
+    "read_year INTEGER NOT NULL, "
+    "read_month VARCHAR(10) NOT NULL DEFAULT '', "
+    "read_format VARCHAR(20) NOT NULL DEFAULT '', "
+    "books_read INT NOT NULL DEFAULT 0, "
+    "PRIMARY KEY (tenant_id, read_year, read_month, read_format))",
+
+    "CREATE TABLE IF NOT EXISTS library_version (tenant_id INTEGER NOT NULL PRIMARY KEY, version BIGINT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS applied_writes ("
+    "id CHAR(32) NOT NULL PRIMARY KEY, "
+    "applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)",
+
+    "CREATE TRIGGER IF NOT EXISTS reading_stats_insert AFTER INSERT ON read_instances BEGIN "
+    "INSERT INTO reading_stats (tenant_id, read_year, read_month, read_format, books_read) "
+    "VALUES (NEW.tenant_id, NEW.read_year, IFNULL(NEW.read_month, ''), IFNULL(NEW.read_format, ''), 1) "
+    "ON CONFLICT (tenant_id, read_year, read_month, read_format) DO UPDATE SET books_read = books_read + 1; "
+    "INSERT INTO library_version (tenant_id, version) VALUES (NEW.tenant_id, 1) "
+    "ON CONFLICT (tenant_id) DO UPDATE SET version = version + 1; "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS reading_stats_delete AFTER DELETE ON read_instances BEGIN "
+    "UPDATE reading_stats SET books_read = books_read - 1 "
+    "WHERE tenant_id = OLD.tenant_id AND read_year = OLD.read_year AND read_month = IFNULL(OLD.read_month, '') "
+    "AND read_format = IFNULL(OLD.read_format, ''); "
+    "INSERT INTO library_version (tenant_id, version) VALUES (OLD.tenant_id, 1) "
+    "ON CONFLICT (tenant_id) DO UPDATE SET version = version + 1; "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS reading_stats_update AFTER UPDATE ON read_instances BEGIN "
+    "UPDATE reading_stats SET books_read = books_read - 1 "
+    "WHERE tenant_id = OLD.tenant_id AND read_year = OLD.read_year AND read_month = IFNULL(OLD.read_month, '') "
+    "AND read_format = IFNULL(OLD.read_format, ''); "
+    "INSERT INTO reading_stats (tenant_id, read_year, read_month, read_format, books_read) "
+    "VALUES (NEW.tenant_id, NEW.read_year, IFNULL(NEW.read_month, ''), IFNULL(NEW.read_format, ''), 1) "
+    "ON CONFLICT (tenant_id, read_year, read_month, read_format) DO UPDATE SET books_read = books_read + 1; "
+    "INSERT INTO library_version (tenant_id, version) VALUES (OLD.tenant_id, 1) "
+    "ON CONFLICT (tenant_id) DO UPDATE SET version = version + 1; "
+    "INSERT INTO library_version (tenant_id, version) VALUES (NEW.tenant_id, 1) "
+    "ON CONFLICT (tenant_id) DO UPDATE SET version = version + 1; "
+    "END",
+]
+
+
+# tenants
+TENANT_FOR_USER = "SELECT id FROM tenants WHERE user_id = ?"
+INSERT_TENANT = "INSERT OR IGNORE INTO tenants (user_id) VALUES (?)"
+CLAIM_TENANT = "UPDATE tenants SET user_id = ? WHERE id = ? AND user_id = ''"
+# Merging an unclaimed library into another tenant's (tenants.py claim --force)
+UNCLAIMED_TENANT = "SELECT id FROM tenants WHERE id = ? AND user_id = ''"
+MOVE_TENANT_READINGS = "UPDATE read_instances SET tenant_id = ? WHERE tenant_id = ?"
+DELETE_TENANT_BOOKS = "DELETE FROM books WHERE tenant_id = ?"
+DELETE_TENANT_READING_STATS = "DELETE FROM reading_stats WHERE tenant_id = ?"
+DELETE_TENANT_LIBRARY_VERSION = "DELETE FROM library_version WHERE tenant_id = ?"
+TENANT_SIZES = ("SELECT t.id, t.user_id, COUNT(b.id) FROM tenants t LEFT JOIN books b ON b.tenant_id = t.id "
+                "GROUP BY t.id, t.user_id ORDER BY t.id")
+
+
+# read_instances
+LAST_READ = "SELECT title, author FROM read_instances WHERE id = (SELECT MAX(id) FROM read_instances WHERE tenant_id = ?)"
+LAST_READ_INSTANCE = "SELECT title, author, read_year FROM read_instances WHERE tenant_id = ? ORDER BY id DESC LIMIT 1"
+INSERT_READ_INSTANCE = ("INSERT INTO read_instances (tenant_id, title, author, read_year, read_month, unsure, read_format, read_context) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+DELETE_LAST_READ_INSTANCE = "DELETE FROM read_instances WHERE id = (SELECT MAX(id) FROM read_instances WHERE tenant_id = ?)"
+READINGS_IN_YEAR_PAGE = ("SELECT id, title, author FROM read_instances WHERE tenant_id = ? AND read_year = ? AND id > ? "
+                         "ORDER BY id LIMIT ?")
+
+# reading_stats
+COUNT_FOR_YEAR = "SELECT IFNULL(SUM(books_read), 0) FROM reading_stats WHERE tenant_id = ? AND read_year = ?"
+
+# books
+SELECT_BOOK = ("SELECT id, title, author, first_read_year, first_read_month, unsure, last_read_year, last_read_month, "
+               "times_read, format_mask FROM books WHERE tenant_id = ? AND title = ? AND author = ?")
+BOOK_CONTEXTS = "SELECT read_context FROM read_instances WHERE tenant_id = ? AND title = ? AND author = ? ORDER BY id"
+TIMES_READ_BY_TITLE = "SELECT times_read FROM books WHERE tenant_id = ? AND title LIKE ? ESCAPE '\\'"
+TIMES_READ_BY_TITLE_AND_AUTHOR = ("SELECT times_read FROM books WHERE tenant_id = ? AND title LIKE ? ESCAPE '\\' "
+                                  "AND author LIKE ? ESCAPE '\\'")
+BOOK_SUMMARIES = "SELECT id, title, author, last_read_year, last_read_month FROM books WHERE tenant_id = ?"
+BOOK_SUMMARY = "SELECT id, title, author, last_read_year, last_read_month FROM books WHERE tenant_id = ? AND title = ? AND author = ?"
+BOOKS_BY_AUTHOR_PAGE = "SELECT title, author FROM books WHERE tenant_id = ? AND author = ? AND title > ? ORDER BY title LIMIT ?"
+UPSERT_BOOK = ("INSERT INTO books (tenant_id, title, author, first_read_year, first_read_month, unsure, last_read_year, "
+               "last_read_month, times_read, format_mask) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?) "
+               "ON CONFLICT (tenant_id, title, author) DO UPDATE SET "
+               "times_read = times_read + 1, "
+               "last_read_year = excluded.last_read_year, "
+               "last_read_month = excluded.last_read_month, "
+               "format_mask = format_mask | excluded.format_mask")
+
+# library_version
+LIBRARY_VERSION = "SELECT version FROM library_version WHERE tenant_id = ?"
+BUMP_LIBRARY_VERSION = ("INSERT INTO library_version (tenant_id, version) VALUES (?, 1) "
+                        "ON CONFLICT (tenant_id) DO UPDATE SET version = version + 1")
+INSERT_APPLIED_WRITE = "INSERT OR IGNORE INTO applied_writes (id) VALUES (?)"
+
+def applied_writes_query(count):
+    return "SELECT id FROM applied_writes WHERE id IN ({})".format(", ".join(["?"] * count))
+
+SNAPSHOT_BOOKS = "SELECT id, title, author, times_read, last_read_year, last_read_month FROM books WHERE tenant_id = ? ORDER BY id"
+SNAPSHOT_READINGS = "SELECT title, author, read_year FROM read_instances WHERE tenant_id = ? ORDER BY id"
+
+# Files created before format_mask replaced overall_format and overall_context get the same change
+# as MySQL migration 7 when they're opened (see sqlite_storage.connect)
+UPGRADE_FORMAT_MASK = [
+    "ALTER TABLE books ADD COLUMN format_mask TINYINT NOT NULL DEFAULT 0",
+    "UPDATE books SET format_mask = (SELECT " + format_mask_sql() + " FROM read_instances r "
+    "WHERE r.title = books.title AND r.author = books.author)",
+    "ALTER TABLE books DROP COLUMN overall_format",
+    "ALTER TABLE books DROP COLUMN overall_context",
+]
+
+# Files created before the libraries were partitioned by tenant get the same change as MySQL
+# migration 9. SQLite can't change a table's keys in place, so the tables are renamed out of the
+# way, created again by the schema, and refilled; the triggers recount reading_stats and bump
+# library_version as the readings are copied back. Everything goes to tenant 1, the library from
+# before partitioning.
+UPGRADE_TENANTS = [
+    "CREATE TABLE IF NOT EXISTS library_version (id TINYINT NOT NULL PRIMARY KEY, version BIGINT NOT NULL)",
+    "DROP TRIGGER IF EXISTS reading_stats_insert",
+    "DROP TRIGGER IF EXISTS reading_stats_delete",
+    "DROP TRIGGER IF EXISTS reading_stats_update",
+    "DROP INDEX IF EXISTS read_instances_title_author",
+    "DROP INDEX IF EXISTS read_instances_read_year",
+    "DROP INDEX IF EXISTS books_author_title",
+    "ALTER TABLE books RENAME TO books_before_tenants",
+    "ALTER TABLE read_instances RENAME TO read_instances_before_tenants",
+    "ALTER TABLE library_version RENAME TO library_version_before_tenants",
+    "DROP TABLE IF EXISTS reading_stats",
+    ] + SCHEMA + [
+    "INSERT INTO library_version (tenant_id, version) SELECT 1, version FROM library_version_before_tenants",
+    "INSERT INTO read_instances (id, tenant_id, title, author, read_year, read_month, unsure, read_format, read_context) "
+    "SELECT id, 1, title, author, read_year, read_month, unsure, read_format, read_context "
+    "FROM read_instances_before_tenants ORDER BY id",
+    "INSERT INTO books (id, tenant_id, title, author, first_read_year, first_read_month, unsure, last_read_year, "
+    "last_read_month, times_read, format_mask) "
+    "SELECT id, 1, title, author, first_read_year, first_read_month, unsure, last_read_year, last_read_month, times_read, "
+    "format_mask FROM books_before_tenants",
+    "DROP TABLE books_before_tenants",
+    "DROP TABLE read_instances_before_tenants",
+    "DROP TABLE library_version_before_tenants",
+]
+
+# Files whose triggers are from before they bumped library_version get the same change as MySQL
+# migration 10: the triggers are dropped here and created again by the schema
+UPGRADE_VERSION_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS reading_stats_insert",
+    "DROP TRIGGER IF EXISTS reading_stats_delete",
+    "DROP TRIGGER IF EXISTS reading_stats_update",
+] + SCHEMA
+
+
+def rebuild_books_sql(where=""):
+    """ queries.rebuild_books_sql for SQLite, with the aggregates computed as window functions over each
+        book's readings in id order, keeping the row of its last reading. """
+    return (
+        "INSERT INTO books (tenant_id, title, author, first_read_year, first_read_month, unsure, last_read_year, last_read_month, "
+        "times_read, format_mask) "
+        "SELECT tenant_id, title, author, first_read_year, first_read_month, first_unsure, read_year, read_month, times_read, format_mask "
+        "FROM (SELECT id, tenant_id, title, author, read_year, read_month, "
+        "FIRST_VALUE(read_year) OVER book AS first_read_year, FIRST_VALUE(read_month) OVER book AS first_read_month, "
+        "FIRST_VALUE(unsure) OVER book AS first_unsure, MAX(id) OVER book AS last_id, COUNT(*) OVER book AS times_read, "
+        + format_mask_sql(" OVER book") + " AS format_mask "
+        "FROM read_instances " + where + " "
+        "WINDOW book AS (PARTITION BY tenant_id, title, author ORDER BY id ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)) "
+        "WHERE id = last_id "
+        "ON CONFLICT (tenant_id, title, author) DO UPDATE SET "
+        "first_read_year = excluded.first_read_year, "
+        "first_read_month = excluded.first_read_month, "
+        "unsure = excluded.unsure, "
+        "last_read_year = excluded.last_read_year, "
+        "last_read_month = excluded.last_read_month, "
+        "times_read = excluded.times_read, "
+        "format_mask = excluded.format_mask")
+
+
+REBUILD_BOOKS = rebuild_books_sql()
+REBUILD_TENANT_BOOKS = rebuild_books_sql("WHERE tenant_id = ?")
+REBUILD_BOOK = rebuild_books_sql("WHERE tenant_id = ? AND title = ? AND author = ?")
+DELETE_BOOK_WITHOUT_READINGS = ("DELETE FROM books WHERE tenant_id = ? AND title = ? AND author = ? "
+                                "AND NOT EXISTS (SELECT 1 FROM read_instances WHERE tenant_id = ? AND title = ? AND author = ?)")
+
+
+def times_read_query(tenant_id, title, author=None):
+    """ Statement and parameters looking up how many times a book in the tenant's library was read by (part of) its title """
+    if author is not None:
+        return TIMES_READ_BY_TITLE_AND_AUTHOR, (tenant_id, like_pattern(title), like_pattern(author))
+    return TIMES_READ_BY_TITLE, (tenant_id, like_pattern(title))
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# Embedded SQLite storage backend (STORAGE_BACKEND=sqlite).
+# The whole book database lives in one file next to the function, so requests skip the network
+# round trip to RDS. The file is opened in WAL mode: readers don't block the writer, and a commit
+# appends to the log instead of rewriting pages. WAL needs every process using the file to be on
+# the same host, so a file shared between Lambda containers over EFS should use
+# SQLITE_JOURNAL_MODE=DELETE instead.
+#
+# The statements need SQLite 3.35 or later (the library Python's sqlite3 module is linked against,
+# not the Python version): upserts with ON CONFLICT ... DO UPDATE, window functions, and the
+# ALTER TABLE ... DROP COLUMN that upgrades older files.
+import os
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+
+import telemetry
+import sqlite_queries
+
+from storage import Storage
+
+
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "/tmp/books.db")
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_BUSY_TIMEOUT = int(os.environ.get("SQLITE_BUSY_TIMEOUT", "5000"))    # Milliseconds to wait for another writer
+
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+
+def check_sqlite_version(version_info=sqlite3.sqlite_version_info):
+    """ Raise if the SQLite library is too old for the statements in sqlite_queries """
+    if version_info < MIN_SQLITE_VERSION:
+        raise RuntimeError("The SQLite backend needs SQLite {} or later; Python's sqlite3 module is using {}".format(
+            ".".join(map(str, MIN_SQLITE_VERSION)), ".".join(map(str, version_info))))
+
+
+def table_columns(connection, table):
+    return [row[1] for row in connection.execute("PRAGMA table_info({})".format(table))]
+
+
+def trigger_sql(connection, name):
+    row = connection.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)).fetchone()
+    return row[0] if row else ""
+
+
+def upgrade(connection, statements):
+    """ Run the statements of a schema upgrade in one transaction """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in statements:
+            connection.execute(statement)
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+def connect(path=SQLITE_PATH):
+    """ Open the database file, creating the schema if it isn't there yet """
+    # Autocommit mode: transactions are started explicitly, so reads never hold a write lock
+    connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode = {}".format(SQLITE_JOURNAL_MODE))
+    connection.execute("PRAGMA synchronous = NORMAL")     # In WAL mode, durable at checkpoints rather than every commit
+    connection.execute("PRAGMA busy_timeout = {}".format(SQLITE_BUSY_TIMEOUT))
+    # Files made by earlier versions are brought up to date before the schema is checked
+    if "overall_format" in table_columns(connection, "books"):
+        upgrade(connection, sqlite_queries.UPGRADE_FORMAT_MASK)
+    columns = table_columns(connection, "read_instances")
+    if columns and "tenant_id" not in columns:
+        upgrade(connection, sqlite_queries.UPGRADE_TENANTS)
+    if columns and "library_version" not in trigger_sql(connection, "reading_stats_insert"):
+        upgrade(connection, sqlite_queries.UPGRADE_VERSION_TRIGGERS)
+    for statement in sqlite_queries.SCHEMA:
+        connection.execute(statement)
+    return connection
+
+
+class SQLiteDatabase(object):
+    """ One connection to the database file, opened on first use and kept between warm invocations.
+        Requests, whichever library they're for, take turns on it. """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._connection = None
+
+    def connection(self):
+        if self._connection is None:
+            self._connection = connect(self.path)
+        return self._connection
+
+    def close(self):
+        with self.lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class SQLiteStorage(Storage):
+    """ The book database in a local SQLite file. Views of it bound to other tenants (for_tenant)
+        share its connection. """
+    queries = sqlite_queries
+
+    def __init__(self, path=SQLITE_PATH):
+        check_sqlite_version()
+        self.path = path
+        self.database = SQLiteDatabase(path)
+
+    @contextmanager
+    def session(self):
+        with self.database.lock:
+            cursor = self.database.connection().cursor()
+            try:
+                yield telemetry.instrument(cursor)
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        with self.database.lock:
+            cursor = self.database.connection().cursor()
+            # IMMEDIATE takes the write lock up front, so two writers can't both read and then deadlock upgrading
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield telemetry.instrument(cursor)
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            else:
+                cursor.execute("COMMIT")
+            finally:
+                cursor.close()
+
+    def close(self):
+        self.database.close()
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+# Storage backends for the book database.
+# The intent handlers talk to a Storage object instead of running SQL themselves. The reading and
+# writing logic lives in Storage, written against a module of SQL statements (queries for MySQL,
+# sqlite_queries for SQLite); each backend supplies the statements and a way to get a cursor.
+#
+#   STORAGE_BACKEND=mysql     The RDS database, through the connection pool in database.py (default)
+#   STORAGE_BACKEND=sqlite    An embedded SQLite file at SQLITE_PATH (see sqlite_storage.py)
+#
+# A Storage object works on one tenant's library (see tenants.py). get_storage() returns the backend
+# bound to tenant 1; the handlers use get_storage().for_user(user id) for the user making the request.
+import os
+import copy
+import datetime
+
+from contextlib import contextmanager
+
+import cache
+import queries
+import database
+import tenants
+import snapshot
+import title_index
+
+from converters import format_mask_converter, overall_format_from_mask, context_separator
+
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mysql")
+
+
+class Storage(object):
+    """ The operations the intent handlers need. Reads are answered from the library snapshot when
+        it's turned on, and otherwise go through the query cache and title index; writes run in one
+        transaction and then invalidate what they changed.
+
+        Subclasses set queries and implement session() and transaction(), both context managers
+        yielding a cursor with execute(sql, params), fetchone() and fetchall(). """
+    queries = None
+    tenant_id = tenants.DEFAULT_TENANT
+
+    def session(self):
+        raise NotImplementedError
+
+    def transaction(self):
+        """ Like session(), but everything run on the cursor is committed together at the end of
+            the block, or rolled back if it raises """
+        raise NotImplementedError
+
+    def fetchall(self, sql, params=()):
+        with self.session() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def fetchone(self, sql, params=()):
+        rows = self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+    # Tenants
+    def for_tenant(self, tenant_id):
+        """ This backend bound to tenant_id's library, sharing its connections """
+        bound = copy.copy(self)
+        bound.tenant_id = tenant_id
+        return bound
+
+    def for_user(self, user_id):
+        """ This backend bound to the library of the Alexa user user_id """
+        return self.for_tenant(tenants.tenant_for_user(self, user_id))
+
+    def find_or_create_tenant(self, user_id):
+        row = self.fetchone(self.queries.TENANT_FOR_USER, (user_id,))
+        if row is None:
+            with self.transaction() as cursor:
+                cursor.execute(self.queries.INSERT_TENANT, (user_id,))
+                cursor.execute(self.queries.TENANT_FOR_USER, (user_id,))
+                row = cursor.fetchone()
+        return row[0]
+
+    def claim_default_tenant(self, user_id):
+        """ Give tenant 1, the library from before partitioning, to the user. False if it already has
+            one, or the user has a tenant of their own. """
+        if self.fetchone(self.queries.TENANT_FOR_USER, (user_id,)) is not None:
+            return False
+        with self.transaction() as cursor:
+            cursor.execute(self.queries.CLAIM_TENANT, (user_id, tenants.DEFAULT_TENANT))
+            return cursor.rowcount == 1
+
+    def merge_default_tenant(self, user_id):
+        """ Move tenant 1, the library from before partitioning, into the library the user already has,
+            leaving tenant 1 empty and unclaimed. The user keeps their tenant_id, so the containers that
+            have it cached stay right. Returns that tenant_id, or None if tenant 1 is claimed or the user
+            has no tenant. """
+        row = self.fetchone(self.queries.TENANT_FOR_USER, (user_id,))
+        if row is None:
+            return None
+        tenant_id = row[0]
+        with self.transaction() as cursor:
+            # Locked, so a claim running at the same time waits for the merge
+            cursor.execute(self.queries.UNCLAIMED_TENANT, (tenants.DEFAULT_TENANT,))
+            if cursor.fetchone() is None:
+                return None
+            # The triggers move the reading_stats counts over with the readings, and bump the version
+            cursor.execute(self.queries.MOVE_TENANT_READINGS, (tenant_id, tenants.DEFAULT_TENANT))
+            cursor.execute(self.queries.DELETE_TENANT_BOOKS, (tenants.DEFAULT_TENANT,))
+            cursor.execute(self.queries.REBUILD_TENANT_BOOKS, (tenant_id,))
+            cursor.execute(self.queries.DELETE_TENANT_READING_STATS, (tenants.DEFAULT_TENANT,))
+            cursor.execute(self.queries.DELETE_TENANT_LIBRARY_VERSION, (tenants.DEFAULT_TENANT,))
+        return tenant_id
+
+    def library_version(self):
+        row = self.fetchone(self.queries.LIBRARY_VERSION, (self.tenant_id,))
+        return row[0] if row else 0
+
+    # Keep-warm
+    def warm_statements(self):
+        """ (sql, params) of the statements the read intents run, with parameters for this library """
+        year = datetime.datetime.now().year
+        return [
+            (self.queries.TENANT_FOR_USER, ("",)),
+            (self.queries.LAST_READ, (self.tenant_id,)),
+            (self.queries.LAST_READ_INSTANCE, (self.tenant_id,)),
+            (self.queries.COUNT_FOR_YEAR, (self.tenant_id, year)),
+            (self.queries.LIBRARY_VERSION, (self.tenant_id,)),
+            self.queries.times_read_query(self.tenant_id, "keep warm"),
+            self.queries.times_read_query(self.tenant_id, "keep warm", "keep warm"),
+            (self.queries.BOOK_SUMMARY, (self.tenant_id, "", "")),
+            (self.queries.SELECT_BOOK, (self.tenant_id, "", "")),
+            (self.queries.BOOK_CONTEXTS, (self.tenant_id, "", "")),
+            (self.queries.READINGS_IN_YEAR_PAGE, (self.tenant_id, year, 0, 1)),
+            (self.queries.BOOKS_BY_AUTHOR_PAGE, (self.tenant_id, "", "", 1)),
+            ]
+
+    def warm(self, connections=1):
+        """ Open the connection, or check it's still open, and run warm_statements() on it ahead of
+            the next request. Returns the number of connections warmed. """
+        with self.session() as cursor:
+            for sql, params in self.warm_statements():
+                cursor.execute(sql, params)
+                cursor.fetchall()
+        return 1
+
+    # Reads
+    def last_read(self):
+        """ (title, author) of the last reading added, or None """
+        library = snapshot.get_library(self)
+        if library is not None:
+            return library.last_read()
+        rows = cache.cached_fetchall(self.queries.LAST_READ, (self.tenant_id,), [cache.last_read_tag(self.tenant_id)], self.fetchall)
+        return tuple(rows[0]) if rows else None
+
+    def times_read(self, title, author=None):
+        """ times_read of the first book whose title (and author, if given) contains the text, or None """
+        library = snapshot.get_library(self)
+        if library is not None:
+            return library.times_read(title, author)
+        sql, params = self.queries.times_read_query(self.tenant_id, title, author)
+        rows = cache.cached_fetchall(sql, params, [cache.title_contains_tag(self.tenant_id, title)], self.fetchall)
+        return rows[0][0] if rows else None
+
+    def count_for_year(self, year):
+        library = snapshot.get_library(self)
+        if library is not None:
+            return library.count_for_year(year)
+        rows = cache.cached_fetchall(self.queries.COUNT_FOR_YEAR, (self.tenant_id, year), [cache.year_tag(self.tenant_id, year)],
+                                     self.fetchall)
+        return rows[0][0]
+
+    def last_time_read(self, title):
+        """ (title, last_read_year, last_read_month) of the closest matching books, best match first """
+        return title_index.search(title, self)
+
+    def book_summaries(self):
+        """ (id, title, author, last_read_year, last_read_month) of every book, for the title index """
+        library = snapshot.get_library(self)
+        if library is not None:
+            return library.book_summaries()
+        return self.fetchall(self.queries.BOOK_SUMMARIES, (self.tenant_id,))
+
+    def book_summary(self, title, author):
+        return self.fetchone(self.queries.BOOK_SUMMARY, (self.tenant_id, title, author))
+
+    def book(self, title, author):
+        """ The book's row - (title, author, first_read_year, first_read_month, unsure, last_read_year,
+            last_read_month, times_read, overall_format, overall_context) - or None. The overall format and
+            context are derived from its format_mask and its readings' contexts. """
+        with self.session() as cursor:
+            cursor.execute(self.queries.SELECT_BOOK, (self.tenant_id, title, author))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute(self.queries.BOOK_CONTEXTS, (self.tenant_id, title, author))
+            contexts = [context or "" for context, in cursor.fetchall()]
+        return tuple(row[1:9]) + (overall_format_from_mask(row[9]), context_separator.join(contexts))
+
+    # Browsing, a page at a time. Not cached: each page is normally asked for once.
+    def readings_in_year(self, year, after_id, limit):
+        """ (id, title, author) of up to limit readings in year with an id above after_id, in the order they were added """
+        return self.fetchall(self.queries.READINGS_IN_YEAR_PAGE, (self.tenant_id, year, after_id, limit))
+
+    def books_by_author(self, author, after_title, limit):
+        """ (title, author) of up to limit books by author with a title after after_title, in title order """
+        return self.fetchall(self.queries.BOOKS_BY_AUTHOR_PAGE, (self.tenant_id, author, after_title, limit))
+
+    # Writes
+    def add_read_instance(self, title, author, year, month, unsure, read_format, context):
+        """ Add a reading, and add its book or update it in place: the same size of write on every reread """
+        with self.transaction() as cursor:
+            self.insert_reading(cursor, title, author, year, month, unsure, read_format, context)
+        self.changed(title, author, year)
+
+    def insert_reading(self, cursor, title, author, year, month, unsure, read_format, context):
+        cursor.execute(self.queries.INSERT_READ_INSTANCE, (self.tenant_id, title, author, year, month, unsure, read_format, context))
+        cursor.execute(self.queries.UPSERT_BOOK, (self.tenant_id, title, author, year, month, unsure, year, month,
+                                                  format_mask_converter(read_format)))
+
+    def apply_queued_readings(self, entries):
+        """ Add readings queued by write_behind, in order, in one transaction. Each goes to the library
+            of the tenant it was queued for. An entry whose id was applied before (by a drain that was
+            interrupted before it could delete it from the queue) is skipped. Returns the entries applied now. """
+        applied = []
+        with self.transaction() as cursor:
+            for entry in entries:
+                cursor.execute(self.queries.INSERT_APPLIED_WRITE, (entry["id"],))
+                if cursor.rowcount == 0:
+                    continue
+                self.for_tenant(entry["tenant_id"]).insert_reading(cursor, entry["title"], entry["author"], entry["year"],
+                                                                   entry["month"], entry["unsure"], entry["read_format"],
+                                                                   entry["context"])
+                applied.append(entry)
+        for entry in applied:
+            self.for_tenant(entry["tenant_id"]).changed(entry["title"], entry["author"], entry["year"])
+        return applied
+
+    def applied_write_ids(self, ids):
+        """ The ones among ids of queued writes that have been applied """
+        return {row[0] for row in self.fetchall(self.queries.applied_writes_query(len(ids)), tuple(ids))}
+
+    def delete_last_read_instance(self):
+        """ Delete the last reading added, and recompute its book from the readings left.
+            Returns its (title, author), or None if there are no readings. """
+        with self.transaction() as cursor:
+            cursor.execute(self.queries.LAST_READ_INSTANCE, (self.tenant_id,))
+            last_read_instance = cursor.fetchone()
+            if last_read_instance is None:
+                return None
+            title, author, year = last_read_instance
+            cursor.execute(self.queries.DELETE_LAST_READ_INSTANCE, (self.tenant_id,))
+            self.recompute_book(cursor, title, author)
+        self.changed(title, author, year)
+        return title, author
+
+    def recompute_book(self, cursor, title, author):
+        """ Rebuild the book's row from its readings in one grouped statement, or delete the row if it
+            has no readings left - the only case where the rebuild touches no rows. """
+        cursor.execute(self.queries.REBUILD_BOOK, (self.tenant_id, title, author))
+        if cursor.rowcount == 0:
+            cursor.execute(self.queries.DELETE_BOOK_WITHOUT_READINGS, (self.tenant_id, title, author, self.tenant_id, title, author))
+
+    def changed(self, title, author, year):
+        """ Called after a reading of title/author in year was committed or deleted """
+        cache.invalidate_reading(self.tenant_id, title, author, year)
+        title_index.book_changed(self.tenant_id, title, author)
+        snapshot.library_changed(self.tenant_id)
+
+
+class MySQLStorage(Storage):
+    """ The RDS MySQL database, through the pooled connections and prepared statements in database.py """
+    queries = queries
+
+    @contextmanager
+    def session(self):
+        with database.checkout() as (mydb, cursor):
+            yield cursor
+
+    @contextmanager
+    def transaction(self):
+        with database.checkout() as (mydb, cursor), database.transaction(mydb):
+            yield cursor
+
+    def warm(self, connections=1):
+        """ Open or re-establish up to connections pooled connections, and prepare warm_statements() on each """
+        return database.get_pool().warm(connections, self.warm_statements())
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == "mysql":
+        return MySQLStorage()
+    if backend == "sqlite":
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage()
+    raise ValueError("Unknown STORAGE_BACKEND {!r}".format(backend))
+
+
+# Global backend, created on first use
+storage = None
+
+def get_storage():
+    global storage
+    if storage is None:
+        storage = create_storage()
+    return storage
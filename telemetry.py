@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+# Per-request latency metrics for the skill.
+# The request interceptor in lambda_function starts timing each sampled request, the database
+# layer wraps the request's cursor to time every SQL statement, and the response interceptor (or
+# the exception handler) writes one line of JSON per request in CloudWatch Embedded Metric Format, which CloudWatch turns into
+# metrics straight from the Lambda log:
+#
+#   {"_aws": {...}, "Intent": "GetLastReadIntent", "Duration": 41.7, "SqlStatements": 2, "SqlTime": 12.3, ...}
+#
+# Requests that aren't sampled (METRICS_SAMPLE_RATE=0 turns sampling off) cost one random()
+# call in the interceptor and a None check per checkout - their cursors aren't wrapped at all.
+import os
+import sys
+import json
+import time
+import random
+import logging
+import threading
+import contextvars
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", "1"))    # Fraction of requests measured, 0 to 1
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "BookSkill")
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "0"))                 # Log sampled statements slower than this; 0 = off
+
+# Metric name -> CloudWatch unit
+METRICS = [
+    ("Duration", "Milliseconds"),
+    ("SqlStatements", "Count"),
+    ("SqlTime", "Milliseconds"),
+    ("CheckoutTime", "Milliseconds"),
+    ("ConnectionsReused", "Count"),
+    ("ConnectionsOpened", "Count"),
+    ("Reconnects", "Count"),
+    ("ColdStart", "Count"),
+    ("WarmStart", "Count"),
+    ]
+
+
+class RequestMetrics(object):
+    """ Measurements for one sampled request. """
+    def __init__(self, intent):
+        self.intent = intent
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.sql_time = 0.0
+        self.pool_before = pool_counters()
+        self._lock = threading.Lock()
+
+    def record_statement(self, sql, seconds):
+        with self._lock:
+            self.statements += 1
+            self.sql_time += seconds
+        if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+            # The statement text only - parameters are the user's own words and stay out of the log
+            emit({"SlowQuery": " ".join(sql.split()), "Intent": self.intent, "SqlTime": round(seconds * 1000, 3)})
+
+    def as_record(self, error=None):
+        """ The EMF log record for this request """
+        pool_after = pool_counters()
+        pool = {name: pool_after[name] - self.pool_before[name] for name in pool_after}
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Intent"]],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, unit in METRICS],
+                    }],
+                },
+            "Intent": self.intent,
+            "ColdStart": int(cold_start),
+            "WarmStart": int(not cold_start),
+            "Duration": round((time.perf_counter() - self.start) * 1000, 3),
+            "SqlStatements": self.statements,
+            "SqlTime": round(self.sql_time * 1000, 3),
+            "CheckoutTime": round(pool["checkout_time"] * 1000, 3),
+            "ConnectionsReused": pool["hits"],
+            "ConnectionsOpened": pool["misses"],
+            "Reconnects": pool["reconnects"],
+            }
+        if error:
+            record["Error"] = error
+        return record
+
+
+class InstrumentedCursor(object):
+    """ Wraps a request's StatementCache, timing each statement into the request's metrics. """
+    def __init__(self, cursor, metrics):
+        self._cursor = cursor
+        self._metrics = metrics
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params)
+        finally:
+            self._metrics.record_statement(sql, time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def pool_counters():
+    """ The pool's running totals, or zeros if no request has used the database yet """
+    import database     # database imports this module to instrument its cursors
+    stats = database.pool.stats if database.pool is not None else database.PoolStats()
+    return {"hits": stats.hits, "misses": stats.misses, "reconnects": stats.reconnects,
+            "checkout_time": stats.checkout_time}
+
+
+def emit(record):
+    """ Write one record as a single JSON line on stdout. EMF records must be bare JSON,
+        without the prefix the Lambda log handler puts in front of logger output. """
+    sys.stdout.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+# Metrics for the request being handled, or None if it isn't sampled. A context variable rather than
+# a plain global so concurrent requests (e.g. in the load test) each see their own; async_storage
+# runs fanned-out calls in the caller's context so their statements are counted too.
+current = contextvars.ContextVar("current_request_metrics", default=None)
+cold_start = True      # Until the container has finished its first request or keep-warm ping
+
+
+def request_name(handler_input):
+    request = handler_input.request_envelope.request
+    if request.object_type == "IntentRequest":
+        return request.intent.name
+    return request.object_type
+
+
+def start_request(handler_input):
+    if METRICS_SAMPLE_RATE > 0 and random.random() < METRICS_SAMPLE_RATE:
+        current.set(RequestMetrics(request_name(handler_input)))
+    else:
+        current.set(None)
+
+
+def start_event(name):
+    """ Measure an event that isn't an Alexa request (e.g. a keep-warm ping) like one, whatever the
+        sample rate. Its record has name in place of the intent. """
+    current.set(RequestMetrics(name))
+
+
+def finish_request(error=None):
+    """ Emit the current request's metrics, if it was sampled. Safe to call more than once. """
+    global cold_start
+    metrics = current.get()
+    current.set(None)
+    if metrics is not None:
+        try:
+            emit(metrics.as_record(error))
+        except Exception:
+            logger.warning("Could not emit request metrics", exc_info=True)
+    cold_start = False
+
+
+def instrument(cursor):
+    """ cursor, wrapped to time its statements if the current request is sampled """
+    metrics = current.get()
+    if metrics is None:
+        return cursor
+    return InstrumentedCursor(cursor, metrics)
+
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# Tenants: one library per Alexa user.
+# Every table holding a library (books, read_instances, reading_stats, library_version) has a
+# tenant_id column leading each of its keys, so one user's lookups are index range reads over their
+# own rows however many other users share the database. The tenants table maps the Alexa user id
+# (a string of 200 or so characters) to the 4-byte tenant_id; a user gets one on their first request.
+#
+# Tenant 1 is the library from before partitioning (see migration 9). It has no user until claimed:
+#
+#   python tenants.py claim <Alexa user id>            Give the library from before partitioning to this user
+#   python tenants.py claim <Alexa user id> --force    The same, or if they already have a library,
+#                                                      merge it into theirs
+#   python tenants.py list                             Tenants and the number of books in each library
+#
+# Claim before the owner's first request after the upgrade, or they'll have been given a new library
+# of their own. Then --force moves tenant 1's readings into that library and rebuilds its books,
+# leaving tenant 1 empty; the user keeps their tenant_id, so no container's cached mapping goes wrong.
+# The command-line tools (importer.py, benchmarks) work on tenant 1 unless told otherwise, so after
+# a merge give them --user.
+import os
+import sys
+import threading
+
+from collections import OrderedDict
+
+
+DEFAULT_TENANT = 1
+TENANT_CACHE_SIZE = int(os.environ.get("TENANT_CACHE_SIZE", "32"))     # Tenants whose title index and snapshot a container keeps
+
+
+class PerTenant(object):
+    """ State kept in memory for each of the most recently used tenants, created by create() on
+        first use. Past size tenants, the least recently used one's state is dropped, and passed to
+        evicted(tenant_id, state) if given, to release what it holds outside the process. """
+    def __init__(self, create, size=TENANT_CACHE_SIZE, evicted=None):
+        self.create = create
+        self.size = size
+        self.evicted = evicted
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id):
+        with self._lock:
+            entry = self._entries.get(tenant_id)
+            if entry is None:
+                entry = self._entries[tenant_id] = self.create()
+                while len(self._entries) > self.size:
+                    # Under the lock, so it's done before the tenant's state can be created again
+                    evicted_id, evicted_entry = self._entries.popitem(last=False)
+                    if self.evicted:
+                        self.evicted(evicted_id, evicted_entry)
+            else:
+                self._entries.move_to_end(tenant_id)
+            return entry
+
+    def tenant_ids(self):
+        """ The tenants with state, least recently used first """
+        with self._lock:
+            return list(self._entries)
+
+    def peek(self, tenant_id):
+        """ The tenant's state if it's loaded, without creating it or counting it as a use """
+        return self._entries.get(tenant_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Alexa user id -> tenant_id, for the users this container has seen. The mapping never changes.
+tenant_ids = {}
+MAX_TENANT_IDS = 10000
+
+
+def tenant_for_user(storage, user_id):
+    """ The user's tenant_id, created on their first request """
+    tenant_id = tenant_ids.get(user_id)
+    if tenant_id is None:
+        tenant_id = storage.find_or_create_tenant(user_id)
+        if len(tenant_ids) > MAX_TENANT_IDS:
+            tenant_ids.clear()
+        tenant_ids[user_id] = tenant_id
+    return tenant_id
+
+
+def main(argv):
+    from storage import get_storage
+
+    storage = get_storage()
+    command = argv[1] if len(argv) > 1 else "list"
+    if command == "claim":
+        user_id = argv[2]
+        if storage.claim_default_tenant(user_id):
+            print("Tenant {} now belongs to {}".format(DEFAULT_TENANT, user_id))
+        elif "--force" in argv[3:]:
+            tenant_id = storage.merge_default_tenant(user_id)
+            if tenant_id is None:
+                print("Not merged: the library is already claimed, or that user has no library yet")
+                return 1
+            print("Tenant {} was merged into tenant {}, which belongs to {}".format(DEFAULT_TENANT, tenant_id, user_id))
+        else:
+            print("Not claimed: the library is already claimed, or that user already has one of their own "
+                  "(--force merges it into theirs)")
+            return 1
+    else:
+        for tenant_id, user_id, books in storage.fetchall(storage.queries.TENANT_SIZES):
+            print("{:>8}  {:>8} books  {}".format(tenant_id, books, user_id or "(unclaimed)"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+# The modules live at the top of the repository, and the scenarios the tests share with the
+# benchmark scripts in benchmarks/
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+# Conformance of the storage backends: the scenario from benchmarks/storage_backends.py, run against
+# each one. SQLite runs on a temporary file. MySQL runs when DB_HOST is set and the database can be
+# reached - point the DB_* settings at an empty scratch database, since the scenario adds readings
+# (and deletes them again).
+#
+#   python -m pytest tests
+import os
+
+import pytest
+
+import storage_backends
+
+from sqlite_storage import SQLiteStorage
+
+
+def sqlite_storage(tmp_path):
+    return SQLiteStorage(str(tmp_path / "books.db"))
+
+
+def mysql_storage(tmp_path):
+    if not os.environ.get("DB_HOST"):
+        pytest.skip("DB_HOST isn't set - point DB_* at an empty scratch database to check MySQL")
+    from storage import MySQLStorage
+    storage = MySQLStorage()
+    try:
+        storage.last_read()
+    except Exception as error:
+        pytest.skip("MySQL isn't reachable: {}".format(error))
+    return storage
+
+
+@pytest.mark.parametrize("create_storage", [sqlite_storage, mysql_storage], ids=["sqlite", "mysql"])
+def test_conformance(create_storage, tmp_path):
+    storage = create_storage(tmp_path)
+    assert storage_backends.check_conformance(storage) == []
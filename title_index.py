@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# In-memory search index over book titles, for matching spoken titles.
+# Titles are normalized (lowercased, punctuation and accents removed, articles dropped) and indexed
+# by word and by character trigram. A spoken title is looked up through those postings instead of
+# running a backtracking REGEXP over every row of the books table.
+#
+# The index is loaded from the books table (through the storage backend) on first use and kept between warm invocations.
+# Books changed by this container's writes are re-read individually; the whole index is reloaded
+# after TITLE_INDEX_TTL seconds to pick up writes from other containers.
+# Each tenant's library has its own index, kept for the TENANT_CACHE_SIZE tenants used most recently.
+import os
+import re
+import time
+import unicodedata
+
+from collections import defaultdict
+
+import tenants
+
+
+TITLE_INDEX_TTL = float(os.environ.get("TITLE_INDEX_TTL", "300"))
+
+ARTICLES = {"the", "a", "an"}
+
+
+def normalize_title(title):
+    """ "The Hitchhiker's Guide to the Galaxy!" -> "hitchhikers guide to galaxy" """
+    title = unicodedata.normalize("NFKD", title).encode("ascii", "ignore").decode("ascii").lower()
+    title = title.replace("'", "")
+    words = re.findall(r"[a-z0-9]+", title)
+    return " ".join(word for word in words if word not in ARTICLES)
+
+
+def trigrams(normalized):
+    padded = "  " + normalized + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex(object):
+    """ Word and trigram postings over normalized titles.
+
+        search() ranks matches in three tiers:
+          1. the normalized title equals the spoken one
+          2. the title contains every spoken word (closest titles first)
+          3. the titles sharing the most trigrams with the spoken one (for misheard words),
+             if they're similar enough
+    """
+    MIN_SIMILARITY = 0.5
+
+    def __init__(self):
+        self.books = {}                     # id -> (title, author, last_read_year, last_read_month)
+        self.normalized = {}                # id -> normalized title
+        self.gram_counts = {}               # id -> number of distinct trigrams in the normalized title
+        self.ids_by_key = {}                # (title, author) -> id
+        self.exact = defaultdict(set)       # normalized title -> ids
+        self.words = defaultdict(set)       # word -> ids
+        self.grams = defaultdict(set)       # trigram -> ids
+
+    def add(self, book_id, title, author, last_read_year, last_read_month):
+        self.remove(book_id)
+        normalized = normalize_title(title)
+        self.books[book_id] = (title, author, last_read_year, last_read_month)
+        self.normalized[book_id] = normalized
+        self.ids_by_key[(title, author)] = book_id
+        self.exact[normalized].add(book_id)
+        for word in normalized.split():
+            self.words[word].add(book_id)
+        grams = trigrams(normalized)
+        self.gram_counts[book_id] = len(grams)
+        for gram in grams:
+            self.grams[gram].add(book_id)
+
+    def remove(self, book_id):
+        if book_id not in self.books:
+            return
+        title, author = self.books[book_id][:2]
+        normalized = self.normalized.pop(book_id)
+        del self.books[book_id]
+        del self.gram_counts[book_id]
+        self.ids_by_key.pop((title, author), None)
+        self.exact[normalized].discard(book_id)
+        for word in normalized.split():
+            self.words[word].discard(book_id)
+        for gram in trigrams(normalized):
+            self.grams[gram].discard(book_id)
+
+    def search(self, spoken_title, limit=3):
+        """ Best matching books as (title, last_read_year, last_read_month) rows, best first """
+        query = normalize_title(spoken_title)
+        if not query:
+            return []
+
+        ids = self.exact.get(query)
+        if ids:
+            return self._rows(sorted(ids), limit)
+
+        # Every spoken word present, rarest word's postings first
+        postings = sorted((self.words.get(word, set()) for word in set(query.split())), key=len)
+        if postings and postings[0]:
+            ids = set(postings[0]).intersection(*postings[1:])
+            if ids:
+                ranked = sorted(ids, key=lambda book_id: (len(self.normalized[book_id]), book_id))
+                return self._rows(ranked, limit)
+
+        # Misheard or partial words: rank by trigram overlap (Dice coefficient)
+        query_grams = trigrams(query)
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for book_id in self.grams.get(gram, ()):
+                shared[book_id] += 1
+        scored = []
+        for book_id, count in shared.items():
+            score = 2.0 * count / (len(query_grams) + self.gram_counts[book_id])
+            if score >= self.MIN_SIMILARITY:
+                scored.append((-score, book_id))
+        scored.sort()
+        return self._rows([book_id for score, book_id in scored], limit)
+
+    def _rows(self, ids, limit):
+        rows = []
+        for book_id in ids[:limit]:
+            title, author, last_read_year, last_read_month = self.books[book_id]
+            rows.append((title, last_read_year, last_read_month))
+        return rows
+
+
+class LoadedIndex(object):
+    """ A tenant's index, when it was loaded, and the books written by this container since """
+    def __init__(self):
+        self.index = None
+        self.loaded_at = 0.0
+        self.changed_books = set()      # (title, author) keys written since they were last read
+
+
+# Global indexes, built on first use so warm invocations don't reload them
+loaded = tenants.PerTenant(LoadedIndex)
+
+
+def get_title_index(storage):
+    """ The loaded index of storage's library, (re)loaded from its book_summaries() and book_summary() as needed """
+    state = loaded.get(storage.tenant_id)
+    if state.index is None or time.monotonic() - state.loaded_at > TITLE_INDEX_TTL:
+        index = TitleIndex()
+        for row in storage.book_summaries():
+            index.add(*row)
+        state.index = index
+        state.loaded_at = time.monotonic()
+        state.changed_books.clear()
+    else:
+        while state.changed_books:
+            title, author = state.changed_books.pop()
+            book_id = state.index.ids_by_key.get((title, author))
+            if book_id is not None:
+                state.index.remove(book_id)
+            row = storage.book_summary(title, author)
+            if row:
+                state.index.add(*row)
+    return state.index
+
+
+def book_changed(tenant_id, title, author):
+    """ Called by the storage backend after committing a write, so the book is re-read on the next search """
+    state = loaded.peek(tenant_id)
+    if state is not None and state.index is not None:
+        state.changed_books.add((title, author))
+
+
+def search(spoken_title, storage, limit=3):
+    return get_title_index(storage).search(spoken_title, limit)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+# Write-behind for AddReadInstance (WRITE_BEHIND=1): the reading is appended to a durable queue and
+# the skill answers straight away, instead of after the database transaction has committed.
+# A drain then adds queued readings to the database in batches, in the order they were queued.
+#
+#   WRITE_QUEUE_URL set      An SQS queue (use a FIFO queue, so readings keep their order)
+#   WRITE_QUEUE_URL unset    A local file at WRITE_QUEUE_PATH standing in for one, e.g. for testing
+#
+# Each entry carries an id, and the tenant_id of the library it goes to. The drain records applied
+# ids in the applied_writes table in the same transaction as the readings, so a batch delivered
+# twice (a drain interrupted before it deleted the batch from the queue, or two drains at once) is
+# only added once. A batch that fails is retried with backoff, then left in the queue for the next drain.
+#
+# Drains run from an SQS event source mapping on the queue (lambda_handler passes the event here),
+# on keep-warm pings, before a delete, and from the command line. They run in the request that
+# asked for them, never on a thread left behind: Lambda freezes a container between invocations,
+# and a drain frozen mid-transaction would hold its locks until the container's next request.
+# A drain can't see every entry (SQS hides ones another consumer has received, and a short poll
+# samples only some of its servers), so before a delete the session's own queued readings are
+# looked up in applied_writes and any still missing are applied directly (see settle()):
+#
+#   python write_behind.py drain       Apply everything queued
+#   python write_behind.py status      Count the entries waiting
+#
+# The session's own queued readings are kept in its session attributes until they're applied, and
+# the read intents add them to what the database says (read-your-writes). Browse Books pages by key
+# through the database, so it settles them first instead.
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import logging
+import threading
+
+from contextlib import contextmanager
+
+from title_index import normalize_title
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+WRITE_BEHIND = os.environ.get("WRITE_BEHIND", "0") == "1"
+WRITE_QUEUE_URL = os.environ.get("WRITE_QUEUE_URL", "")
+WRITE_QUEUE_PATH = os.environ.get("WRITE_QUEUE_PATH", "/tmp/write_queue.jsonl")
+DRAIN_BATCH_SIZE = int(os.environ.get("DRAIN_BATCH_SIZE", "25"))
+DRAIN_RETRIES = int(os.environ.get("DRAIN_RETRIES", "3"))
+DRAIN_BACKOFF = 0.2     # Seconds before the first retry, doubling after each
+
+SESSION_KEY = "pending_readings"
+
+
+class FileQueue(object):
+    """ Stand-in for SQS: entries appended to a local file, one JSON line each, and on disk before
+        send() returns. Deleted entries' ids go to a second file; both are emptied once everything
+        sent has been deleted. Unlike SQS, received entries aren't hidden from other receivers. """
+    def __init__(self, path=WRITE_QUEUE_PATH):
+        self.path = path
+        self.deleted_path = path + ".deleted"
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        """ Exclusive access, from other threads and from other processes (e.g. the drain command) """
+        with self._lock, open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return [line for line in f.read().splitlines() if line]
+        except FileNotFoundError:
+            return []
+
+    def _waiting(self):
+        deleted = set(self._read(self.deleted_path))
+        entries = [json.loads(line) for line in self._read(self.path)]
+        return [entry for entry in entries if entry["id"] not in deleted]
+
+    def _append(self, path, lines):
+        with open(path, "a") as f:
+            f.write("".join(line + "\n" for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def send(self, entry):
+        with self.locked():
+            self._append(self.path, [json.dumps(entry)])
+
+    def receive(self, max_entries):
+        """ [(receipt, entry)] for up to max_entries of the oldest waiting entries """
+        with self.locked():
+            return [(entry["id"], entry) for entry in self._waiting()[:max_entries]]
+
+    def delete(self, receipts):
+        with self.locked():
+            self._append(self.deleted_path, receipts)
+            if not self._waiting():
+                for path in (self.path, self.deleted_path):
+                    open(path, "w").close()
+
+    def count(self):
+        with self.locked():
+            return len(self._waiting())
+
+
+class SQSQueue(object):
+    """ An SQS queue, through boto3 (part of the Lambda runtime) """
+    def __init__(self, url=WRITE_QUEUE_URL):
+        import boto3
+        self.url = url
+        self.client = boto3.client("sqs")
+
+    def send(self, entry):
+        fifo = {"MessageGroupId": "readings", "MessageDeduplicationId": entry["id"]} if self.url.endswith(".fifo") else {}
+        self.client.send_message(QueueUrl=self.url, MessageBody=json.dumps(entry), **fifo)
+
+    def receive(self, max_entries):
+        response = self.client.receive_message(QueueUrl=self.url, MaxNumberOfMessages=min(max_entries, 10), WaitTimeSeconds=0)
+        return [(message["ReceiptHandle"], json.loads(message["Body"])) for message in response.get("Messages", [])]
+
+    def delete(self, receipts):
+        for start in range(0, len(receipts), 10):
+            self.client.delete_message_batch(QueueUrl=self.url, Entries=[
+                {"Id": str(i), "ReceiptHandle": receipt} for i, receipt in enumerate(receipts[start:start + 10])])
+
+    def count(self):
+        attributes = self.client.get_queue_attributes(QueueUrl=self.url, AttributeNames=["ApproximateNumberOfMessages"])
+        return int(attributes["Attributes"]["ApproximateNumberOfMessages"])
+
+
+# Global queue, created on first use
+queue = None
+
+def get_queue():
+    global queue
+    if queue is None:
+        queue = SQSQueue(WRITE_QUEUE_URL) if WRITE_QUEUE_URL else FileQueue(WRITE_QUEUE_PATH)
+    return queue
+
+
+# Ids this container has applied, so it can tell its sessions' readings are in without asking the database
+applied_ids = set()
+MAX_APPLIED_IDS = 10000
+
+
+def apply(storage, entries, retries=DRAIN_RETRIES):
+    """ Add the entries to the database, retrying with backoff. Raises if the last attempt fails. """
+    for attempt in range(retries + 1):
+        try:
+            storage.apply_queued_readings(entries)
+            break
+        except Exception:
+            if attempt == retries:
+                raise
+            logger.warning("Applying %d queued reading(s) failed, retrying", len(entries), exc_info=True)
+            time.sleep(DRAIN_BACKOFF * 2 ** attempt)
+    if len(applied_ids) > MAX_APPLIED_IDS:
+        applied_ids.clear()
+    applied_ids.update(entry["id"] for entry in entries)
+
+
+drain_lock = threading.Lock()
+
+def drain(storage, batch_size=DRAIN_BATCH_SIZE):
+    """ Apply everything waiting in the queue, a batch per transaction. Returns the number of entries. """
+    drained = 0
+    with drain_lock:
+        while True:
+            received = get_queue().receive(batch_size)
+            if not received:
+                return drained
+            apply(storage, [entry for receipt, entry in received])
+            get_queue().delete([receipt for receipt, entry in received])
+            drained += len(received)
+
+
+def enqueue_read_instance(session_attributes, storage, title, author, year, month, unsure, read_format, context):
+    """ Queue a reading to be added to storage's library, and remember it in the session until it's applied """
+    entry = {"id": uuid.uuid4().hex, "tenant_id": storage.tenant_id, "title": title, "author": author, "year": year,
+             "month": month, "unsure": unsure, "read_format": read_format, "context": context}
+    get_queue().send(entry)
+    session_attributes.setdefault(SESSION_KEY, []).append(entry)
+    return entry
+
+
+def is_queue_event(event):
+    """ Whether the Lambda event is a batch from an SQS event source mapping rather than an Alexa request """
+    records = event.get("Records") if isinstance(event, dict) else None
+    return bool(records) and records[0].get("eventSource") == "aws:sqs"
+
+
+def handle_queue_event(event, storage):
+    """ Apply a batch delivered by the event source mapping. Raising leaves it to be redelivered. """
+    apply(storage, [json.loads(record["body"]) for record in event["Records"]])
+    return {"batchItemFailures": []}
+
+
+def settle(session_attributes, storage):
+    """ Drain the queue, then apply directly the session's queued readings the drain didn't get, so a
+        write that depends on them (a delete) finds them in the database. A reading applied here and
+        delivered again later is skipped then, by its id. """
+    drain(storage)
+    pending = pending_readings(session_attributes, storage)
+    if pending:
+        logger.info("Applying %d queued reading(s) of the session the drain didn't receive", len(pending))
+        apply(storage, pending)
+        session_attributes.pop(SESSION_KEY, None)
+
+
+# Read-your-writes
+def pending_readings(session_attributes, storage):
+    """ The session's queued readings not applied yet, oldest first. Applied ones are dropped from the session. """
+    pending = session_attributes.get(SESSION_KEY)
+    if not pending:
+        return []
+    pending = [entry for entry in pending if entry["id"] not in applied_ids]
+    if pending:
+        applied = storage.applied_write_ids([entry["id"] for entry in pending])
+        pending = [entry for entry in pending if entry["id"] not in applied]
+    if pending:
+        session_attributes[SESSION_KEY] = pending
+    else:
+        session_attributes.pop(SESSION_KEY, None)
+    return pending
+
+
+def last_read(pending, last_read):
+    """ (title, author) of the last reading, counting the pending ones """
+    return (pending[-1]["title"], pending[-1]["author"]) if pending else last_read
+
+
+def count_for_year(pending, year, count):
+    return count + sum(1 for entry in pending if str(entry["year"]) == str(year))
+
+
+def times_read(pending, title, author, times_read):
+    """ times_read plus the pending readings of books whose title (and author) contain the text """
+    matching = sum(1 for entry in pending if title.lower() in entry["title"].lower() and
+                   (author is None or author.lower() in entry["author"].lower()))
+    if not matching:
+        return times_read
+    return (times_read or 0) + matching
+
+
+def last_time_read(pending, title, rows):
+    """ (title, read_year, read_month) rows of LastTimeRead, with the newest pending reading of a
+        matching title in place of what the database says about that book """
+    spoken = normalize_title(title)
+    for entry in reversed(pending):
+        if spoken and spoken in normalize_title(entry["title"]):
+            others = [row for row in rows if row[0].lower() != entry["title"].lower()]
+            return [(entry["title"], int(entry["year"]), entry["month"])] + others
+    return rows
+
+
+def main(argv):
+    from storage import get_storage
+
+    command = argv[1] if len(argv) > 1 else "status"
+    if command == "drain":
+        print("{} queued reading(s) applied".format(drain(get_storage())))
+    else:
+        print("{} reading(s) waiting in the queue".format(get_queue().count()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))